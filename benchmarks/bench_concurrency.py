@@ -0,0 +1,195 @@
+# bench_concurrency.py
+# Load test for the serving modes in gunicorn_config.py. Starts a stand-in
+# Corepoint that answers after a fixed delay, runs the real app under
+# gunicorn with sync, threaded and gevent workers in turn, and drives
+# /api/verify with many concurrent clients. Reports throughput, latency and
+# the peak number of Corepoint calls in flight per worker.
+#
+#   python benchmarks/bench_concurrency.py [--latency 0.5] [--clients 50] [--requests 300] [--workers 1]
+#
+# Needs gunicorn and gevent installed, and for the gevent run a Redis server
+# (SESSION_REDIS_URL, default localhost). Runs entirely on localhost; sessions,
+# outbox and bulkhead files go to a temporary directory.
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COREPOINT_REPLY = json.dumps({"IDS": {
+    "MRN": "000123456", "FIN": "987654321012", "ZIP": "37920", "VALID": "true",
+    "ADDRESS": "1924 Alcoa Hwy Apt 4B",
+    "BAD_ADDS": [{"BAD_ADD": "310 Gay St"}, {"BAD_ADD": "5021 Kingston Pike"}],
+}}).encode()
+VERIFY_REQUEST = {"firstName": "Jordan", "lastName": "Example-Patient", "dob": "1984-07-12"}
+
+
+class StandInCorepoint(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), CorepointHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+
+    def reset(self):
+        with self.lock:
+            self.in_flight = 0
+            self.peak = 0
+
+
+class CorepointHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with server.lock:
+            server.in_flight += 1
+            server.peak = max(server.peak, server.in_flight)
+        try:
+            time.sleep(server.latency)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(COREPOINT_REPLY)))
+        self.end_headers()
+        self.wfile.write(COREPOINT_REPLY)
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"gunicorn did not start on port {port}")
+
+
+def start_server(mode, port, workers, clients, upstream_url, workdir, extra_env=None):
+    env = dict(
+        os.environ,
+        SERVER_MODE=mode,
+        WORKER_CONNECTIONS=str(clients),
+        ENV_CP_API_URL=upstream_url,
+        # Let the bulkhead admit as many calls as a gevent worker can hold
+        CP_BULKHEAD_LIMIT=str(clients),
+        CP_POOL_SIZE=str(clients),
+        CP_BULKHEAD_WAIT='30',
+        CP_READ_TIMEOUT='60',
+        BULKHEAD_DIR=os.path.join(workdir, mode, 'bulkhead'),
+        SESSION_CACHE_DIR=os.path.join(workdir, mode, 'sessions'),
+        OUTBOX_PATH=os.path.join(workdir, mode, 'outbox.db'),
+        RATE_LIMIT_PATH=os.path.join(workdir, mode, 'ratelimit.db'),
+        TOKEN_REVOCATION_PATH=os.path.join(workdir, mode, 'revoked.db'),
+        SESSION_STAMP_PATH=os.path.join(workdir, mode, 'session-stamps'),
+        # Every simulated patient comes from 127.0.0.1, often with the same name
+        VERIFY_LIMIT_IP='1000000/60',
+        VERIFY_LIMIT_IDENTITY='1000000/60',
+        **(extra_env or {})
+    )
+    if mode == 'gevent':
+        # gevent workers refuse the filesystem backend (config.py)
+        env['SESSION_BACKEND'] = 'redis'
+    command = [
+        sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn_config.py'),
+        '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+        '--access-logfile', os.devnull, '--error-logfile', os.path.join(workdir, f'{mode}.log'),
+        '--timeout', '120', '--chdir', ROOT, 'sdohapi:app',
+    ]
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for(port)
+    return process
+
+
+def run_load(port, clients, total):
+    url = f'http://127.0.0.1:{port}/api/verify'
+    local = threading.local()
+
+    def one(i):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        # A different patient per request, or the Corepoint memo would answer most of them
+        body = dict(VERIFY_REQUEST, lastName=f"{VERIFY_REQUEST['lastName']}-{i}")
+        response = session.post(url, json=body, headers={'Session-ID': f'load-{i}'}, timeout=120)
+        return response.status_code, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for _, latency in results)
+    return {
+        'ok': sum(1 for status, _ in results if status == 200),
+        'requests': total,
+        'seconds': round(elapsed, 2),
+        'rps': round(total / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.5, help='stand-in Corepoint delay in seconds')
+    parser.add_argument('--clients', type=int, default=50, help='concurrent patients')
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers in both modes')
+    parser.add_argument('--modes', default='sync,threads,gevent')
+    args = parser.parse_args()
+
+    upstream = StandInCorepoint(args.latency)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    upstream_url = f'http://127.0.0.1:{upstream.server_address[1]}/verify'
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in args.modes.split(','):
+            port = free_port()
+            process = start_server(mode, port, args.workers, args.clients, upstream_url, workdir)
+            try:
+                run_load(port, args.clients, min(args.requests, args.clients))  # warm up pools
+                upstream.reset()
+                result = run_load(port, args.clients, args.requests)
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+            result['peak_upstream_in_flight'] = upstream.peak
+            result['in_flight_per_worker'] = round(upstream.peak / args.workers, 1)
+            results[mode] = result
+            print(f"{mode:>7}: {result}")
+
+    print(json.dumps({'latency_s': args.latency, 'clients': args.clients, 'workers': args.workers,
+                      'results': results}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
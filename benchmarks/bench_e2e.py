@@ -0,0 +1,324 @@
+# bench_e2e.py
+# Offline end-to-end benchmark of the patient journey:
+#   GET /api/get-csp-nonce -> POST /api/verify -> POST /api/validate -> POST /api/submit
+# against the real app under gunicorn (gunicorn_config.py), with local
+# stand-ins for Corepoint and Formstack whose latency and error rates are
+# configurable. Reports p50/p95/p99 latency and requests per second per
+# endpoint, and writes everything to a JSON file so runs can be compared.
+#
+#   python benchmarks/bench_e2e.py [--journeys 500] [--concurrency 20] [--mode threads]
+#       [--cp-latency-ms 150] [--cp-jitter-ms 50] [--cp-error-rate 0.01] [--cp-novisit-rate 0.05]
+#       [--fs-latency-ms 400] [--fs-jitter-ms 100] [--fs-error-rate 0.02]
+#       [-o benchmarks/results/e2e.json] [--compare previous.json]
+#
+# Needs gunicorn (and gevent and a Redis server, SESSION_REDIS_URL, for
+# --mode gevent). Nothing leaves localhost.
+import argparse
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+sys.path.insert(0, BENCH)
+
+from bench_concurrency import free_port, start_server  # noqa: E402
+from bench_json import SUBMIT_REQUEST  # noqa: E402
+
+ORIGIN = 'https://sdohtest.utmck.edu'
+ADDRESS = '1924 Alcoa Hwy Apt 4B'
+ENDPOINTS = ('csp_nonce', 'verify', 'validate', 'submit')
+# A lastName starting with one of these forces that Corepoint outcome (used by replay.py)
+NOVISIT_MARKER = 'REPLAY-NOVISIT'
+FAIL_MARKER = 'REPLAY-FAIL'
+
+
+class Upstream:
+    """Latency/error profile for one stand-in upstream."""
+
+    def __init__(self, latency_ms, jitter_ms, error_rate, rng):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.rng = rng
+        self.calls = 0
+        self.errors = 0
+
+    def delay(self):
+        time.sleep(max(0.0, self.rng.gauss(self.latency, self.jitter)))
+
+    def fails(self):
+        failed = self.rng.random() < self.error_rate
+        self.calls += 1
+        self.errors += failed
+        return failed
+
+
+class StandIns(ThreadingHTTPServer):
+    """Corepoint at /corepoint/verify and Formstack at /formstack/form/<id>/submission.json."""
+
+    daemon_threads = True
+
+    def __init__(self, corepoint, formstack, novisit_rate, rng):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.corepoint = corepoint
+        self.formstack = formstack
+        self.novisit_rate = novisit_rate
+        self.rng = rng
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, body):
+        raw = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server = self.server
+        upstream = server.corepoint if self.path.startswith('/corepoint') else server.formstack
+        last_name = ''
+        if upstream is server.corepoint:
+            try:
+                last_name = str(json.loads(raw).get('lastName', ''))
+            except (ValueError, AttributeError):
+                pass
+        with server.lock:
+            failed = upstream.fails() or last_name.startswith(FAIL_MARKER)
+            novisit = server.rng.random() < server.novisit_rate or last_name.startswith(NOVISIT_MARKER)
+        upstream.delay()
+        if failed:
+            return self._reply(503, {'error': 'stand-in failure'})
+        if upstream is server.formstack:
+            return self._reply(201, {'id': str(uuid.uuid4())})
+        if novisit:
+            return self._reply(200, {'IDS': {'VALID': 'false'}})
+        return self._reply(200, {'IDS': {
+            'MRN': '000123456', 'FIN': '987654321012', 'ZIP': '37920', 'VALID': 'true', 'ADDRESS': ADDRESS,
+            'BAD_ADDS': [{'BAD_ADD': '310 Gay St'}, {'BAD_ADD': '5021 Kingston Pike'}],
+        }})
+
+    def log_message(self, *args):
+        pass
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {name: [] for name in ENDPOINTS}
+        self.statuses = {name: {} for name in ENDPOINTS}
+        self.outcomes = {}
+
+    def call(self, endpoint, send):
+        started = time.perf_counter()
+        try:
+            response = send()
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 'error'
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.samples[endpoint].append(elapsed)
+            counts = self.statuses[endpoint]
+            counts[str(status)] = counts.get(str(status), 0) + 1
+        return response
+
+    def outcome(self, name):
+        with self.lock:
+            self.outcomes[name] = self.outcomes.get(name, 0) + 1
+
+
+def journey(base, session, recorder):
+    headers = {'Origin': ORIGIN}
+    recorder.call('csp_nonce', lambda: session.get(f'{base}/api/get-csp-nonce', headers=headers))
+
+    response = recorder.call('verify', lambda: session.post(
+        f'{base}/api/verify', json={'firstName': 'Jordan', 'lastName': f'Example-Patient-{uuid.uuid4().hex[:8]}', 'dob': '1984-07-12'},
+        headers={**headers, 'Session-ID': str(uuid.uuid4())}))
+    if response is None or response.status_code != 200:
+        return recorder.outcome(f'verify_{response.status_code if response is not None else "error"}')
+    verified = response.json()
+
+    response = recorder.call('validate', lambda: session.post(
+        f'{base}/api/validate', json={'address': ADDRESS},
+        headers={**headers, 'Session-ID': verified['session_id'],
+                 'Verification-Token': verified['verificationToken'], 'X-CSP-Nonce': verified['verify_nonce']}))
+    if response is None or response.status_code != 200:
+        return recorder.outcome(f'validate_{response.status_code if response is not None else "error"}')
+    validated = response.json()
+
+    response = recorder.call('submit', lambda: session.post(
+        f'{base}/api/submit', json=SUBMIT_REQUEST,
+        headers={**headers, 'Session-ID': validated['session_id'], 'Validation-Token': validated['validationToken'],
+                 'Idempotency-Key': str(uuid.uuid4())}))
+    if response is None or response.status_code != 202:
+        return recorder.outcome(f'submit_{response.status_code if response is not None else "error"}')
+    recorder.outcome('completed')
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def summarize(recorder, elapsed):
+    endpoints = {}
+    for name in ENDPOINTS:
+        samples = sorted(recorder.samples[name])
+        if not samples:
+            continue
+        endpoints[name] = {
+            'count': len(samples),
+            'rps': round(len(samples) / elapsed, 2),
+            'p50_ms': round(percentile(samples, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(samples, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(samples, 0.99) * 1000, 2),
+            'max_ms': round(samples[-1] * 1000, 2),
+            'statuses': recorder.statuses[name],
+        }
+    return endpoints
+
+
+def outbox_counts(path):
+    # Read straight from the outbox database the workers share
+    try:
+        conn = sqlite3.connect(path, timeout=5)
+        rows = conn.execute('SELECT status, COUNT(*) FROM submissions GROUP BY status').fetchall()
+        conn.close()
+    except sqlite3.Error:
+        return {}
+    return dict(rows)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(previous_path, current):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"vs {previous_path} ({previous.get('commit')}):")
+    for name, stats in current['endpoints'].items():
+        before = previous.get('endpoints', {}).get(name)
+        if not before:
+            continue
+        deltas = ', '.join(f"{key} {before[key]} -> {stats[key]} ({(stats[key] - before[key]) / before[key] * 100:+.1f}%)"
+                           for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms') if before.get(key))
+        print(f"  {name:<10} {deltas}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the patient journey")
+    parser.add_argument('--journeys', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--mode', default='threads', choices=('sync', 'threads', 'gevent'), help='SERVER_MODE')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--cp-latency-ms', type=float, default=150)
+    parser.add_argument('--cp-jitter-ms', type=float, default=50)
+    parser.add_argument('--cp-error-rate', type=float, default=0.01)
+    parser.add_argument('--cp-novisit-rate', type=float, default=0.05, help='share of lookups with no visit')
+    parser.add_argument('--fs-latency-ms', type=float, default=400)
+    parser.add_argument('--fs-jitter-ms', type=float, default=100)
+    parser.add_argument('--fs-error-rate', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--drain-seconds', type=float, default=10, help='time allowed for the outbox to deliver')
+    parser.add_argument('-o', '--output', default=None, help='results JSON (default benchmarks/results/e2e-<time>.json)')
+    parser.add_argument('--compare', default=None, help='previous results JSON to diff against')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corepoint = Upstream(args.cp_latency_ms, args.cp_jitter_ms, args.cp_error_rate, rng)
+    formstack = Upstream(args.fs_latency_ms, args.fs_jitter_ms, args.fs_error_rate, rng)
+    stand_ins = StandIns(corepoint, formstack, args.cp_novisit_rate, rng)
+    threading.Thread(target=stand_ins.serve_forever, daemon=True).start()
+
+    recorder = Recorder()
+    with tempfile.TemporaryDirectory() as workdir:
+        port = free_port()
+        extra_env = {
+            'FS_SUBMISSION_URL': f'{stand_ins.base_url}/formstack/form/{{form_id}}/submission.json',
+            'METRICS_DIR': os.path.join(workdir, 'metrics'),
+            'LOG_HEADERS': 'off',
+            'LOG_BODIES': 'off',
+        }
+        process = start_server(args.mode, port, args.workers, args.concurrency,
+                               f'{stand_ins.base_url}/corepoint/verify', workdir, extra_env)
+        base = f'http://127.0.0.1:{port}'
+        local = threading.local()
+
+        def run(_):
+            session = getattr(local, 'session', None)
+            if session is None:
+                session = local.session = requests.Session()
+            journey(base, session, recorder)
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                list(pool.map(run, range(args.journeys)))
+            elapsed = time.perf_counter() - started
+            outbox_path = os.path.join(workdir, args.mode, 'outbox.db')
+            deadline = time.monotonic() + args.drain_seconds
+            while time.monotonic() < deadline and any(outbox_counts(outbox_path).get(s) for s in ('queued', 'sending')):
+                time.sleep(0.5)
+            outbox = outbox_counts(outbox_path)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    results = {
+        'commit': git_commit(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': vars(args),
+        'seconds': round(elapsed, 2),
+        'journeys_per_second': round(args.journeys / elapsed, 2),
+        'outcomes': recorder.outcomes,
+        'endpoints': summarize(recorder, elapsed),
+        'upstreams': {
+            'corepoint': {'calls': corepoint.calls, 'errors': corepoint.errors},
+            'formstack': {'calls': formstack.calls, 'errors': formstack.errors},
+        },
+        'outbox': outbox,
+    }
+
+    for name, stats in results['endpoints'].items():
+        print(f"{name:<10} n={stats['count']:<6} rps={stats['rps']:<8} p50={stats['p50_ms']:<8} "
+              f"p95={stats['p95_ms']:<8} p99={stats['p99_ms']:<8} {stats['statuses']}")
+    print(f"journeys: {results['outcomes']}  outbox: {outbox}")
+
+    output = args.output or os.path.join(BENCH, 'results', f"e2e-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {output}")
+    if args.compare:
+        compare(args.compare, results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+# bench_json.py
+# Compares the stdlib json module with the app codec (utils/jsoncodec.py) on
+# the payloads this service actually handles: the /api/verify body and
+# Corepoint reply, the /api/submit body and the Formstack payload built from
+# it. Reports CPU time per request for the codec work alone and for a full
+# Flask request/response cycle through each JSON provider.
+#
+#   python benchmarks/bench_json.py [-n 20000]
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask, jsonify, request  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+from utils import jsoncodec  # noqa: E402
+from utils.formstack import PayloadBuilder, SubmissionRecord, SCHEMA_PATH  # noqa: E402
+from utils.scoring import ScoringEngine  # noqa: E402
+
+VERIFY_REQUEST = {"firstName": "Jordan", "lastName": "Example-Patient", "dob": "1984-07-12", "freshen": False}
+COREPOINT_REPLY = {"IDS": {
+    "MRN": "000123456", "FIN": "987654321012", "ZIP": "37920", "VALID": "true",
+    "ADDRESS": "1924 Alcoa Hwy Apt 4B",
+    "BAD_ADDS": [{"BAD_ADD": "310 Gay St"}, {"BAD_ADD": "5021 Kingston Pike"}, {"BAD_ADD": "88 Chapman Hwy"}],
+}}
+SUBMIT_REQUEST = {
+    "participation": "I choose to participate",
+    "housingSecurity": "Yes",
+    "housingCondition": ["Bug infestation", "No or not working smoke detectors", "None of the above"],
+    "foodSecurity": "Sometimes true",
+    "foodAccess": "I choose not to answer",
+    "healthcareAccess": "No",
+    "utilitySecurity": "Yes",
+    "childcareAccess": "I choose not to answer",
+    "occupationAccess": "Yes",
+    "educationAccess": "I choose not to answer",
+    "financialSecurity": "Fairly often",
+    "physicalSecurity": "Sometimes",
+    "emotionalSecurity": "I choose not to answer",
+    "safetySecurity": "Never",
+    "wellbeingSecurity": "Sometimes",
+    "legalStatus": "I choose not to answer",
+    "refugeSecurity": "No",
+    "militaryService": "Never served",
+    "requestHelp": "yes",
+    "sdohConsentProgram": "I agree",
+    "sdohConsentHelp": "I do not agree",
+}
+
+
+def formstack_payload():
+    engine = ScoringEngine.from_file()
+    builder = PayloadBuilder()
+    with open(SCHEMA_PATH) as f:
+        builder.compile(json.load(f), 'development', engine)
+    answers = dict(SUBMIT_REQUEST)
+    result = engine.score(answers)
+    record = SubmissionRecord("Jordan", "Example-Patient", "1984-07-12", "000123456", "987654321012",
+                              "2024-03-01", "10:42", answers, result.domains, result.scores)
+    return builder.build(record)
+
+
+def cpu_us(fn, n):
+    started = time.process_time()
+    for _ in range(n):
+        fn()
+    return (time.process_time() - started) / n * 1e6
+
+
+def codec_cases(payloads, n):
+    print(f"codec ({jsoncodec.BACKEND} vs stdlib json), CPU us per call:")
+    print(f"  {'payload':<18}{'bytes':>7}{'stdlib enc':>12}{'codec enc':>11}{'stdlib dec':>12}{'codec dec':>11}")
+    for name, obj in payloads.items():
+        text = json.dumps(obj)
+        raw = text.encode('utf-8')
+        row = (
+            cpu_us(lambda: json.dumps(obj).encode('utf-8'), n),
+            cpu_us(lambda: jsoncodec.dumpb(obj), n),
+            cpu_us(lambda: json.loads(raw), n),
+            cpu_us(lambda: jsoncodec.loads(raw), n),
+        )
+        print(f"  {name:<18}{len(raw):>7}" + ''.join(f"{v:>12.2f}" if i % 2 == 0 else f"{v:>11.2f}"
+                                                    for i, v in enumerate(row)))
+
+
+def make_app(provider):
+    app = Flask(__name__)
+    if provider is not None:
+        app.json = provider(app)
+
+    @app.route('/echo', methods=['POST'])
+    def echo():
+        data = request.json
+        return jsonify({"message": "Data processed successfully", "received": data}), 200
+
+    return app
+
+
+def flask_cases(payloads, n):
+    print("Flask request.json + jsonify(), CPU us per request:")
+    clients = {
+        'stdlib': make_app(DefaultJSONProvider).test_client(),
+        jsoncodec.BACKEND: make_app(jsoncodec.FastJSONProvider).test_client(),
+    }
+    for name, obj in payloads.items():
+        body = json.dumps(obj)
+        results = {}
+        for label, client in clients.items():
+            def call():
+                client.post('/echo', data=body, content_type='application/json')
+            call()
+            results[label] = cpu_us(call, n)
+        stdlib, fast = results['stdlib'], results[jsoncodec.BACKEND]
+        print(f"  {name:<18} stdlib {stdlib:8.1f}  {jsoncodec.BACKEND} {fast:8.1f}  saved {stdlib - fast:6.1f} us"
+              f" ({(stdlib - fast) / stdlib * 100:.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=20000, help='iterations per codec case')
+    args = parser.parse_args()
+
+    payloads = {
+        'verify request': VERIFY_REQUEST,
+        'corepoint reply': COREPOINT_REPLY,
+        'submit request': SUBMIT_REQUEST,
+        'formstack payload': formstack_payload(),
+    }
+    codec_cases(payloads, args.n)
+    flask_cases(payloads, max(1, args.n // 10))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+# bench_schema.py
+# Cost of the request body validators (utils/schemas.py) per request: the
+# compiled /api/verify, /api/validate and /api/submit schemas on valid bodies,
+# on the golden submissions in scoring_golden.jsonl and on typical invalid
+# ones, next to the JSON decode of the same body for scale.
+#
+#   python benchmarks/bench_schema.py [-n 20000]
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+sys.path.insert(0, ROOT)
+
+from bench_json import SUBMIT_REQUEST, VERIFY_REQUEST  # noqa: E402
+
+from utils import jsoncodec  # noqa: E402
+from utils.schemas import compile_schema  # noqa: E402
+from utils.scoring import ScoringEngine  # noqa: E402
+
+GOLDEN_PATH = os.path.join(BENCH, 'scoring_golden.jsonl')
+
+
+def load_schemas():
+    # The schemas the routes compile at import, compiled the same way
+    from routes.fscommit import submit_schema
+    from routes.routes import VERIFY_SCHEMA
+    from routes.validate import VALIDATE_SCHEMA
+    return {
+        'verify': compile_schema(VERIFY_SCHEMA),
+        'validate': compile_schema(VALIDATE_SCHEMA),
+        'submit': compile_schema(submit_schema(ScoringEngine.from_file())),
+    }
+
+
+def per_call_us(fn, arg, n):
+    started = time.perf_counter()
+    for _ in range(n):
+        fn(arg)
+    return (time.perf_counter() - started) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Request body validator cost per request")
+    parser.add_argument('-n', type=int, default=20000)
+    args = parser.parse_args()
+
+    validators = load_schemas()
+    with open(GOLDEN_PATH) as f:
+        golden = [json.loads(line)['request'] for line in f if line.strip()]
+    cases = [
+        ('verify', 'valid', VERIFY_REQUEST),
+        ('verify', 'invalid (empty dob, extra type)', dict(VERIFY_REQUEST, dob='', lastName=7)),
+        ('validate', 'valid', {'address': '1924 Alcoa Hwy Apt 4B'}),
+        ('submit', 'valid', SUBMIT_REQUEST),
+        ('submit', 'opt-out', {'participation': 'I choose not to participate'}),
+        ('submit', 'invalid (scale, length)', dict(SUBMIT_REQUEST, physicalSecurity='Always',
+                                                   foodAccess='x' * 500)),
+    ]
+
+    print(f"{'endpoint':<9} {'body':<32} {'validate us':>12} {'decode us':>10} {'errors':>7}")
+    for endpoint, label, body in cases:
+        validator = validators[endpoint]
+        raw = jsoncodec.dumpb(body)
+        errors = len(validator(body))
+        print(f"{endpoint:<9} {label:<32} {per_call_us(validator, body, args.n):>12.2f} "
+              f"{per_call_us(jsoncodec.loads, raw, args.n):>10.2f} {errors:>7}")
+
+    submit = validators['submit']
+    rejected = sum(1 for body in golden if submit(body))
+    rounds = max(1, args.n // len(golden))
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for body in golden:
+            submit(body)
+    per_body = (time.perf_counter() - started) / (rounds * len(golden)) * 1e6
+    print(f"\nsubmit over {len(golden)} golden bodies: {per_body:.2f} us each, {rejected} rejected")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+# bench_scoring.py
+# Times the scoring engine over the golden request bodies. Its output is
+# checked against the original inline scoring by tests/test_scoring.py.
+#
+#   python benchmarks/bench_scoring.py [--rules utils/sdoh_rules.json] [-n 20000]
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.scoring import ScoringEngine  # noqa: E402
+from utils.rescore import answers_for  # noqa: E402
+
+GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scoring_golden.jsonl')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rules', default=None)
+    parser.add_argument('-n', type=int, default=20000, help='scores to time')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    engine = ScoringEngine.from_file(args.rules)
+    load_ms = (time.perf_counter() - started) * 1000
+
+    with open(GOLDEN) as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+    print(f"rules v{engine.version}, {len(cases)} golden bodies")
+
+    prepared = [answers_for(engine, case['request']) for case in cases]
+    score = engine.score
+    started = time.perf_counter()
+    for i in range(args.n):
+        score(prepared[i % len(prepared)])
+    elapsed = time.perf_counter() - started
+    print(f"load+compile: {load_ms:.2f} ms")
+    print(f"score: {args.n} responses in {elapsed:.3f}s = {elapsed / args.n * 1e6:.2f} us/response")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
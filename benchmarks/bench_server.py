@@ -0,0 +1,140 @@
+# bench_server.py
+# Picks the server sizing defaults (config.py, used by gunicorn_config.py).
+#
+# 1. Measures the CPU time one /api/verify and one /api/submit request costs
+#    in-process (against a stand-in Corepoint with no delay). That is
+#    SERVER_CPU_MS.
+# 2. Runs the real app under gunicorn with one threaded worker and a
+#    stand-in Corepoint that answers after --latency seconds, sweeping the
+#    thread count. It reports the smallest count that reaches 95% of peak
+#    throughput, next to what the config.py formula gives.
+#
+#   python benchmarks/bench_server.py [--latency 0.3] [--threads 1,2,4,8,16,32,64] [--requests 400]
+#
+# Needs gunicorn installed; everything runs on localhost.
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+sys.path.insert(0, BENCH)
+
+from bench_concurrency import (  # noqa: E402
+    COREPOINT_REPLY, VERIFY_REQUEST, StandInCorepoint, free_port, run_load, start_server
+)
+from bench_json import SUBMIT_REQUEST  # noqa: E402
+
+
+def measure_cpu(upstream_url, workdir, n):
+    """Mean CPU ms per request on the request thread, for verify and for submit."""
+    os.environ.update(
+        ENV_CP_API_URL=upstream_url,
+        SESSION_CACHE_DIR=os.path.join(workdir, 'inproc', 'sessions'),
+        OUTBOX_PATH=os.path.join(workdir, 'inproc', 'outbox.db'),
+        BULKHEAD_DIR=os.path.join(workdir, 'inproc', 'bulkhead'),
+        RATE_LIMIT_PATH=os.path.join(workdir, 'inproc', 'ratelimit.db'),
+        TOKEN_REVOCATION_PATH=os.path.join(workdir, 'inproc', 'revoked.db'),
+        # Same patient and session every time: measure the full Corepoint path, unthrottled
+        COREPOINT_MEMO_TTL='0',
+        VERIFY_LIMIT_IP='1000000/60',
+        VERIFY_LIMIT_IDENTITY='1000000/60',
+        VERIFY_LIMIT_SESSION='1000000/60',
+    )
+    sys.path.insert(0, ROOT)
+    from sdohapi import app
+
+    client = app.test_client()
+    results = {}
+
+    def verify():
+        return client.post('/api/verify', json=VERIFY_REQUEST, headers={'Session-ID': 'bench'}).get_json()
+
+    def submit(session):
+        headers = {'Session-ID': session['session_id'], 'Validation-Token': session['validationToken']}
+        return client.post('/api/submit', json=SUBMIT_REQUEST, headers=headers)
+
+    # Warm up imports, pools and caches
+    for _ in range(5):
+        verify()
+    started = time.thread_time()
+    for _ in range(n):
+        verify()
+    results['verify'] = (time.thread_time() - started) / n * 1000
+
+    verified = verify()
+    validated = client.post('/api/validate', json={'address': json.loads(COREPOINT_REPLY)['IDS']['ADDRESS']},
+                            headers={'Session-ID': verified['session_id'],
+                                     'Verification-Token': verified['verificationToken'],
+                                     'X-CSP-Nonce': verified['verify_nonce']}).get_json()
+    if validated.get('validationToken'):
+        started = time.thread_time()
+        for _ in range(n):
+            submit(validated)
+        results['submit'] = (time.thread_time() - started) / n * 1000
+    return results
+
+
+def sweep_threads(upstream, upstream_url, workdir, thread_counts, total):
+    rows = []
+    for count in thread_counts:
+        port = free_port()
+        clients = max(count * 2, 8)
+        process = start_server('threads', port, 1, clients, upstream_url, workdir,
+                               extra_env={'WEB_THREADS': str(count)})
+        try:
+            run_load(port, clients, clients)
+            upstream.reset()
+            result = run_load(port, clients, total)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+        result['threads'] = count
+        result['peak_upstream_in_flight'] = upstream.peak
+        rows.append(result)
+        print(f"  threads={count:<3} rps={result['rps']:<7} p50={result['p50_ms']}ms p95={result['p95_ms']}ms")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.3, help='stand-in Corepoint delay in seconds')
+    parser.add_argument('--threads', default='1,2,4,8,16,32,64')
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('-n', type=int, default=200, help='requests per in-process CPU measurement')
+    args = parser.parse_args()
+
+    instant = StandInCorepoint(0)
+    threading.Thread(target=instant.serve_forever, daemon=True).start()
+    slow = StandInCorepoint(args.latency)
+    threading.Thread(target=slow.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cpu = measure_cpu(f'http://127.0.0.1:{instant.server_address[1]}/verify', workdir, args.n)
+        print("CPU per request (ms): " + ", ".join(f"{k}={v:.2f}" for k, v in cpu.items()))
+
+        print(f"thread sweep, 1 worker, upstream latency {args.latency * 1000:.0f} ms:")
+        rows = sweep_threads(slow, f'http://127.0.0.1:{slow.server_address[1]}/verify', workdir,
+                             [int(t) for t in args.threads.split(',')], args.requests)
+
+    best = max(row['rps'] for row in rows)
+    knee = next(row for row in rows if row['rps'] >= best * 0.95)
+    formula = 1 + math.ceil(args.latency * 1000 / cpu['verify'])
+    print(json.dumps({
+        'SERVER_CPU_MS': round(cpu['verify'], 2),
+        'UPSTREAM_LATENCY_MS': args.latency * 1000,
+        'formula_threads': formula,
+        'measured_knee_threads': knee['threads'],
+        'peak_rps_per_worker': best,
+        'sweep': rows,
+    }, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
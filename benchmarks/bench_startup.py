@@ -0,0 +1,160 @@
+# bench_startup.py
+# Cold start benchmark: time from launching the app to its first served
+# request (GET /api/get-csp-nonce answered 200), plus the bare `import sdohapi`
+# time with and without precompiled bytecode.
+#
+#   python benchmarks/bench_startup.py [--runs 5]
+#   python benchmarks/bench_startup.py --command dist/sdohapi/sdohapi --url https://127.0.0.1:5000
+#
+# The default run measures `import sdohapi` in a fresh interpreter from a copy
+# of the app without bytecode (what a server sees on the first start after a
+# deploy without `python -m compileall`) and with precompiled bytecode, then
+# gunicorn with one worker. --command times any other launcher instead, e.g. the one-file and
+# SDOHAPI_BUILD=onedir PyInstaller builds; they serve HTTPS with the
+# certificates from config, so certificate checks are off for the probe.
+# Session, outbox and limiter files go to a temporary directory.
+import argparse
+import compileall
+import json
+import os
+import shlex
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+import urllib3
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+sys.path.insert(0, BENCH)
+
+from bench_concurrency import free_port  # noqa: E402
+from bench_e2e import ORIGIN  # noqa: E402
+
+
+def app_env(workdir):
+    return dict(
+        os.environ,
+        SESSION_CACHE_DIR=os.path.join(workdir, 'sessions'),
+        OUTBOX_PATH=os.path.join(workdir, 'outbox.db'),
+        RATE_LIMIT_PATH=os.path.join(workdir, 'ratelimit.db'),
+        TOKEN_REVOCATION_PATH=os.path.join(workdir, 'revoked.db'),
+        BULKHEAD_DIR=os.path.join(workdir, 'bulkhead'),
+        METRICS_DIR=os.path.join(workdir, 'metrics'),
+    )
+
+
+def copy_app(workdir):
+    app_dir = os.path.join(workdir, 'app')
+    shutil.copytree(ROOT, app_dir, ignore=shutil.ignore_patterns(
+        '.git', '__pycache__', 'benchmarks', 'build', 'dist', '*.pyc'))
+    return app_dir
+
+
+def drop_bytecode(app_dir):
+    for directory, subdirs, _files in os.walk(app_dir):
+        if '__pycache__' in subdirs:
+            shutil.rmtree(os.path.join(directory, '__pycache__'))
+            subdirs.remove('__pycache__')
+
+
+def time_import(app_dir, env):
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import sdohapi'], cwd=app_dir, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def time_first_request(command, url, env, timeout=60):
+    """Seconds from spawning command until url/api/get-csp-nonce answers 200."""
+    session = requests.Session()
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"{command[0]} exited with {process.returncode} before serving")
+            try:
+                response = session.get(f'{url}/api/get-csp-nonce', headers={'Origin': ORIGIN},
+                                       timeout=1, verify=False)
+                if response.status_code == 200:
+                    return time.perf_counter() - started
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.01)
+        raise RuntimeError(f"no 200 from {url} within {timeout}s")
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def summarize(samples):
+    return {
+        'runs': len(samples),
+        'min_ms': round(min(samples) * 1000, 1),
+        'median_ms': round(statistics.median(samples) * 1000, 1),
+        'max_ms': round(max(samples) * 1000, 1),
+    }
+
+
+def gunicorn_command(port, workdir):
+    return [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn_config.py'),
+            '--bind', f'127.0.0.1:{port}', '--workers', '1', '--access-logfile', os.devnull,
+            '--error-logfile', os.path.join(workdir, 'gunicorn.log'), '--chdir', ROOT, 'sdohapi:app']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time from launch to first served request")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--command', default=None, help='launcher to time instead of gunicorn')
+    parser.add_argument('--url', default='https://127.0.0.1:5000', help='base URL the --command serves on')
+    parser.add_argument('-o', '--output', default=None, help='results JSON (default benchmarks/results/startup-<time>.json)')
+    args = parser.parse_args()
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    results = {'python': sys.version.split()[0], 'runs': args.runs}
+    with tempfile.TemporaryDirectory() as workdir:
+        env = app_env(workdir)
+        if args.command:
+            command = shlex.split(args.command)
+            results['command'] = args.command
+            results['first_request'] = summarize(
+                [time_first_request(command, args.url, env) for _ in range(args.runs)])
+        else:
+            app_dir = copy_app(workdir)
+            cold = []
+            for _ in range(args.runs):
+                drop_bytecode(app_dir)
+                cold.append(time_import(app_dir, env))
+            compileall.compile_dir(app_dir, quiet=1)
+            warm = [time_import(app_dir, env) for _ in range(args.runs)]
+            results['import_no_bytecode'] = summarize(cold)
+            results['import_precompiled'] = summarize(warm)
+            samples = []
+            for _ in range(args.runs):
+                port = free_port()
+                samples.append(time_first_request(gunicorn_command(port, workdir), f'http://127.0.0.1:{port}', env))
+            results['gunicorn_first_request'] = summarize(samples)
+
+    for name, stats in results.items():
+        if isinstance(stats, dict):
+            print(f"{name:<24} min {stats['min_ms']:>7.1f} ms  median {stats['median_ms']:>7.1f} ms"
+                  f"  max {stats['max_ms']:>7.1f} ms")
+    output = args.output or os.path.join(BENCH, 'results', f"startup-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+# bench_tls.py
+# TLS handshake benchmark for utils/tls.py. Generates a throwaway certificate,
+# serves it from a separate process and times client handshakes: full ones
+# (no session) against resumed ones (the previous connection's session
+# ticket), for TLS 1.2 and 1.3. The same is run against a server that builds
+# a new context per connection, which is what gunicorn's default
+# ssl_context does, to show that resumption never happens there.
+#
+#   python benchmarks/bench_tls.py [--connections 200] [--key rsa|ec]
+#
+# Needs the cryptography package (already required by the app). Runs
+# entirely on localhost.
+import argparse
+import datetime
+import ipaddress
+import multiprocessing
+import os
+import socket
+import ssl
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+sys.path.insert(0, ROOT)
+
+from utils.tls import ServerContext, configure  # noqa: E402
+
+REPLY = b'HTTP/1.1 204 No Content\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+
+
+def make_cert(directory, key_type):
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(65537, 2048) if key_type == 'rsa' else ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'localhost')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5)).not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([
+            x509.DNSName('localhost'), x509.IPAddress(ipaddress.ip_address('127.0.0.1'))]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    cert_file = os.path.join(directory, 'cert.pem')
+    key_file = os.path.join(directory, 'key.pem')
+    with open(cert_file, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_file, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return cert_file, key_file
+
+
+def serve(listener, cert_file, key_file, per_connection):
+    if per_connection:
+        # gunicorn's default: a new context (and new ticket keys) for every connection
+        def wrap(sock):
+            context = configure(ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER), cert_file, key_file)
+            return context.wrap_socket(sock, server_side=True)
+        accept = listener.accept
+    else:
+        # As app.run does it: the listening socket is wrapped once and accept() hands out TLS sockets
+        listener = ServerContext(cert_file, key_file).wrap_socket(listener, server_side=True)
+        accept = listener.accept
+        wrap = None
+    while True:
+        try:
+            conn, _addr = accept()
+            if wrap is not None:
+                conn = wrap(conn)
+            conn.recv(1024)
+            conn.sendall(REPLY)
+            conn.close()
+        except (ssl.SSLError, OSError):
+            continue
+
+
+def handshakes(port, cert_file, version, connections, resume):
+    client = ssl.create_default_context(cafile=cert_file)
+    client.minimum_version = client.maximum_version = version
+    timings = []
+    reused = 0
+    session = None
+    for _ in range(connections):
+        raw = socket.create_connection(('127.0.0.1', port))
+        started = time.perf_counter()
+        conn = client.wrap_socket(raw, server_hostname='localhost', session=session if resume else None)
+        timings.append(time.perf_counter() - started)
+        reused += conn.session_reused
+        # TLS 1.3 tickets arrive after the handshake, with the first server data
+        conn.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        conn.recv(1024)
+        session = conn.session
+        conn.close()
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(sorted(timings)[int(len(timings) * 0.95) - 1] * 1000, 3),
+        'resumed': f'{reused}/{connections}',
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full vs resumed TLS handshakes against utils/tls.py")
+    parser.add_argument('--connections', type=int, default=200)
+    parser.add_argument('--key', choices=('rsa', 'ec'), default='rsa')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cert_file, key_file = make_cert(workdir, args.key)
+        results = {}
+        for server in ('rotating', 'per-connection'):
+            listener = socket.create_server(('127.0.0.1', 0))
+            port = listener.getsockname()[1]
+            process = multiprocessing.Process(target=serve, daemon=True,
+                                              args=(listener, cert_file, key_file, server == 'per-connection'))
+            process.start()
+            listener.close()
+            try:
+                for version in (ssl.TLSVersion.TLSv1_2, ssl.TLSVersion.TLSv1_3):
+                    for resume in (False, True):
+                        name = f"{server} {version.name} {'resumed' if resume else 'full'}"
+                        results[name] = handshakes(port, cert_file, version, args.connections, resume)
+            finally:
+                process.terminate()
+                process.join()
+
+    print(f"{args.connections} connections per row, {args.key} certificate, {ssl.OPENSSL_VERSION}\n")
+    print(f"{'server / protocol / handshake':<36} {'median ms':>10} {'p95 ms':>8} {'resumed':>9}")
+    for name, stats in results.items():
+        print(f"{name:<36} {stats['median_ms']:>10.3f} {stats['p95_ms']:>8.3f} {stats['resumed']:>9}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+# profile_imports.py
+# Import-time profile of the app: runs `python -X importtime -c "import sdohapi"`
+# in a fresh interpreter and reports the slowest imports, by cumulative time
+# (the module and everything it pulled in) and by self time, plus totals per
+# top-level package.
+#
+#   python benchmarks/profile_imports.py [--module sdohapi] [--top 25] [--runs 3]
+#
+# With --runs > 1 each module's fastest run is reported, which filters out
+# disk cache noise. Session, outbox and limiter files go to a temporary directory.
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def app_env(workdir):
+    return dict(
+        os.environ,
+        SESSION_CACHE_DIR=os.path.join(workdir, 'sessions'),
+        OUTBOX_PATH=os.path.join(workdir, 'outbox.db'),
+        RATE_LIMIT_PATH=os.path.join(workdir, 'ratelimit.db'),
+        TOKEN_REVOCATION_PATH=os.path.join(workdir, 'revoked.db'),
+        BULKHEAD_DIR=os.path.join(workdir, 'bulkhead'),
+        METRICS_DIR=os.path.join(workdir, 'metrics'),
+    )
+
+
+def profile(module, env):
+    """{module: (self_us, cumulative_us, depth)} for one fresh interpreter."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr[-2000:])
+        raise SystemExit(f"importing {module} failed")
+    timings = {}
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            timings[name] = (int(own), int(cumulative), len(indent) // 2)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the slowest imports at app startup")
+    parser.add_argument('--module', default='sdohapi')
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = app_env(workdir)
+        runs = [profile(args.module, env) for _ in range(args.runs)]
+    best = {}
+    for timings in runs:
+        for name, (own, cumulative, depth) in timings.items():
+            if name not in best or cumulative < best[name][1]:
+                best[name] = (own, cumulative, depth)
+
+    total = best[args.module][1] if args.module in best else sum(own for own, _, _ in best.values())
+    print(f"import {args.module}: {total / 1000:.1f} ms, {len(best)} modules (best of {args.runs})\n")
+
+    print(f"{'cumulative ms':>13} {'self ms':>8}  module")
+    for name, (own, cumulative, _depth) in sorted(best.items(), key=lambda item: -item[1][1])[:args.top]:
+        print(f"{cumulative / 1000:>13.1f} {own / 1000:>8.1f}  {name}")
+
+    print(f"\n{'self ms':>8}  module")
+    for name, (own, _cumulative, _depth) in sorted(best.items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f"{own / 1000:>8.1f}  {name}")
+
+    packages = {}
+    for name, (own, _cumulative, _depth) in best.items():
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + own
+    print(f"\n{'self ms':>8}  package (sum over its modules)")
+    for package, own in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{own / 1000:>8.1f}  {package}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
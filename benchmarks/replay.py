@@ -0,0 +1,312 @@
+# replay.py
+# Re-drives traffic recorded by utils/capture.py (CAPTURE_ENABLED) against a
+# local instance, keeping the recorded mix and timing: failed verifies and
+# freshen retries, abandoned address validations, participation vs opt-out
+# submits, duplicate submits, status polls. Requests are sent at their
+# recorded offsets divided by --speed, and each journey's steps stay in order
+# with live session ids and tokens threaded through from earlier responses.
+#
+#   python benchmarks/replay.py /tmp/sdohapi-capture [--speed 1] [--limit N]
+#       [--mode threads] [--workers 2] [--cp-latency-ms 150] [--fs-latency-ms 400]
+#       [--target http://127.0.0.1:5000] [-o benchmarks/results/replay.json]
+#
+# By default starts the app under gunicorn with the bench_e2e.py stand-ins for
+# Corepoint and Formstack. Recorded Corepoint outcomes are reproduced by
+# marking the synthetic patient's last name, so --target must point at an
+# instance whose ENV_CP_API_URL is such a stand-in. Nothing leaves localhost.
+import argparse
+import glob
+import gzip
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH)
+
+from bench_concurrency import free_port, start_server  # noqa: E402
+from bench_e2e import (ADDRESS, FAIL_MARKER, NOVISIT_MARKER, ORIGIN, StandIns, Upstream,  # noqa: E402
+                       git_commit, percentile)
+from bench_json import SUBMIT_REQUEST  # noqa: E402
+
+WRONG_ADDRESS = '310 Gay St'
+ANSWER_KEYS = [key for key in SUBMIT_REQUEST if key != 'participation']
+
+
+def read_capture(paths):
+    """Records from capture files (or directories of them), oldest first."""
+    files = []
+    for path in paths:
+        files.extend(sorted(glob.glob(os.path.join(path, 'capture-*.jsonl.gz'))) if os.path.isdir(path) else [path])
+    records = []
+    for path in files:
+        with gzip.open(path, 'rb') as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        records.append(json.loads(line))
+            except (EOFError, zlib.error):
+                # Worker killed before closing its file; everything up to the last flush is intact
+                pass
+            except ValueError:
+                print(f"skipping partial record at end of {path}", file=sys.stderr)
+    records.sort(key=lambda r: r['t'])
+    return records
+
+
+class Journeys:
+    """Live ids and tokens for the synthetic tokens in the capture."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}      # session token -> latest JSON reply for that session
+        self.pre_sessions = {}  # pre-verify Session-ID token -> live id (tries are counted per id)
+        self.idempotency = {}   # Idempotency-Key token -> live key (so duplicate submits stay duplicates)
+        self.submissions = {}   # submission token -> live submission id
+
+    def _live(self, table, token, make):
+        with self.lock:
+            if token not in table:
+                table[token] = make()
+            return table[token]
+
+    def pre_session(self, token):
+        return self._live(self.pre_sessions, token, lambda: str(uuid.uuid4()))
+
+    def idempotency_key(self, token):
+        return self._live(self.idempotency, token, lambda: str(uuid.uuid4()))
+
+    def session(self, token):
+        with self.lock:
+            return self.sessions.get(token)
+
+    def remember(self, record, reply):
+        with self.lock:
+            if record.get('ns') and reply.get('session_id'):
+                self.sessions[record['ns']] = {**self.sessions.get(record['ns'], {}), **reply}
+            if record.get('s') in self.sessions:
+                self.sessions[record['s']].update(reply)
+            if record.get('sub') and reply.get('submission_id'):
+                self.submissions[record['sub']] = reply['submission_id']
+
+
+def build_request(record, journeys):
+    """(method, path, headers, json body) that reproduces a captured request's outcome."""
+    method, path, body = record['m'], record['p'], record.get('b') or {}
+    headers = {'Origin': ORIGIN}
+    payload = None
+    live = journeys.session(record['s']) if record.get('s') else None
+    if record.get('ik'):
+        headers['Idempotency-Key'] = journeys.idempotency_key(record['ik'])
+
+    if method == 'OPTIONS':
+        headers['Access-Control-Request-Method'] = 'POST'
+        headers['Access-Control-Request-Headers'] = 'content-type,session-id'
+    elif path == '/api/verify' and method == 'POST':
+        status = record.get('st') or 0
+        last_name = f"Patient-{body.get('pt', 'unknown')}"
+        if status >= 500:
+            last_name = f'{FAIL_MARKER}-{last_name}'
+        elif status != 200:
+            last_name = f'{NOVISIT_MARKER}-{last_name}'
+        payload = {'firstName': 'Replay', 'lastName': last_name, 'dob': '1980-01-01'}
+        if body.get('fr'):
+            payload['freshen'] = True
+        if record.get('s'):
+            headers['Session-ID'] = journeys.pre_session(record['s'])
+    elif path == '/api/validate' and method == 'POST':
+        payload = {'address': ADDRESS if record.get('st') == 200 else WRONG_ADDRESS}
+        if live:
+            headers.update({'Session-ID': live['session_id'], 'Verification-Token': live.get('verificationToken', ''),
+                            'X-CSP-Nonce': live.get('verify_nonce', '')})
+    elif path == '/api/submit' and method == 'POST':
+        participation = body.get('pa', SUBMIT_REQUEST['participation'])
+        payload = {'participation': 'replay-other' if participation == 'other' else participation}
+        payload.update((key, SUBMIT_REQUEST[key]) for key in ANSWER_KEYS[:body.get('n', len(ANSWER_KEYS))])
+        if live:
+            headers.update({'Session-ID': live['session_id'], 'Validation-Token': live.get('validationToken', '')})
+    elif path == '/api/submit/{id}':
+        with journeys.lock:
+            path = f"/api/submit/{journeys.submissions.get(record.get('sub'), 'unknown')}"
+    return method, path, headers, payload
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.recorded = {}
+        self.statuses = {}
+        self.recorded_statuses = {}
+        self.lag = []
+
+    def add(self, name, elapsed, status, record, lag):
+        with self.lock:
+            self.samples.setdefault(name, []).append(elapsed)
+            self.recorded.setdefault(name, []).append(record.get('d', 0) / 1000)
+            counts = self.statuses.setdefault(name, {})
+            counts[str(status)] = counts.get(str(status), 0) + 1
+            counts = self.recorded_statuses.setdefault(name, {})
+            counts[str(record.get('st'))] = counts.get(str(record.get('st')), 0) + 1
+            self.lag.append(lag)
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for name, samples in sorted(self.samples.items()):
+            samples = sorted(samples)
+            recorded = sorted(self.recorded[name])
+            endpoints[name] = {
+                'count': len(samples),
+                'rps': round(len(samples) / elapsed, 2),
+                'p50_ms': round(percentile(samples, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(samples, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(samples, 0.99) * 1000, 2),
+                'recorded_p50_ms': round(percentile(recorded, 0.50) * 1000, 2),
+                'recorded_p95_ms': round(percentile(recorded, 0.95) * 1000, 2),
+                'statuses': self.statuses[name],
+                'recorded_statuses': self.recorded_statuses[name],
+            }
+        lag = sorted(self.lag) or [0.0]
+        return endpoints, {'p50_ms': round(percentile(lag, 0.5) * 1000, 2),
+                           'p99_ms': round(percentile(lag, 0.99) * 1000, 2),
+                           'max_ms': round(lag[-1] * 1000, 2)}
+
+
+def replay(base, records, speed, max_in_flight, results):
+    """Send records at their recorded offsets / speed, chaining the steps of each journey."""
+    journeys = Journeys()
+    local = threading.local()
+    # Each step waits for the previous step of its session; a verify that hands out a
+    # session id is the previous step of everything later sent under that id
+    previous = {}
+
+    def send(record, due, wait_for, done):
+        try:
+            if wait_for is not None:
+                wait_for.wait(timeout=120)
+            session = getattr(local, 'session', None)
+            if session is None:
+                session = local.session = requests.Session()
+            method, path, headers, payload = build_request(record, journeys)
+            lag = max(0.0, time.perf_counter() - due)
+            started = time.perf_counter()
+            try:
+                response = session.request(method, f'{base}{path}', headers=headers, json=payload, timeout=120)
+                status = response.status_code
+            except requests.RequestException:
+                response, status = None, 'error'
+            elapsed = time.perf_counter() - started
+            if response is not None and response.headers.get('Content-Type', '').startswith('application/json'):
+                try:
+                    reply = response.json()
+                except ValueError:
+                    reply = None
+                if isinstance(reply, dict):
+                    journeys.remember(record, reply)
+            results.add(f"{method} {record['p']}", elapsed, status, record, lag)
+        finally:
+            done.set()
+
+    t0 = records[0]['t']
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        for record in records:
+            due = started + (record['t'] - t0) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            done = threading.Event()
+            wait_for = previous.get(record.get('s')) if record.get('s') else None
+            for key in (record.get('s'), record.get('ns')):
+                if key:
+                    previous[key] = done
+            pool.submit(send, record, due, wait_for, done)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay traffic captured by utils/capture.py")
+    parser.add_argument('capture', nargs='+', help='capture files or CAPTURE_DIR directories')
+    parser.add_argument('--speed', type=float, default=1.0, help='1 = recorded pace, 10 = ten times faster')
+    parser.add_argument('--limit', type=int, default=None, help='replay only the first N requests')
+    parser.add_argument('--max-in-flight', type=int, default=200, help='client threads')
+    parser.add_argument('--target', default=None, help='running instance (default: start one with stand-ins)')
+    parser.add_argument('--mode', default='threads', choices=('sync', 'threads', 'gevent'), help='SERVER_MODE')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--cp-latency-ms', type=float, default=150)
+    parser.add_argument('--cp-jitter-ms', type=float, default=50)
+    parser.add_argument('--fs-latency-ms', type=float, default=400)
+    parser.add_argument('--fs-jitter-ms', type=float, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', default=None,
+                        help='results JSON (default benchmarks/results/replay-<time>.json)')
+    args = parser.parse_args()
+
+    records = read_capture(args.capture)[:args.limit]
+    if not records:
+        print("no captured requests found", file=sys.stderr)
+        return 1
+    span = records[-1]['t'] - records[0]['t']
+    print(f"{len(records)} requests over {span:.1f}s recorded; replaying in ~{span / args.speed:.1f}s")
+
+    results = Results()
+    if args.target:
+        elapsed = replay(args.target.rstrip('/'), records, args.speed, args.max_in_flight, results)
+    else:
+        # Outcomes come from the capture, so the stand-ins add latency but no random errors
+        rng = random.Random(args.seed)
+        stand_ins = StandIns(Upstream(args.cp_latency_ms, args.cp_jitter_ms, 0.0, rng),
+                             Upstream(args.fs_latency_ms, args.fs_jitter_ms, 0.0, rng), 0.0, rng)
+        threading.Thread(target=stand_ins.serve_forever, daemon=True).start()
+        with tempfile.TemporaryDirectory() as workdir:
+            port = free_port()
+            extra_env = {
+                'FS_SUBMISSION_URL': f'{stand_ins.base_url}/formstack/form/{{form_id}}/submission.json',
+                'METRICS_DIR': os.path.join(workdir, 'metrics'),
+                'LOG_HEADERS': 'off',
+                'LOG_BODIES': 'off',
+                'CAPTURE_ENABLED': 'false',
+            }
+            process = start_server(args.mode, port, args.workers, args.max_in_flight,
+                                   f'{stand_ins.base_url}/corepoint/verify', workdir, extra_env)
+            try:
+                elapsed = replay(f'http://127.0.0.1:{port}', records, args.speed, args.max_in_flight, results)
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+
+    endpoints, lag = results.summary(elapsed)
+    output = {
+        'commit': git_commit(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': vars(args),
+        'requests': len(records),
+        'recorded_seconds': round(span, 2),
+        'seconds': round(elapsed, 2),
+        'dispatch_lag': lag,
+        'endpoints': endpoints,
+    }
+    for name, stats in endpoints.items():
+        print(f"{name:<26} n={stats['count']:<6} p50={stats['p50_ms']:<8} p95={stats['p95_ms']:<8} "
+              f"(recorded p50={stats['recorded_p50_ms']}) {stats['statuses']} vs {stats['recorded_statuses']}")
+    print(f"dispatch lag: {lag}")
+
+    path = args.output or os.path.join(BENCH, 'results', f"replay-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f"results written to {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
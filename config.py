@@ -1,17 +1,160 @@
+import math
 import os
 from dotenv import load_dotenv
 
 print("I made it into the config file!")
 
+
+def _cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# Server sizing, read by gunicorn_config.py and by the Corepoint limits below so
+# the two always agree. One worker per core (the GIL keeps a worker's Python
+# code on one core). A request spends about SERVER_CPU_MS on that core and then
+# waits UPSTREAM_LATENCY_MS on Corepoint or Formstack, so at full load a worker
+# has about latency / cpu requests waiting upstream, and needs that many
+# threads plus one for requests that are not. The Corepoint bulkhead defaults
+# to half that many calls per worker, so a slow Corepoint cannot hold every
+# thread; when CP_BULKHEAD_LIMIT is set to what Corepoint can take from this
+# host instead, threads are cut down to match it.
+SERVER_MODE = os.getenv('SERVER_MODE', 'threads')
+UPSTREAM_LATENCY_MS = float(os.getenv('UPSTREAM_LATENCY_MS', '300'))
+SERVER_CPU_MS = float(os.getenv('SERVER_CPU_MS', '5'))
+MAX_THREADS = int(os.getenv('MAX_THREADS', '32'))
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', _cpu_count()))
+WORKER_CONNECTIONS = int(os.getenv('WORKER_CONNECTIONS', '100'))  # gevent only
+if SERVER_MODE == 'threads':
+    _waiting = min(MAX_THREADS - 1, math.ceil(UPSTREAM_LATENCY_MS / SERVER_CPU_MS))
+    if os.getenv('CP_BULKHEAD_LIMIT'):
+        _waiting = min(_waiting, math.ceil(int(os.getenv('CP_BULKHEAD_LIMIT')) / WEB_WORKERS))
+    WEB_THREADS = int(os.getenv('WEB_THREADS', 1 + _waiting))
+    # Concurrent upstream calls one worker can have in flight
+    UPSTREAM_SLOTS = max(1, WEB_THREADS - 1)
+else:
+    WEB_THREADS = 1
+    UPSTREAM_SLOTS = (min(WORKER_CONNECTIONS - 1, math.ceil(UPSTREAM_LATENCY_MS / SERVER_CPU_MS))
+                      if SERVER_MODE == 'gevent' else 1)
+
 class Config:
     FLASK_ENV =os.getenv('FLASK_ENV')
     SECRET_KEY = os.getenv('SECRET_KEY')
     FLASK_DEBUG = os.getenv('FLASK_DEBUG')
-    ENV_CERT_FILE = os.getenv('ENV_CERT_FILE')
-    ENV_KEY_FILE = os.getenv('ENV_KEY_FILE')
+    # Certificate and key for TLS served by the app itself (app.run, or gunicorn with GUNICORN_TLS=1)
+    ENV_CERT_FILE = os.getenv('ENV_CERT_FILE', '/etc/pki/tls/certs/uhsvtsdohdapp01.crt')
+    ENV_KEY_FILE = os.getenv('ENV_KEY_FILE', '/etc/pki/tls/private/uhsvtsdohdapp01.key')
+    # Oldest protocol accepted ('TLSv1_2' or 'TLSv1_3') and seconds between session ticket key rotations
+    TLS_MIN_VERSION = os.getenv('TLS_MIN_VERSION', 'TLSv1_2')
+    TLS_TICKET_ROTATION = int(os.getenv('TLS_TICKET_ROTATION', '3600'))
+    # Formstack API bearer token, sent with every submission the outbox drainer delivers
     FS_TOK = os.getenv('FS_BEAR_TOKEN')
     FS_API = os.getenv('FS_API_URL')
     CP_API = os.getenv('ENV_CP_API_URL')
+    # Upstream HTTP clients (seconds); see utils/upstream.py
+    CP_CONNECT_TIMEOUT = float(os.getenv('CP_CONNECT_TIMEOUT', '3.05'))
+    CP_READ_TIMEOUT = float(os.getenv('CP_READ_TIMEOUT', '15'))
+    # One pooled connection per Corepoint call a worker can have in flight
+    CP_POOL_SIZE = int(os.getenv('CP_POOL_SIZE', UPSTREAM_SLOTS))
+    CP_RETRIES = int(os.getenv('CP_RETRIES', '2'))
+    CP_RETRY_BACKOFF = float(os.getenv('CP_RETRY_BACKOFF', '0.2'))
+    # Corepoint circuit breaker and bulkhead (max concurrent calls per host); see utils/resilience.py.
+    # The bulkhead defaults to half the Corepoint calls the server was sized to hold (see above), leaving
+    # the other threads for validate, submit and the rest while Corepoint is slow
+    CP_BREAKER_FAILURES = int(os.getenv('CP_BREAKER_FAILURES', '5'))
+    CP_BREAKER_RECOVERY = int(os.getenv('CP_BREAKER_RECOVERY', '30'))
+    CP_BULKHEAD_LIMIT = int(os.getenv('CP_BULKHEAD_LIMIT', max(1, WEB_WORKERS * UPSTREAM_SLOTS // 2)))
+    CP_BULKHEAD_WAIT = float(os.getenv('CP_BULKHEAD_WAIT', '0.5'))
+    BULKHEAD_DIR = os.getenv('BULKHEAD_DIR', '/tmp/sdohapi-bulkhead')
+    # Seconds a successful Corepoint lookup is reused for the same name and DOB (0 = off); utils/memo.py
+    COREPOINT_MEMO_TTL = int(os.getenv('COREPOINT_MEMO_TTL', '30'))
+    COREPOINT_MEMO_SIZE = int(os.getenv('COREPOINT_MEMO_SIZE', '1024'))
+    FS_CONNECT_TIMEOUT = float(os.getenv('FS_CONNECT_TIMEOUT', '3.05'))
+    FS_READ_TIMEOUT = float(os.getenv('FS_READ_TIMEOUT', '30'))
+    FS_POOL_SIZE = int(os.getenv('FS_POOL_SIZE', '10'))
+    # Browser origins allowed to call the API; preflights are answered by utils/cors.py
+    CORS_ORIGINS = os.getenv('CORS_ORIGINS', 'https://uhsvtsdohdapp01.utmck.edu,https://sdohtest.utmck.edu').split(',')
+    CORS_ALLOW_HEADERS = ['Content-Type', 'Authorization', 'Session-ID', 'Verification-Token', 'Validation-Token',
+                          'X-CSP-Nonce', 'Idempotency-Key']
+    # Seconds browsers may reuse a preflight answer
+    CORS_MAX_AGE = int(os.getenv('CORS_MAX_AGE', '7200'))
+    # Largest request body accepted (bytes); bigger ones get 413 before any route runs
+    MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', '16384'))
+    # Addresses allowed to read /api/monitor/* and /metrics. Behind the proxy the client is resolved
+    # through PROXY_HOPS/TRUSTED_PROXIES; a forwarded request that names no client is refused
+    MONITOR_ALLOWED_IPS = os.getenv('MONITOR_ALLOWED_IPS', '127.0.0.1').split(',')
+    # Which form in utils/formstack_schema.json to submit to (defaults to FLASK_ENV)
+    FORMSTACK_SCHEMA_ENV = os.getenv('FORMSTACK_SCHEMA_ENV')
+    # Overrides the schema's submission_url template ({form_id} is filled in), e.g. for a stand-in
+    FS_SUBMISSION_URL = os.getenv('FS_SUBMISSION_URL')
+    # Durable Formstack submission queue; see utils/outbox.py
+    OUTBOX_PATH = os.getenv('OUTBOX_PATH', '/home/jclutter/sdoh_outbox/outbox.db')
+    OUTBOX_CONCURRENCY = int(os.getenv('OUTBOX_CONCURRENCY', '2'))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+    # Seconds a retried /api/submit (same Idempotency-Key, or same session and body) gets the first result back
+    OUTBOX_IDEMPOTENCY_TTL = int(os.getenv('OUTBOX_IDEMPOTENCY_TTL', '86400'))
+    # Latency histograms (utils/metrics.py): one file per worker, summed by /metrics
+    METRICS_DIR = os.getenv('METRICS_DIR', '/tmp/sdohapi-metrics')
+    METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+    # Add a Server-Timing header with per-stage durations to every response
+    SERVER_TIMING = os.getenv('SERVER_TIMING', 'false').lower() == 'true'
+    # Logging (utils/logsetup.py). LOG_HEADERS / LOG_BODIES: 'off', 'redacted' or 'full';
+    # header and body dumps are further sampled at LOG_SAMPLE_RATE (0-1)
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # 'text' or 'json'
+    LOG_FILE = os.getenv('LOG_FILE')  # default: stderr (gunicorn's errorlog)
+    LOG_HEADERS = os.getenv('LOG_HEADERS', 'redacted')
+    LOG_BODIES = os.getenv('LOG_BODIES', 'redacted')
+    LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))
+    # Traffic capture for benchmarks/replay.py (utils/capture.py). Identifiers are replaced by
+    # HMAC tokens under CAPTURE_KEY (SECRET_KEY when unset), which must be the same on every worker
+    CAPTURE_ENABLED = os.getenv('CAPTURE_ENABLED', 'false').lower() == 'true'
+    CAPTURE_DIR = os.getenv('CAPTURE_DIR', '/tmp/sdohapi-capture')
+    CAPTURE_KEY = os.getenv('CAPTURE_KEY')
+    # Verification/validation tokens (utils/tokens.py): 'cache' keeps random tokens in the session
+    # record, 'signed' issues HMAC-signed tokens checked without a cache read (TOKEN_SECRET or SECRET_KEY)
+    TOKEN_MODE = os.getenv('TOKEN_MODE', 'cache')
+    TOKEN_SECRET = os.getenv('TOKEN_SECRET')
+    TOKEN_MAX_AGE = int(os.getenv('TOKEN_MAX_AGE', '3600'))
+    # Used-up signed tokens; shared through this file (or Redis with SESSION_BACKEND=redis)
+    TOKEN_REVOCATION_PATH = os.getenv('TOKEN_REVOCATION_PATH', '/home/jclutter/sdoh_outbox/revoked.db')
+    TOKEN_REVOCATION_SYNC = float(os.getenv('TOKEN_REVOCATION_SYNC', '2'))
+    # Verify rate limits (utils/ratelimit.py) as "count/seconds" sliding windows, or "off", shared through
+    # RATE_LIMIT_PATH (or Redis with SESSION_BACKEND=redis). FAILURES is the no-visit "tries" budget.
+    # IP is per client address (see PROXY_HOPS) and set above the busiest site's verifies, since a clinic's
+    # kiosks share one NAT address; IDENTITY is per patient name, so guessing DOBs does not get around it
+    VERIFY_LIMIT_IP = os.getenv('VERIFY_LIMIT_IP', '60/300')
+    VERIFY_LIMIT_IDENTITY = os.getenv('VERIFY_LIMIT_IDENTITY', '10/900')
+    VERIFY_LIMIT_SESSION = os.getenv('VERIFY_LIMIT_SESSION', '10/900')
+    VERIFY_LIMIT_FAILURES = os.getenv('VERIFY_LIMIT_FAILURES', '4/3600')
+    RATE_LIMIT_PATH = os.getenv('RATE_LIMIT_PATH', '/home/jclutter/sdoh_outbox/ratelimit.db')
+    # Reverse proxies in front of gunicorn (the same-host proxy by default). X-Forwarded-For is only read
+    # when the peer is in TRUSTED_PROXIES; the client is PROXY_HOPS entries from its end
+    PROXY_HOPS = int(os.getenv('PROXY_HOPS', '1'))
+    TRUSTED_PROXIES = os.getenv('TRUSTED_PROXIES', '127.0.0.1,::1').split(',')
+    # Session storage: 'filesystem' (single host), 'redis' (shared across hosts) or 'memory' (local runs).
+    # The rate limits and token revocations follow it. SERVER_MODE=gevent needs 'redis': the others keep
+    # them and the breaker state in sqlite3 and files behind blocking flock calls, which would stall every
+    # greenlet in the worker. The outbox stays on SQLite in every mode, so each submit still blocks its
+    # gevent worker for one local commit
+    SERVER_MODE = SERVER_MODE
+    SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'filesystem')
+    SESSION_CACHE_DIR = os.getenv('SESSION_CACHE_DIR', '/home/jclutter/flask_sessions')
+    SESSION_REDIS_URL = os.getenv('SESSION_REDIS_URL', 'redis://localhost:6379/0')
+    SESSION_KEY_PREFIX = os.getenv('SESSION_KEY_PREFIX', 'sdoh:session:')
+    # Per-worker near cache of session records (utils/nearcache.py); NEAR_CACHE_SIZE=0 turns it off.
+    # Filesystem backend only: the version stamps are kept in SESSION_STAMP_PATH, shared by the workers on
+    # the host. With SESSION_BACKEND=redis every read goes to Redis; a version-key check would cost the
+    # round trip it saves, and pub/sub invalidation could let a worker serve a nonce already used elsewhere
+    NEAR_CACHE_SIZE = int(os.getenv('NEAR_CACHE_SIZE', '1024'))
+    NEAR_CACHE_TTL = int(os.getenv('NEAR_CACHE_TTL', '30'))
+    SESSION_STAMP_PATH = os.getenv('SESSION_STAMP_PATH', '/dev/shm/sdohapi-session-stamps'
+                                   if os.path.isdir('/dev/shm') else '/tmp/sdohapi-session-stamps')
+    # Background removal of expired filesystem session files
+    CACHE_SWEEP_INTERVAL = int(os.getenv('CACHE_SWEEP_INTERVAL', '60'))
+    CACHE_SWEEP_BATCH = int(os.getenv('CACHE_SWEEP_BATCH', '200'))
 
 
 class DevelopmentConfig(Config):
@@ -19,6 +162,10 @@ class DevelopmentConfig(Config):
 
 class ProductionConfig(Config):
     DEBUG = False
+    # Never write PHI or tokens to production logs unless explicitly asked to
+    LOG_HEADERS = os.getenv('LOG_HEADERS', 'redacted')
+    LOG_BODIES = os.getenv('LOG_BODIES', 'off')
+    LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.01'))
 
 def load_environment():
     environment = os.getenv('FLASK_ENV', 'development')
@@ -1,7 +1,119 @@
-bind = "0.0.0.0:5000"
-workers = 3  # Adjust based on your server's CPU cores
+import os
+import random
+import sys
+
+# Every value can be overridden from the environment; the defaults were picked
+# with benchmarks/bench_server.py (see the README).
+#
+# Workers and threads come from the sizing in config.py, which also sets the
+# Corepoint bulkhead and connection pool from the same inputs (SERVER_CPU_MS,
+# UPSTREAM_LATENCY_MS, CP_BULKHEAD_LIMIT), so the threads never outnumber the
+# Corepoint calls the app will let through.
+SERVER_MODE = os.getenv('SERVER_MODE', 'threads')
+
+bind = os.getenv('BIND', "0.0.0.0:5000")
+
+# SERVER_MODE=gevent runs each worker on gevent, so one worker can hold many
+# requests that are waiting on Corepoint or Formstack instead of one, up to
+# UPSTREAM_LATENCY_MS / SERVER_CPU_MS of them in Corepoint (config.py).
+# See benchmarks/bench_concurrency.py.
+if SERVER_MODE == 'gevent':
+    # Patch before the app is preloaded below, or requests/ssl keep blocking sockets
+    from gevent import monkey
+    monkey.patch_all()
+    worker_class = 'gevent'
+elif SERVER_MODE == 'sync':
+    worker_class = 'sync'
+else:
+    worker_class = 'gthread'
+
+# gunicorn reads this file before --chdir applies
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import WEB_THREADS, WEB_WORKERS, WORKER_CONNECTIONS  # noqa: E402
+
+workers = WEB_WORKERS
+threads = WEB_THREADS
+worker_connections = WORKER_CONNECTIONS  # gevent only
+
+# Load config, blueprints and the rule/schema tables once in the master and
+# fork workers from it, so they share that memory copy-on-write
+preload_app = os.getenv('PRELOAD_APP', '1') == '1'
+
+# Recycle workers to cap slow memory growth; jitter keeps them from restarting together
+max_requests = int(os.getenv('MAX_REQUESTS', '5000'))
+max_requests_jitter = int(os.getenv('MAX_REQUESTS_JITTER', str(max_requests // 10)))
+
+# Idle keep-alive to the reverse proxy must outlast the proxy's own upstream
+# keep-alive timeout, or the proxy reuses connections gunicorn has closed
+keepalive = int(os.getenv('KEEPALIVE', '75'))
+backlog = int(os.getenv('BACKLOG', '2048'))
+timeout = int(os.getenv('WORKER_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', '30'))
+# Heartbeat files on tmpfs, so a slow disk cannot get workers killed
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# GUNICORN_TLS=1 serves HTTPS from gunicorn itself rather than behind a TLS
+# proxy. The ssl_context hook below is called for every accepted connection;
+# gunicorn's default builds a new SSLContext each time, which costs a
+# certificate load per connection and makes session resumption impossible.
+GUNICORN_TLS = os.getenv('GUNICORN_TLS', '0') == '1'
+if GUNICORN_TLS:
+    certfile = os.getenv('ENV_CERT_FILE', '/etc/pki/tls/certs/uhsvtsdohdapp01.crt')
+    keyfile = os.getenv('ENV_KEY_FILE', '/etc/pki/tls/private/uhsvtsdohdapp01.key')
 
 # Logging
 accesslog = '/home/jclutter/guni_logs/access.log'
 errorlog = '/var/log/guni_logs/error.log'
 loglevel = 'info'
+# Path without the query string, no referrer: nothing a patient typed reaches access.log
+access_log_format = '%(h)s %(t)s "%(m)s %(U)s %(H)s" %(s)s %(B)s %(M)sms'
+
+
+def post_worker_init(worker):
+    # The cache sweeper and outbox drainer are threads, which fork does not
+    # copy, so each worker starts its own once the app is loaded
+    from sdohapi import start_background_tasks
+    start_background_tasks()
+
+
+def _tls_context(cfg):
+    # One rotating context per process (utils/tls.py), built by the master before any fork
+    from config import Config
+    from utils.tls import server_context
+    return server_context(cfg.certfile, cfg.keyfile, rotation=Config.TLS_TICKET_ROTATION,
+                          minimum_version=Config.TLS_MIN_VERSION)
+
+
+def on_starting(server):
+    # Session ticket keys are made with the context; building it here, in the
+    # master, gives every worker the same keys, so a client resumes on any worker
+    if GUNICORN_TLS:
+        _tls_context(server.cfg)
+
+
+def pre_fork(server, worker):
+    # Rotate in the master, once the keys are TLS_TICKET_ROTATION old, so each new worker starts on current keys
+    if GUNICORN_TLS:
+        _tls_context(server.cfg).current()
+
+
+def post_fork(server, worker):
+    # A worker rotating on its own would make keys no other worker shares
+    if GUNICORN_TLS:
+        context = _tls_context(server.cfg)
+        context.pin()
+        # Spread the restarts of workers forked together
+        worker.tls_grace = random.uniform(0, context.rotation / 10)
+
+
+def post_request(worker, req, environ, resp):
+    # Once its keys are due, the worker finishes its requests and exits; the master
+    # forks its replacement with the rotated keys
+    if GUNICORN_TLS and worker.alive and _tls_context(worker.cfg).expired(worker.tls_grace):
+        worker.log.info("TLS ticket keys due for rotation, restarting worker")
+        worker.alive = False
+
+
+def ssl_context(conf, default_ssl_context_factory):
+    # The context inherited from the master, shared by this worker's connections
+    return _tls_context(conf)
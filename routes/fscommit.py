@@ -1,12 +1,66 @@
-from flask import Blueprint, request, jsonify, current_app, session
-from utils.extensions import cache
-import requests
+from flask import Blueprint, request, jsonify, current_app, session, g
+from utils.extensions import session_store
+from utils.upstream import formstack as formstack_client
+from utils.outbox import outbox, DeliveryError
+from utils.scoring import load_scoring_engine
+from utils.formstack import payload_builder, SubmissionRecord
+from utils.logsetup import log_body, session_ref
+from utils.metrics import metrics
+from utils.tokens import tokens
+from utils.schemas import compile_schema, validate_json
+from utils import jsoncodec
+import hashlib
+import uuid
 from functools import wraps
 from datetime import datetime
-import pytz
 
 submit_bp = Blueprint('submit', __name__)
 
+# Domain rules are loaded and compiled once at startup
+scoring_engine = load_scoring_engine()
+
+# Survey answers copied from the request body
+ANSWER_FIELDS = (
+    'housingSecurity', 'housingCondition', 'foodSecurity', 'foodAccess', 'healthcareAccess',
+    'utilitySecurity', 'childcareAccess', 'occupationAccess', 'educationAccess', 'financialSecurity',
+    'physicalSecurity', 'emotionalSecurity', 'safetySecurity', 'wellbeingSecurity', 'legalStatus',
+    'refugeSecurity', 'militaryService', 'requestHelp', 'sdohConsentProgram', 'sdohConsentHelp',
+)
+PARTICIPATE = "I choose to participate"
+OPT_OUT = "I choose not to participate"
+
+
+def submit_schema(engine):
+    """Body of /api/submit. Answers must be options the rule table's choices list for the field, and scored
+    answers must also be on its point scale. Fields without choices are bounded strings.
+
+    The frontend sends "" for a question left blank, which scores 0 like a missing answer.
+    """
+    answer = {'type': ['string', 'null'], 'maxLength': 200}
+    properties = {field: answer for field in ANSWER_FIELDS}
+    properties['housingCondition'] = {
+        'type': ['array', 'null'], 'maxItems': 20, 'uniqueItems': True,
+        'items': {'type': 'string', 'maxLength': 200},
+    }
+    for field, options in engine.choices.items():
+        if field == 'housingCondition':
+            properties[field] = dict(properties[field], items={'type': 'string', 'enum': list(options)})
+        else:
+            properties[field] = {'type': ['string', 'null'], 'enum': [None, '', *options]}
+    for field, scorers in engine.scorers.items():
+        scale = {value for _name, points, _default in scorers for value in points}
+        properties[field] = {'type': ['string', 'null'], 'enum': [None, '', *sorted(scale)]}
+    properties['participation'] = {'type': 'string', 'enum': [PARTICIPATE, OPT_OUT]}
+    return {
+        'type': 'object',
+        'required': ['participation'],
+        'maxProperties': 40,
+        'properties': properties,
+    }
+
+
+submit_body = compile_schema(submit_schema(scoring_engine))
+
 # Define the decorator here, before the routes
 def require_validation(f):
     @wraps(f)
@@ -17,7 +71,13 @@ def require_validation(f):
         if not session_id or not validate_token:
             return jsonify({"error": "Missing session ID or validation token"}), 401
 
-        stored_token = cache.get(f"{session_id}_validation_token")
+        if tokens.signed:
+            g.validate_claims = tokens.check('validate', validate_token, session_id)
+            if g.validate_claims is None:
+                return jsonify({"error": "Invalid or expired verification token"}), 401
+            return f(*args, **kwargs)
+
+        stored_token = session_store.get(session_id, 'validation_token')
         if not stored_token or stored_token != validate_token:
             return jsonify({"error": "Invalid or expired verification token"}), 401
 
@@ -25,304 +85,156 @@ def require_validation(f):
     return decorated_function
 
 
-@submit_bp.route('/api/submit', methods=['POST', 'OPTIONS'])
+@submit_bp.route('/api/submit', methods=['POST'])
+@validate_json(submit_body)
 def submit():
-    if request.method == 'OPTIONS':
-        # Handle preflight CORS requests
-        return '', 204  # No Content for preflight requests
-
     if request.method == 'POST':
         if request.content_type != 'application/json':
             return jsonify({"error": "Unsupported Media Type"}), 415
 
 
-    current_app.logger.info("!!START of FSCOMMIT-SUBMIT ROUTE!!")
+    current_app.logger.debug("!!START of FSCOMMIT-SUBMIT ROUTE!!")
     data = request.json
-    current_app.logger.info(data)
+    log_body(current_app.logger, "FSCOMMIT -Request Data", data)
     session_id = request.headers.get('Session-ID')
-    validation_data = cache.get(session_id)
-    current_app.logger.info(f"FSCOMMIT -Session ID: {session_id}")
-    current_app.logger.info(f"FSCOMMIT -Session data set: {session.get('{session_id}_validation_data')}")
-
-    # Get current date and time in EST/EDT timezone
-    est_timezone = pytz.timezone('America/New_York') 
+    current_app.logger.info("FSCOMMIT -Session ID: %s", session_ref(session_id))
+
+    # A retry of a submission that is already queued (double tap, kiosk network
+    # retry) gets the first result back without being scored or queued again
+    idempotency_key = submission_key(request.headers.get('Idempotency-Key'), session_id, data)
+    if idempotency_key:
+        row = outbox.find(idempotency_key)
+        if row is not None:
+            current_app.logger.info("FSCOMMIT -Submission %s replayed", row['id'])
+            return submission_response(row, session_id, replayed=True)
+
+    # Name, DOB, MRN and FIN come from the verified session; without it there is nothing to submit for
+    validation_data = session_store.get(session_id)
+    if validation_data is None:
+        current_app.logger.warning("FSCOMMIT -No session record, submission refused")
+        return jsonify({"error": "Invalid or expired session"}), 401
+
+    # Get current date and time in EST/EDT timezone (pytz is imported on first use, not at startup)
+    import pytz
+    est_timezone = pytz.timezone('America/New_York')
     current_datetime = datetime.now(est_timezone)
 
     # Format the date and time
     date_str = current_datetime.strftime('%Y-%m-%d')
     time_str = current_datetime.strftime('%H:%M')
 
-    current_app.logger.info(f"Date: {date_str}, Time: {time_str}")
+    current_app.logger.debug("Date: %s, Time: %s", date_str, time_str)
 
-    fname = validation_data.get('FNM')
-    lname = validation_data.get('LNM')
-    dtbrt = validation_data.get('DOB')
-    rsltdt = date_str
-    rslttm = time_str
-    mrn = cache.get(f"{session_id}_mrn")
-    fin = cache.get(f"{session_id}_fin")
     participate = data.get('participation')
     nonparticipant = "I choose not to answer"
 
-    if (participate == "I choose not to participate"):
-        hous_sec = nonparticipant
-        hous_con = nonparticipant
-        food_sec = nonparticipant
-        food_acc = nonparticipant
-        heal_acc = nonparticipant
-        util_sec = nonparticipant
-        care_acc = nonparticipant
-        occu_acc = nonparticipant
-        educ_sec = nonparticipant
-        fina_sec = nonparticipant
-        phys_sec = nonparticipant
-        emot_sec = nonparticipant
-        safe_sec = nonparticipant
-        well_sec = nonparticipant
-        legal_sec = nonparticipant
-        refuge_sec = nonparticipant
-        military_stat = nonparticipant
-        help_req = "no"
-        sdohConsentProgram = "I do not agree"
-        sdohConsentHelp = "I do not agree"
-        hous_con_str = nonparticipant
-    elif (participate == "I choose to participate"):
-        hous_sec = data.get('housingSecurity')
+    if (participate == OPT_OUT):
+        answers = dict.fromkeys(ANSWER_FIELDS, nonparticipant)
+        answers['requestHelp'] = "no"
+        answers['sdohConsentProgram'] = "I do not agree"
+        answers['sdohConsentHelp'] = "I do not agree"
+    elif (participate == PARTICIPATE):
+        answers = {field: data.get(field) for field in ANSWER_FIELDS}
         # Capture the housingCondition values as a list
-        hous_con = data.get('housingCondition', [])
-        food_sec = data.get('foodSecurity')
-        food_acc = data.get('foodAccess')
-        heal_acc = data.get('healthcareAccess')
-        util_sec = data.get('utilitySecurity')
-        care_acc = data.get('childcareAccess')
-        occu_acc = data.get('occupationAccess')
-        educ_sec = data.get('educationAccess')
-        fina_sec = data.get('financialSecurity')
-        phys_sec = data.get('physicalSecurity')
-        emot_sec = data.get('emotionalSecurity')
-        safe_sec = data.get('safetySecurity')
-        well_sec = data.get('wellbeingSecurity')
-        legal_sec = data.get('legalStatus')
-        refuge_sec = data.get('refugeSecurity')
-        military_stat = data.get('militaryService')
-        help_req = data.get('requestHelp')
-        sdohConsentProgram = data.get('sdohConsentProgram')
-        sdohConsentHelp = data.get('sdohConsentHelp')
-        hous_con_str = "\n".join(hous_con)
-
-    #nonprod form = 5848665
-    #prod form = 5780073
-    formstack= 'https://www.formstack.com/api/v2/form/5848665/submission.json'
-
-    # Conditional logic to set domain data - Only set if relevant values are not empty
-    # Financial Domain
- #   if all(value != '' for value in [occu_acc, educ_sec, fina_sec]):
-
-    # All positive frequency answers
-    pos_true_answers = {"Sometimes true", "Often true"}
-
-    # All positive frequency answers
-    pos_freq_answers = {"Sometimes", "Fairly often", "Frequently"}
-
-    if (fina_sec in pos_freq_answers):
-        domain_financial = "POSITIVE"
-    else:
-        domain_financial = "negative" 
-
-    # Childcare Domain
-    #  if care_acc != '':
-    if (care_acc == "Yes"):
-        domain_childcare = "POSITIVE"
-    else:
-        domain_childcare = "negative"
-
-    # Food Domain
-   # if food_sec != '':
-    if any(answer in pos_true_answers for answer in [food_acc, food_sec]):
-        domain_food = "POSITIVE"
+        answers['housingCondition'] = data.get('housingCondition', [])
     else:
-        domain_food = "negative"
-
-    # Check if any concerning condition is selected in housing condition list
-    housing_conditions = ["Bug infestation", "Mold", "Lead paint or pipes", "Inadequate heat",
-        "Oven or stove not working", "No or not working smoke detectors", "Water leaks"]
-
-    has_concerning_condition = any(condition in hous_con for condition in housing_conditions)
-
-    # Housing domain
-    #if all(value != '' for value in [hous_sec, hous_con]):
-    if hous_sec == "Yes" or has_concerning_condition:
-        domain_housing = "POSITIVE"
-    else:
-        domain_housing = "negative"
-
-    # Safety Domain
-    #if all(value != '' for value in [phys_sec, emot_sec, safe_sec, well_sec]):
-    #if any(answer in pos_freq_answers for answer in [phys_sec, emot_sec, safe_sec, well_sec]):
-        #domain_safety = "POSITIVE"
-    #else:
-        #domain_safety = "negative" 
-
-    # Transport Domain
-    #if food_sec != '':
-    if (heal_acc == "Yes"):
-        domain_transport = "POSITIVE"
-    else:
-        domain_transport = "negative"
-
-    # Utility Domain
-    #if food_sec != '':
-    if (util_sec in ("Yes", "Already shut off")):
-        domain_utility = "POSITIVE"
-    else:
-        domain_utility = "negative"
-
-    # Personal Safety Score Calculator
-    # Map scores to answers
-    answer_scores = {
-        "Never": 1,
-        "Rarely": 2,
-        "Sometimes": 3,
-        "Fairly often": 4,
-        "Frequently": 5,
-        "I choose not to answer": 0
-    }
-
-    # User entered values list
-    answers = [phys_sec, emot_sec, safe_sec, well_sec]
-    # Calculate total score
-    # Default to 0 if answer is not found
-    safety_score = sum(answer_scores.get(answer, 0) for answer in answers)
-    current_app.logger.info(f"DOB: {dtbrt}")
-
-
-    # Safety Domain
-    #if all(value != '' for value in [phys_sec, emot_sec, safe_sec, well_sec]):
-    if safety_score > 10:
-        domain_safety = "POSITIVE"
-    else:
-        domain_safety = "negative"
-
-
-    # Employment Domain
-    if (occu_acc == "No"):
-        domain_employment = "POSITIVE"
-    else:
-        domain_employment = "negative"
-
-    # Education Domain
-    if (educ_sec == "No"):
-        domain_education = "POSITIVE"
-    else:
-        domain_education = "negative"
+        return jsonify({"error": "Invalid participation value"}), 400
+
+    # Score every SDOH domain from the versioned rule table (utils/sdoh_rules.json)
+    with metrics.timer('scoring'):
+        scored = scoring_engine.score(answers)
+
+    record = SubmissionRecord(
+        first_name=validation_data.get('FNM'),
+        last_name=validation_data.get('LNM'),
+        dob=validation_data.get('DOB'),
+        mrn=validation_data.get('mrn'),
+        fin=validation_data.get('fin'),
+        result_date=date_str,
+        result_time=time_str,
+        answers=answers,
+        domains=scored.domains,
+        scores=scored.scores
+    )
+
+    # Construct payload for Formstack submission; the form and its field ids
+    # come from utils/formstack_schema.json for the running environment
+    formstack = payload_builder.url
+    payload = payload_builder.build(record)
+
+    # Queue the submission durably; the outbox drainer delivers it to Formstack
+    # so the patient is not kept waiting on the Formstack round trip. A
+    # concurrent duplicate waits for this insert and gets the same row back
+    with metrics.timer('outbox_enqueue'):
+        row, created = outbox.enqueue(idempotency_key or str(uuid.uuid4()), formstack, payload,
+                                      session_id=session_id)
+    current_app.logger.info("FSCOMMIT -Submission %s queued (new: %s)", row['id'], created)
+
+    return submission_response(row, session_id, replayed=not created)
+
+
+def submission_key(header_key, session_id, data):
+    """The client's Idempotency-Key, else a hash of the session id and request body.
+
+    Without either there is nothing to tie a retry to, so None (every request is new).
+    """
+    if header_key:
+        return header_key
+    if not session_id:
+        return None
+    body = jsoncodec.dumpb(data, sort_keys=True)
+    return 'auto:' + hashlib.sha256(session_id.encode() + b'\0' + body).hexdigest()
+
+
+def submission_response(row, session_id, replayed=False):
+    if row['session_id'] != session_id:
+        # The client reused an Idempotency-Key from another session; do not hand out its submission
+        return jsonify({"error": "Idempotency-Key already used"}), 409
+
+    response = jsonify({
+        "message": "Submission received",
+        "submission_id": row['id'],
+        "status": row['status']
+    })
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response, 202
+
+
+@submit_bp.route('/api/submit/<submission_id>', methods=['GET'])
+def submission_status(submission_id):
+    # Only the session that made the submission may look it up
+    session_id = request.headers.get('Session-ID')
+    row = outbox.get(submission_id)
+    if row is None or not session_id or row['session_id'] != session_id:
+        return jsonify({"error": "Submission not found"}), 404
 
-    # Additional Factors Domain
-    if (legal_sec == "Yes" or refuge_sec == "Yes" or military_stat in ("Veteran/Honorably discharged", "Veteran/Dishonorably discharged")):
-        domain_add_factors = "POSITIVE"
-    else:
-        domain_add_factors = "negative"
-
-    # Send the data to the mock external system
-    #responses = requests.post(f'http://{external_system_ip}/verify', json=data)
-
-
-    # Construct payload for Formstack submission
-    #non-prod:
-    payload = {
-        "field_169568839": {
-          "first": fname,
-          "last": lname,
-        },
-        "field_169568836": rsltdt,
-        "field_169568837": rslttm,
-        "field_169568834": mrn,      
-        "field_169568835": fin,
-        "field_169568840": dtbrt,
-        "field_169568841": hous_sec,
-        "field_169568842": hous_con_str, #hous_con,
-        "field_169568843": food_sec,
-        "field_169568844": food_acc,
-        "field_169568845": heal_acc,
-        "field_169568846": util_sec,
-        "field_169568847": care_acc,
-        "field_169568848": occu_acc,
-        "field_169568849": educ_sec,
-        "field_169568850": fina_sec,
-        "field_169568851": phys_sec,
-        "field_169568852": emot_sec,
-        "field_169568853": safe_sec,
-        "field_169568854": well_sec,
-        "field_174042542": legal_sec,
-        "field_174042555": refuge_sec,
-        "field_174042557": military_stat,
-        "field_169568855": help_req,
-        "field_172501608": sdohConsentProgram,
-        "field_171471885": sdohConsentHelp,
-        "field_173550269": domain_financial,
-        "field_173549876": domain_childcare,
-        "field_173549893": domain_food,
-        "field_173549892": domain_housing,
-        "field_173549880": domain_safety,
-        "field_173549879": domain_transport,
-        "field_173550241": domain_utility,
-        "field_174042914": domain_employment,
-        "field_174042915": domain_education,
-        "field_174042910": domain_add_factors,
-        "field_173550244": safety_score,
-        # Add more fields as needed
-    }
+    return jsonify({
+        "submission_id": row['id'],
+        "status": row['status'],
+        "attempts": row['attempts']
+    }), 200
 
-#production:
-#    payload = {
-#	"field_166238501": {
-#          "first": fname,
-#          "last": lname,
-#        },
-#     	 "field_166238471": mrn,
-#        "field_166238472": fin,
-#        "field_166238529": dtbrt,
-#        "field_166238573": hous_sec,
-#        "field_166239604": hous_con_str, #hous_con,
-#        "field_166239670": food_sec,
-#        "field_166239685": food_acc,
-#        "field_166239714": heal_acc,
-#        "field_166239734": util_sec,
-#        "field_166239744": care_acc,
-#        "field_166239752": occu_acc,
-#        "field_166239754": educ_sec,
-#        "field_166239758": fina_sec,
-#        "field_166239858": phys_sec,
-#        "field_166239860": emot_sec,
-#        "field_166239867": safe_sec,
-#        "field_166239871": well_sec,
-#        "field_166239912": help_req,
-        # Add more fields as needed
-#    }
-
-
-
-
-
-# Retrieve the bearer token from a secure location
-    bearer_token = "ccf1c3dd965d78588833343192c19514"  # Replace with actual token retrieval
 
+def deliver_submission(url, payload):
+    # Called by the outbox drainer, outside of any request. The bearer token
+    # (FS_BEAR_TOKEN) is set on the Formstack client by init_upstreams
     headers = {
         "accept": "application/json",
-        "content-type": "application/json",
-        "Authorization": f"Bearer {bearer_token}"
+        "content-type": "application/json"
     }
 
     # Send the data to FormStack
-    response = requests.post(formstack, json=payload, headers=headers)
-
+    response = formstack_client.post(url, json=payload, headers=headers)
 
     # Check if the request was successful
     if response.status_code in {200,201}:
         # Assuming the Formstack API responds with JSON containing submission information
-        response_data = response.json()
-        return jsonify(response_data), 200  # Return the response from Formstack
-    else:
-        return jsonify({"error": "Failed to submit data to Formstack"}), response.status_code
+        return formstack_client.decode(response)
+
+    # A 4xx other than 429 means Formstack rejected the payload itself; retrying will not help
+    permanent = 400 <= response.status_code < 500 and response.status_code != 429
+    raise DeliveryError(f"Formstack returned {response.status_code}: {response.text[:200]}", permanent=permanent)
 
 # Additional test route for debugging purposes
 #@submit_bp.route('/submit/test', methods=['GET'])
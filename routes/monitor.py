@@ -0,0 +1,70 @@
+from flask import Blueprint, request, jsonify, current_app, Response
+from functools import wraps
+from utils.upstream import corepoint, formstack
+from utils.outbox import outbox
+from utils.memo import corepoint_memo
+from utils.metrics import metrics
+from utils.ratelimit import limiter
+from utils.extensions import session_store
+
+monitor_bp = Blueprint('monitor', __name__)
+
+# Set by a proxy in front of gunicorn; only X-Forwarded-For from a trusted proxy names the client
+FORWARDING_HEADERS = ('X-Forwarded-For', 'Forwarded', 'X-Real-IP')
+
+
+def monitor_client(request):
+    """The caller's address, or None when a proxy forwarded the request for someone it does not name.
+
+    Behind the same-host proxy every request comes from 127.0.0.1, so the peer address alone says
+    nothing; the client is resolved the way the verify limits resolve it (PROXY_HOPS, TRUSTED_PROXIES).
+    """
+    forwarded = [header for header in FORWARDING_HEADERS if header in request.headers]
+    if not forwarded:
+        return request.remote_addr
+    if forwarded == ['X-Forwarded-For'] and limiter.proxy_hops and request.remote_addr in limiter.trusted_proxies:
+        return limiter.client_ip(request)
+    # Forwarded in a way the verify limits do not read, so the real client is unknown
+    return None
+
+
+def local_only(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if monitor_client(request) not in current_app.config.get('MONITOR_ALLOWED_IPS', ['127.0.0.1']):
+            return jsonify({"error": "Forbidden"}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+@monitor_bp.route('/api/monitor/upstreams', methods=['GET'])
+@local_only
+def upstreams():
+    # Per-worker view: latency, retries, breaker state/trips and bulkhead usage
+    return jsonify({
+        "corepoint": corepoint.stats(),
+        "corepoint_memo": corepoint_memo.stats(),
+        "formstack": formstack.stats(),
+        "outbox": outbox.stats()
+    }), 200
+
+
+@monitor_bp.route('/api/monitor/ratelimit', methods=['GET'])
+@local_only
+def ratelimit():
+    # Limits and allowed/rejected counts per rule, shared by every worker
+    return jsonify(limiter.stats()), 200
+
+
+@monitor_bp.route('/api/monitor/sessions', methods=['GET'])
+@local_only
+def sessions():
+    # Near tier is this worker's memory; the shared tier is the configured SESSION_BACKEND
+    return jsonify(session_store.stats()), 200
+
+
+@monitor_bp.route('/metrics', methods=['GET'])
+@local_only
+def prometheus_metrics():
+    # Stage and request latency histograms summed across every worker on this host
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,14 +1,38 @@
-from flask import Blueprint, request, jsonify, current_app, make_response
+from flask import Blueprint, request, jsonify, current_app
 import requests
-from utils.extensions import cache, generate_csp_nonce
+from utils.extensions import session_store, generate_csp_nonce
+from utils.upstream import corepoint
+from utils.memo import corepoint_memo
+from utils.resilience import UpstreamUnavailable
+from utils.logsetup import log_body, session_ref
+from utils.tokens import tokens
+from utils.ratelimit import limiter
+from utils.schemas import compile_schema, validate_json
 import uuid  # Import the uuid module for generating session ID
 import time
 import random
 import secrets
+import math
 
 verify_bp = Blueprint('verify', __name__)
 
-@verify_bp.route('/api/verify', methods=['POST', 'OPTIONS', 'GET', 'HEAD'])
+# The whole body is forwarded to Corepoint, so it is checked before anything else runs
+VERIFY_SCHEMA = {
+    'type': 'object',
+    'required': ['firstName', 'lastName', 'dob'],
+    'maxProperties': 8,
+    'properties': {
+        'firstName': {'type': 'string', 'minLength': 1, 'maxLength': 100},
+        'lastName': {'type': 'string', 'minLength': 1, 'maxLength': 100},
+        # Passed to Corepoint as the frontend sends it (YYYY-MM-DD or MM/DD/YYYY), so only bounded here
+        'dob': {'type': 'string', 'minLength': 1, 'maxLength': 32},
+        'freshen': {'type': ['boolean', 'null']},
+    },
+}
+verify_body = compile_schema(VERIFY_SCHEMA)
+
+@verify_bp.route('/api/verify', methods=['POST', 'GET', 'HEAD'])
+@validate_json(verify_body)
 def verify():
     if request.method == 'GET':
         return jsonify({'message': 'GET method not allowed for this endpoint'}), 405
@@ -17,18 +41,6 @@ def verify():
         current_app.logger.info("Received HEAD request")
         return '', 200
 
-    if request.method == 'OPTIONS':
-        origin = request.headers.get('Origin')
-        if origin in ["https://uhsvtsdohdapp01.utmck.edu", "https://sdohtest.utmck.edu"]:
-            response = make_response('', 204)  # No Content for preflight requests
-            response.headers['Access-Control-Allow-Origin'] = origin
-            response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, session-id, verification-token, validation-token, x-csp-nonce'
-            response.headers['Access-Control-Allow-Credentials'] = 'true'
-            return response
-        else:
-            return make_response('Forbidden', 403)
-
     if request.method == 'POST':
         if request.content_type != 'application/json':
             return jsonify({"error": "Unsupported Media Type"}), 415
@@ -44,8 +56,8 @@ def verify():
 
         freshen = data.get('freshen', False)  # Parse Freshen from request json
 
-        current_app.logger.info(f"Session ID: {session_id}")
-        current_app.logger.info(f"Request Data: {data}")
+        current_app.logger.info("Session ID: %s", session_ref(session_id))
+        log_body(current_app.logger, "Request Data", data)
 
         first_name = data.get('firstName')
         last_name = data.get('lastName')
@@ -54,31 +66,56 @@ def verify():
         if not all([first_name, last_name, date_of_birth]):
             return jsonify({"error": "Missing required fields"}), 400
 
-        <redacted>
+        # A session that could not afford one more failed lookup is turned away
+        # first, without spending its other limits or a Corepoint call. freshen
+        # is charged two tries and does not start the budget over
+        failure_cost = 2 if freshen else 1
+        if not limiter.allows('verify_fail', session_id, cost=failure_cost):
+            return jsonify({'message': 'Maximum tries exceeded', 'redirectTo': '/failedpage'}), 400
+
+        # Rejected before Corepoint is called. Rotating Session-IDs does not get
+        # around the client IP and patient identity limits, and the identity is
+        # the name alone so each new DOB guess counts against the same patient
+        for rule, key in (('verify_ip', limiter.client_ip(request)),
+                          ('verify_identity', limiter.identity(first_name, last_name)),
+                          ('verify_session', session_id)):
+            decision = limiter.hit(rule, key)
+            if not decision.allowed:
+                current_app.logger.warning("Verify rate limited by %s", rule)
+                response = jsonify({'message': 'Too many verification attempts, please try again later'})
+                response.headers['Retry-After'] = str(decision.retry_after)
+                return response, 429
+
+        def lookup():
+            # Patient lookups are read-only, so Corepoint calls are safe to retry
+            response = corepoint.post(json=data, idempotent=True)
+            if response.status_code != 200:
+                return response.status_code, None
+            return 200, corepoint.decode(response)
 
         try:
-            response = requests.post(corepoint, json=data)
+            # Repeats of the same lookup within COREPOINT_MEMO_TTL, or while one is
+            # in flight, share a single Corepoint call; freshen always asks Corepoint
+            status_code, response_data = corepoint_memo.lookup(
+                corepoint_memo.key(first_name, last_name, date_of_birth), lookup,
+                refresh=bool(freshen), cacheable=lambda result: result[0] == 200)
 
-            if response.status_code == 200:
-                response_data = response.json()
-                current_app.logger.info(f"Session data set: {response_data}")
+            if status_code == 200:
+                log_body(current_app.logger, "Corepoint response", response_data)
 
                 mrn = response_data['IDS'].get('MRN')
                 fin = response_data['IDS'].get('FIN')
                 zip = response_data['IDS'].get('ZIP')
                 address_v = response_data['IDS'].get('ADDRESS')
                 valid = response_data['IDS'].get('VALID')
-                current_app.logger.info(f"Correct Address: {address_v}")
 
                 #Extract Address Values
                 bad_adds = [bad_add.get('BAD_ADD') for bad_add in response_data['IDS'].get('BAD_ADDS', [])]
-                current_app.logger.info(f"bad addys: {bad_adds}")
                 # Combine the main address and the bad addresses into a single list
                 all_addresses = [address_v] + bad_adds
 
                 # Randomize the order of the addresses
                 random.shuffle(all_addresses)
-                current_app.logger.info(f"Address List: {all_addresses}")
 
                 if valid and valid.lower() == "true":
                     session_id = str(uuid.uuid4())
@@ -94,29 +131,34 @@ def verify():
 #                        'VLD': valid
                     }
 
-                    cache.set(session_id, validation_data, timeout=1*3600)
-                    #Fill cache with user and session values for auditing
-                    cache.set(f'{session_id}_tries', 3, timeout=1*3600)
-                    cache.set(f'{session_id}_mrn', mrn, timeout=1*3600)
-                    cache.set(f'{session_id}_fin', fin, timeout=1*3600)
-                    cache.set(f'{session_id}_verify_nonce', verify_nonce, timeout=1*3600)
-                    cache.set(f'{session_id}_valid', valid, timeout=1*3600)
-                    cache.set(f'{session_id}_correct_address', address_v, timeout=1*3600)
-#                    cache.set(f'{session_id}_all_addresses', all_addresses, timeout=1*3600)
-
-                    cached_data = cache.get(session_id)
-                    current_app.logger.info(f"Cached Data: {cached_data}")
+                    # One record carries everything the later steps need for this session
+                    if tokens.signed:
+                        # Signed token carries the nonce, so validate can check both without a cache read
+                        verification_token = tokens.issue('verify', session_id, nonce=verify_nonce)
+                        stored_tokens = {}
+                    else:
+                        verification_token = generate_verification_token()
+                        stored_tokens = {'verification_token': verification_token}
+                    session_store.create(
+                        session_id,
+                        mrn=mrn,
+                        fin=fin,
+                        verify_nonce=verify_nonce,
+                        valid=valid,
+                        correct_address=address_v,
+                        **stored_tokens,
+                        **validation_data
+                    )
 
                     verification_result = verify_data(data, valid, mrn, fin)
 
                     if verification_result:
-                        cache.delete(f'{session_id}_tries')  # Reset tries on successful verification
                         return jsonify({
                             "message": "Data processed successfully",
                             "session_id": session_id,
                             "addresses": all_addresses,
                             "isVerified": True,
-                            "verificationToken": generate_verification_token(session_id),
+                            "verificationToken": verification_token,
                             "verify_nonce": verify_nonce,  # Send the nonce to the client
                             "redirectTo": "/success"
                         }), 200
@@ -128,29 +170,27 @@ def verify():
                         }), 400
 
                 else: 
-                    #need to change up this session_id because its pre-session id creation
-                    tries_key = f'{session_id}_tries'
-                    tries = cache.get(tries_key)
-                    if tries is None:
-                        tries = 3
-                    elif freshen and tries is not None:
-                        tries = 3
-                        tries -= 1
-                    else:
-                        tries -= 1
-                    cache.set(tries_key, tries, timeout=1*3600)
+                    # Failed lookups per pre-session id, counted atomically across workers.
+                    decision = limiter.hit('verify_fail', session_id, cost=failure_cost)
+                    tries = max(0, decision.limit - math.ceil(decision.count)) if decision.allowed else 0
 
                     if tries > 0:
                         return jsonify({'message': 'NO VISITS FOUND', 'tries': tries}), 400
                     else:
-                        cache.delete(tries_key)
                         return jsonify({'message': 'Maximum tries exceeded', 'redirectTo': '/failedpage'}), 400
             else:
-                current_app.logger.error(f'Error communicating with Corepoint: {response.status_code} {response.text}')
-                return jsonify({'message': 'Error communicating with Corepoint'}), response.status_code
+                current_app.logger.error('Error communicating with Corepoint: %s', status_code)
+                return jsonify({'message': 'Error communicating with Corepoint'}), status_code
+
+        except UpstreamUnavailable as e:
+            # Breaker open or too many Corepoint calls in flight: fail fast instead of queueing
+            current_app.logger.warning('Corepoint call refused: %s', e)
+            response = jsonify({'message': 'Verification is temporarily unavailable, please try again'})
+            response.headers['Retry-After'] = str(e.retry_after or 1)
+            return response, 503
 
         except requests.RequestException as e:
-            current_app.logger.error(f'RequestException: {e}')
+            current_app.logger.error('RequestException: %s', e)
             return jsonify({'message': 'Error communicating with Corepoint'}), 500
 
 def verify_data(data, valid, mrn, fin):
@@ -159,9 +199,6 @@ def verify_data(data, valid, mrn, fin):
             return True
     return False
 
-def generate_verification_token(session_id):
-    # Generate a secure token
-    vertoken = secrets.token_urlsafe(32)
-    # Store the token in cache with an expiration time
-    cache.set(f"{session_id}_verification_token", vertoken, timeout=3600)  # 1 hour expiration
-    return vertoken
+def generate_verification_token():
+    # Generate a secure token, stored with the rest of the session record by the caller
+    return secrets.token_urlsafe(32)
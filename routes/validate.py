@@ -1,46 +1,60 @@
-from flask import Blueprint, request, jsonify, current_app, make_response, after_this_request
-import requests
-from utils.extensions import cache
+from flask import Blueprint, request, jsonify, current_app, after_this_request, g
+from utils.extensions import session_store
+from utils.logsetup import log_body, session_ref
+from utils.tokens import tokens
+from utils.schemas import compile_schema, validate_json
 import uuid  # Import the uuid module for generating session ID
 import time
 import random
 import secrets
 from functools import wraps
-import traceback
 
 validate_bp = Blueprint('validate', __name__)
 
+# Checked before the token and nonce decorators read the session record
+VALIDATE_SCHEMA = {
+    'type': 'object',
+    'required': ['address'],
+    'maxProperties': 4,
+    'properties': {
+        'address': {'type': 'string', 'minLength': 1, 'maxLength': 300},
+    },
+}
+validate_body = compile_schema(VALIDATE_SCHEMA)
+
 def require_verification(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         try:
-            current_app.logger.info("Entering require_verification decorator")
+            current_app.logger.debug("Entering require_verification decorator")
             session_id = request.headers.get('Session-ID')
             verify_token = request.headers.get('Verification-Token')
 
-            # Log the received headers
-            current_app.logger.info(f"Headers: {dict(request.headers)}")
-
-            current_app.logger.info(f"Session ID: {session_id}, Verification Token: {verify_token}")
+            # Headers are logged (sampled and redacted) once per request in sdohapi.before_request
+            current_app.logger.info("Session ID: %s, Verification Token present: %s", session_ref(session_id),
+                                    bool(verify_token))
 
             if not session_id or not verify_token:
                 current_app.logger.warning("Missing session ID or validation token")
                 return jsonify({"error": "Missing session ID or validation token"}), 401
 
-#            current_app.logger.info(f"Attempting to retrieve token for session {session_id}")
-#            stored_token = cache.get(f"{session_id}_verification_token")
-#            current_app.logger.info(f"Retrieved token: {stored_token}")
+            if tokens.signed:
+                g.verify_claims = tokens.check('verify', verify_token, session_id)
+                if g.verify_claims is None:
+                    return jsonify({"error": "Invalid or expired verification token"}), 401
+            else:
+                # Cache mode: the token handed out by verify is kept in the session record
+                stored_token = session_store.get(session_id, 'verification_token')
+                if not stored_token or not secrets.compare_digest(stored_token, verify_token):
+                    return jsonify({"error": "Invalid or expired verification token"}), 401
 
-#            if not stored_token or stored_token != verify_token:
-#                return jsonify({"error": "Invalid or expired verification token"}), 401
-
-            current_app.logger.info("Verification successful, proceeding to route")
+            current_app.logger.debug("Verification successful, proceeding to route")
 
             # Call the wrapped function with the original arguments
             return f(*args, **kwargs)
         except Exception as e:
-            current_app.logger.error(f"Exception in require_verification decorator: {str(e)}")
-            current_app.logger.error(traceback.format_exc())  # Logs the full stack trace
+            # Logs the full stack trace, formatted on the log writer thread
+            current_app.logger.exception("Exception in require_verification decorator: %s", e)
             return jsonify({"error": "Internal server error"}), 500
     return decorated_function
 
@@ -50,20 +64,25 @@ def validate_nonce(f):
     def decorated_function(*args, **kwargs):
         session_id = request.headers.get("Session-ID")
         request_nonce = request.headers.get("X-CSP-Nonce")
-        current_app.logger.info(f"Session ID: {session_id}, Request Nonce: {request_nonce}")
+        current_app.logger.info("Session ID: %s, Request Nonce present: %s", session_ref(session_id),
+                                bool(request_nonce))
 
         if not request_nonce:
-            current_app.logger.info(f"Session ID: {session_id}, Missing request nonce")
+            current_app.logger.info("Session ID: %s, Missing request nonce", session_ref(session_id))
             return jsonify({"error": "Missing nonce"}), 401
 
-        stored_nonce = cache.get(f"{session_id}_verify_nonce")
-        current_app.logger.info(f"Session ID: {session_id}, Stored Nonce: {stored_nonce}")
-        if not stored_nonce or stored_nonce != request_nonce:
+        if tokens.signed:
+            # Checked against the nonce signed into the verification token (require_verification)
+            stored_nonce = g.verify_claims.get('nonce')
+        else:
+            stored_nonce = session_store.get(session_id, 'verify_nonce')
+        if not stored_nonce or not secrets.compare_digest(stored_nonce, request_nonce):
             return jsonify({"error": "Invalid or expired nonce"}), 401
 
         # Generate a new nonce for the next request
         validate_nonce = secrets.token_urlsafe(16)
-        cache.set(f"{session_id}_validate_nonce", validate_nonce, timeout=3600)
+        if not tokens.signed:
+            session_store.update(session_id, validate_nonce=validate_nonce)
 
         # Attach the new nonce to the response
         @after_this_request
@@ -74,30 +93,13 @@ def validate_nonce(f):
         return f(*args, **kwargs)
     return decorated_function
 
-@validate_bp.route('/api/validate', methods=['OPTIONS'])
-def cors_preflight():
-    current_app.logger.info(f"Incoming headers: {dict(request.headers)}")
-    # Handle OPTIONS preflight requests directly (no need for verification or nonce validation)
-    if request.method == 'OPTIONS':
-        origin = request.headers.get('Origin')
-        if origin in ["https://uhsvtsdohdapp01.utmck.edu", "https://sdohtest.utmck.edu"]:
-            response = make_response('', 204)  # No Content for preflight requests
-            response.headers['Access-Control-Allow-Origin'] = origin
-            response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, Session-ID, Verification-Token, Validation-Token, X-CSP-Nonce'
-            response.headers['Access-Control-Allow-Credentials'] = 'true'
-            return response
-        else:
-            return make_response('Forbidden', 403)
-
-
 # Secure method for all other methods (POST, GET, HEAD), use require_verification and validate_nonce decorators
 # Ensure the next function only runs with requests to */api/validate AND only with methods listed.
 @validate_bp.route('/api/validate', methods=['POST', 'GET', 'HEAD'])
+@validate_json(validate_body)
 @require_verification
 @validate_nonce
 def validate():
-    current_app.logger.info(f"Incoming headers: {dict(request.headers)}")
     if request.method == 'GET':
         return jsonify({'message': 'GET method not allowed for this endpoint'}), 405
 
@@ -105,18 +107,6 @@ def validate():
         current_app.logger.info("Received HEAD request")
         return '', 200
 
-    if request.method == 'OPTIONS':
-        origin = request.headers.get('Origin')
-        if origin in ["https://uhsvtsdohdapp01.utmck.edu", "https://sdohtest.utmck.edu"]:
-            response = make_response('', 204)  # No Content for preflight requests
-            response.headers['Access-Control-Allow-Origin'] = origin
-            response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, Session-Id, Verification-Token, Validation-Token, X-CSP-Nonce'
-            response.headers['Access-Control-Allow-Credentials'] = 'true'
-            return response
-        else:
-            return make_response('Forbidden', 403)
-
     if request.method == 'POST':
         if request.content_type != 'application/json':
             return jsonify({"error": "Unsupported Media Type"}), 415
@@ -130,11 +120,8 @@ def validate():
         address_choice = data.get("address")
 #add
         request_nonce = request.headers.get("X-CSP-Nonce")
-        current_app.logger.info(f"Session ID: {session_id}")
-        current_app.logger.info(f"Request Data: {data}")
-        current_app.logger.info(f"Address Chosen: {address_choice}")
-#add
-        current_app.logger.info(f"Request Nonce: {request_nonce}")
+        current_app.logger.info("Session ID: %s", session_ref(session_id))
+        log_body(current_app.logger, "Request Data", data)
 
         if not all([session_id, address_choice, verification_token]):
             if not verification_token:
@@ -144,31 +131,41 @@ def validate():
             if not address_choice:
                 return jsonify({"error": "Address choice missing in request body"}), 400
 
-        # Get the correct address from cache
-        correct_address = cache.get(f"{session_id}_correct_address")
-        current_app.logger.info(f"Correct Address: {correct_address}")
+        # Get the correct address from the session record (already loaded by validate_nonce in cache token mode)
+        correct_address = session_store.get(session_id, 'correct_address')
 
         if not correct_address:
             # If there's no correct address in cache, the session is invalid
-            cache.delete(f"{session_id}_correct_address")
-            # Clean up any other session data if necessary
-            # cache.delete(f"{session_id}_"
+            session_store.delete_many(session_id, 'correct_address')
             return jsonify({"error": "Invalid or expired session"}), 400
 
         if address_choice == correct_address:
             # User passed validation, deleting cache address because they would need to start over the validation process to go again
-            cache.delete(f"{session_id}_correct_address")
-            # Clean up other session data if necessary
-            cache.delete(f"{session_id}_tries")  # Reset tries on successful verification
+            # Tries are reset on successful verification
+            if tokens.signed:
+                # The verification token is used up; submit only needs the validation token
+                tokens.revoke(g.verify_claims)
+                validation_token = tokens.issue('validate', session_id)
+                session_store.update(session_id, drop=('correct_address', 'tries'))
+            else:
+                validation_token = generate_validation_token()
+                # The verification token is used up here too
+                session_store.update(
+                    session_id,
+                    drop=('correct_address', 'tries', 'verification_token'),
+                    validation_token=validation_token
+                )
             return jsonify({
                 "message": "Address validated successfully",
                 "session_id": session_id,
                 "isValidated": True,
-                "validationToken": generate_validation_token(session_id)
+                "validationToken": validation_token
             }), 200
         else:
             # User failed validation
-            cache.delete(f"{session_id}_correct_address")  # Clean up session data
+            session_store.delete_many(session_id, 'correct_address', 'verification_token')  # Clean up session data
+            if tokens.signed:
+                tokens.revoke(g.verify_claims)
             return jsonify({
                 "error": "Address validation failed",
                 "redirect": "/validation-failed",
@@ -185,10 +182,6 @@ def protected_route():
     return jsonify({"message": "Access granted to protected validation route"}), 200
 
 
-def generate_validation_token(session_id):
-    # Generate a secure token
-    valtoken = secrets.token_urlsafe(32)
-    # Store the token in cache with an expiration time
-    cache.set(f"{session_id}_validation_token", valtoken, timeout=3600)  # 1 hour expiration
-    return valtoken
-
+def generate_validation_token():
+    # Generate a secure token, stored with the rest of the session record by the caller
+    return secrets.token_urlsafe(32)
@@ -1,21 +1,36 @@
 import os
-from flask import Flask, request, make_response
+from flask import Flask, request, make_response, jsonify
 from flask_cors import CORS
 from routes.routes import verify_bp
 from routes.validate import validate_bp
-from routes.fscommit import submit_bp
-import ssl
+from routes.fscommit import submit_bp, deliver_submission, scoring_engine
+from routes.monitor import monitor_bp
 import logging
 from datetime import timedelta
-from utils.extensions import cache
+from utils.extensions import cache, session_store
+from utils.sweeper import CacheSweeper
+from utils.upstream import init_upstreams
+from utils.memo import corepoint_memo
+from utils.outbox import outbox
+from utils.formstack import payload_builder
+from utils import jsoncodec
+from utils.logsetup import init_logging, start_log_listener, log_headers
+from utils.metrics import metrics
+from utils.capture import init_capture, capture_writer
+from utils.cors import init_cors
+from utils.tokens import tokens
+from utils.ratelimit import limiter
+from utils.tls import server_context
 from config import load_environment, DevelopmentConfig, ProductionConfig
-from utils.extensions import generate_csp_nonce
+from utils.extensions import generate_csp_nonce, get_csp_nonce
 
 # Load environment variables
 load_environment()
 
 # Create Flask app instance
 app = Flask(__name__)
+# request.json and jsonify() in every blueprint go through utils/jsoncodec (orjson when installed)
+jsoncodec.init_app(app)
 
 #reload function
 def reload_config():
@@ -25,21 +40,21 @@ def reload_config():
     else:
         app.config.from_object(DevelopmentConfig)
         print("DEV config")
-    app.config['ENV_CERT_FILE'] = os.getenv('ENV_CERT_FILE')
+    # Re-read after load_environment(), so paths from the .env file apply
+    app.config['ENV_CERT_FILE'] = os.getenv('ENV_CERT_FILE', app.config['ENV_CERT_FILE'])
+    app.config['ENV_KEY_FILE'] = os.getenv('ENV_KEY_FILE', app.config['ENV_KEY_FILE'])
 
 # Reload configuration after loading environment variables
 reload_config()
+# Queue-backed logging: request threads never format or write log output themselves
+init_logging(app)
 
-# Define SSL certificate and key file paths
-#ca.crt
-CERT_FILE = "/etc/pki/tls/certs/uhsvtsdohdapp01.crt" #app.config['ENV_CERT_FILE']
-KEY_FILE = "/etc/pki/tls/private/uhsvtsdohdapp01.key" #app.config['ENV_KEY_FILE']
-
-# Create SSL context
-context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
-
-#context.load_cert_chain('/home/strawboss/sdohapi_unzip/uhsvtdohdapp01.crt',  '/home/strawboss/sdohapi_unzip/ca.key')
-context.load_cert_chain(CERT_FILE, KEY_FILE)
+# TLS for app.run() below, from ENV_CERT_FILE/ENV_KEY_FILE; under gunicorn see the
+# ssl_context hook in gunicorn_config.py. Both use the rotating context in utils/tls.py
+def create_ssl_context():
+    return server_context(app.config['ENV_CERT_FILE'], app.config['ENV_KEY_FILE'],
+                          rotation=app.config['TLS_TICKET_ROTATION'],
+                          minimum_version=app.config['TLS_MIN_VERSION'])
 
 #app.secret_key = "devkey"
 #@app.context_processor
@@ -49,22 +64,62 @@ context.load_cert_chain(CERT_FILE, KEY_FILE)
 #    return dict(nonce=g.nonce)
 
 
-cache.init_app(app,config={
-    'CACHE_TYPE': 'filesystem',
-    'CACHE_DIR': '/home/jclutter/flask_sessions',
-    'CACHE_DEFAULT_TIMEOUT': 1 * 3600  # 1 hours
-})
-
-
-# Enable CORS globally
+cache_sweeper = None
+if app.config.get('SESSION_BACKEND') == 'redis':
+    cache.init_app(app,config={
+        'CACHE_TYPE': 'RedisCache',
+        'CACHE_REDIS_URL': app.config['SESSION_REDIS_URL'],
+        'CACHE_DEFAULT_TIMEOUT': 1 * 3600  # 1 hours
+    })
+else:
+    cache.init_app(app,config={
+        'CACHE_TYPE': 'filesystem',
+        'CACHE_DIR': app.config['SESSION_CACHE_DIR'],
+        'CACHE_DEFAULT_TIMEOUT': 1 * 3600,  # 1 hours
+        # Never prune on the request thread; cache_sweeper expires files in the background
+        'CACHE_THRESHOLD': 0
+    })
+    cache_sweeper = CacheSweeper(
+        app.config['SESSION_CACHE_DIR'],
+        interval=app.config['CACHE_SWEEP_INTERVAL'],
+        batch_size=app.config['CACHE_SWEEP_BATCH']
+    )
+# Registered before the session store so its after_request (and the Server-Timing
+# header) runs last and includes the session commit
+metrics.init_app(app)
+session_store.init_app(app, sweeper=cache_sweeper)
+tokens.init_app(app)
+limiter.init_app(app)
+init_upstreams(app)
+corepoint_memo.init_app(app)
+# Falls back to the schema's fallback form, with a warning, if the selected one cannot take every scored field
+payload_builder.init_app(app, scoring_engine)
+outbox.init_app(app, deliver=deliver_submission)
+# Preflights are answered before Flask dispatch; wrapped inside capture so they are still recorded
+init_cors(app)
+# Opt-in: wraps app.wsgi_app to record tokenized request shapes for benchmarks/replay.py
+init_capture(app)
+
+
+def start_background_tasks():
+    # Threads do not survive fork, so this runs in each serving process: from the
+    # post_worker_init hook under gunicorn (gunicorn_config.py), from wsgi.py, or below
+    start_log_listener()
+    metrics.start()
+    if cache_sweeper is not None:
+        cache_sweeper.start()
+    outbox.start()
+    tokens.start()
+    if app.config['CAPTURE_ENABLED']:
+        capture_writer.start()
+
+
+# CORS headers on actual responses (preflights never reach Flask, see utils/cors.py)
 CORS(app, supports_credentials=True, resources={
     r"/*": {
-        "origins": [
-            "https://uhsvtsdohdapp01.utmck.edu",
-            "https://sdohtest.utmck.edu"
-        ],
-        "methods": ["POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Session-ID", "Verification-Token", "Validation-Token", "X-CSP-Nonce"],
+        "origins": app.config['CORS_ORIGINS'],
+        "methods": ["GET", "POST", "OPTIONS"],
+        "allow_headers": app.config['CORS_ALLOW_HEADERS'],
         "supports_credentials": True
     }
 })
@@ -75,8 +130,8 @@ app.config['SESSION_COOKIE_NAME'] = None
 
 @app.before_request
 def before_request():
-    app.logger.info("Flask App New request received")
-    app.logger.info(f"Headers: {dict(request.headers)}")
+    app.logger.debug("Flask App New request received: %s %s", request.method, request.path)
+    log_headers(app.logger, request.headers)
 
 #@app.after_request
 #def add_security_headers(response):
@@ -89,30 +144,27 @@ def before_request():
 app.register_blueprint(verify_bp) 
 app.register_blueprint(validate_bp)
 app.register_blueprint(submit_bp) 
+app.register_blueprint(monitor_bp)
 
-# Set up basic configuration for other loggers
-logging.basicConfig(level=logging.INFO)
+# Other loggers go through the root queue handler set up by init_logging()
 
 # Configure CORS logger specifically
 logger = logging.getLogger('flask_cors')
 logger.setLevel(logging.ERROR)
 
-# StreamHandler but control its level:
-cors_handler = logging.StreamHandler()
-cors_handler.setLevel(logging.ERROR)
-logger.addHandler(cors_handler)
-
 # Optionally, you can also set the 'cors' logger to ERROR level
 logging.getLogger('cors').setLevel(logging.ERROR)
 
+# Real preflights to /api are answered by utils/cors.py; a plain OPTIONS
+# (no Access-Control-Request-Method) still lands here for the CSP nonce
 @app.route('/api', methods=['OPTIONS'])
 def api_root():
     origin = request.headers.get('Origin')
-    if origin in ["https://uhsvtsdohdapp01.utmck.edu", "https://sdohtest.utmck.edu"]:
+    if origin in app.config['CORS_ORIGINS']:
         response = make_response('', 204)
         response.headers['Access-Control-Allow-Origin'] = origin
         response.headers['Access-Control-Allow-Methods'] = 'POST, GET, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, Session-ID, Verification-Token, Validation-Token, X-CSP-Nonce'
+        response.headers['Access-Control-Allow-Headers'] = ', '.join(app.config['CORS_ALLOW_HEADERS'])
         response.headers['Access-Control-Allow-Credentials'] = 'true'
 
         # Generate and include the CSP nonce
@@ -131,19 +183,20 @@ def api_root():
 @app.route('/api/get-csp-nonce', methods=['GET'])
 def get_csp_nonce_api():
     origin = request.headers.get('Origin')
-    if origin in ["https://uhsvtsdohdapp01.utmck.edu", "https://sdohtest.utmck.edu"]:
+    if origin in app.config['CORS_ORIGINS']:
         csp_nonce = get_csp_nonce()
         response = make_response(jsonify({'nonce': csp_nonce}))
         response.headers['Access-Control-Allow-Origin'] = origin
         response.headers['Access-Control-Allow-Credentials'] = 'true'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, Session-ID, Verification-Token, Validation-Token, X-CSP-Nonce'
+        response.headers['Access-Control-Allow-Headers'] = ', '.join(app.config['CORS_ALLOW_HEADERS'])
         return response
     else:
         return make_response('Forbidden', 403)
 
 
 if __name__ == '__main__':
+    start_background_tasks()
 #    app.run(host='uhsvtsdohdapp01.utmck.edu',ssl_context=context, debug=True)
-    app.run(host='0.0.0.0',ssl_context=context, debug=False)
+    app.run(host='0.0.0.0',ssl_context=create_ssl_context(), debug=False)
 # SWITCH TO 0.0.0.0 FOR TESTING ONLY
 
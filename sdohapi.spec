@@ -1,38 +1,74 @@
 # -*- mode: python ; coding: utf-8 -*-
+import os
 
+# SDOHAPI_BUILD=onedir builds a folder (dist/sdohapi/) without UPX. The default
+# one-file build unpacks and decompresses the whole bundle into a temp dir on
+# every launch; the folder build starts straight from disk. See
+# benchmarks/bench_startup.py for the difference.
+ONEDIR = os.environ.get('SDOHAPI_BUILD', 'onefile') == 'onedir'
 
 a = Analysis(
     ['sdohapi.py'],
     pathex=[],
     binaries=[],
-    datas=[],
+    datas=[('utils/sdoh_rules.json', 'utils'), ('utils/formstack_schema.json', 'utils')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # Offline tools and server-only packages the executable never imports
+    excludes=['numpy', 'gevent', 'gunicorn', 'tkinter'] if ONEDIR else [],
     noarchive=False,
-    optimize=0,
+    # Bytecode is compiled at build time either way; 1 also drops asserts
+    optimize=1 if ONEDIR else 0,
 )
 pyz = PYZ(a.pure)
 
-exe = EXE(
-    pyz,
-    a.scripts,
-    a.binaries,
-    a.datas,
-    [],
-    name='sdohapi',
-    debug=False,
-    bootloader_ignore_signals=False,
-    strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
-    console=True,
-    disable_windowed_traceback=False,
-    argv_emulation=False,
-    target_arch=None,
-    codesign_identity=None,
-    entitlements_file=None,
-)
+if ONEDIR:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        [],
+        exclude_binaries=True,
+        name='sdohapi',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=False,
+        console=True,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+    )
+    coll = COLLECT(
+        exe,
+        a.binaries,
+        a.datas,
+        strip=False,
+        upx=False,
+        upx_exclude=[],
+        name='sdohapi',
+    )
+else:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        a.binaries,
+        a.datas,
+        [],
+        name='sdohapi',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=True,
+        upx_exclude=[],
+        runtime_tmpdir=None,
+        console=True,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+    )
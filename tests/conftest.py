@@ -0,0 +1,111 @@
+# conftest.py
+# The app is imported once per test run with SESSION_BACKEND=redis, against an
+# in-process fakeredis server instead of a Redis host, with every on-disk path
+# under a temp directory and Corepoint answered by a local transport adapter.
+#
+#   pip install pytest fakeredis lupa   (lupa runs the rate limit Lua script)
+#   python -m pytest -q
+import os
+import sys
+
+import pytest
+import requests
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TESTS)
+sys.path.insert(0, ROOT)
+
+COREPOINT_URL = 'http://corepoint.test/verify'
+ADDRESS = '1924 Alcoa Hwy Apt 4B'
+COREPOINT_REPLY = {'IDS': {
+    'MRN': '000123456', 'FIN': '987654321012', 'ZIP': '37920', 'VALID': 'true', 'ADDRESS': ADDRESS,
+    'BAD_ADDS': [{'BAD_ADD': '310 Gay St'}, {'BAD_ADD': '5021 Kingston Pike'}],
+}}
+
+
+class CorepointAdapter(requests.adapters.BaseAdapter):
+    """Answers every Corepoint call with `reply`, so the upstream client, breaker and bulkhead still run."""
+
+    def __init__(self, reply=COREPOINT_REPLY, status_code=200):
+        super().__init__()
+        self.reply = reply
+        self.status_code = status_code
+        self.calls = 0
+
+    def send(self, request, **kwargs):
+        from utils import jsoncodec
+        self.calls += 1
+        response = requests.Response()
+        response.status_code = self.status_code
+        response._content = jsoncodec.dumpb(self.reply)
+        response.headers['Content-Type'] = 'application/json'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(scope='session')
+def redis_server():
+    fakeredis = pytest.importorskip('fakeredis')
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def fake_redis(redis_server, monkeypatch):
+    """Every Redis client built with from_url while the test runs shares the fake server."""
+    import fakeredis
+    import redis
+    monkeypatch.setattr(redis.Redis, 'from_url',
+                        classmethod(lambda cls, url, **kwargs: fakeredis.FakeRedis(server=redis_server, **kwargs)))
+    return fakeredis.FakeRedis(server=redis_server)
+
+
+@pytest.fixture(scope='session')
+def app(redis_server, tmp_path_factory):
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    import redis
+
+    workdir = tmp_path_factory.mktemp('sdohapi')
+    patch = pytest.MonkeyPatch()
+    for name, value in {
+        'FLASK_ENV': 'development',
+        'SECRET_KEY': 'test-secret',
+        'SESSION_BACKEND': 'redis',
+        'ENV_CP_API_URL': COREPOINT_URL,
+        'OUTBOX_PATH': str(workdir / 'outbox.db'),
+        'TOKEN_REVOCATION_PATH': str(workdir / 'revoked.db'),
+        'RATE_LIMIT_PATH': str(workdir / 'ratelimit.db'),
+        'BULKHEAD_DIR': str(workdir / 'bulkhead'),
+        'METRICS_DIR': str(workdir / 'metrics'),
+        'SESSION_CACHE_DIR': str(workdir / 'sessions'),
+        'SESSION_STAMP_PATH': str(workdir / 'session-stamps'),
+        # Every test client is 127.0.0.1; test_ratelimit checks the IP rule with forwarded clients
+        'VERIFY_LIMIT_IP': '1000/300',
+    }.items():
+        patch.setenv(name, value)
+    # Every Redis client the app builds (sessions, flask_caching, limits, revocations) shares the fake server
+    patch.setattr(redis.Redis, 'from_url',
+                  classmethod(lambda cls, url, **kwargs: fakeredis.FakeRedis(server=redis_server, **kwargs)))
+
+    import sdohapi
+    sdohapi.app.config['TESTING'] = True
+    yield sdohapi.app
+    patch.undo()
+
+
+@pytest.fixture
+def corepoint(app):
+    from utils.upstream import corepoint as client
+    adapter = CorepointAdapter()
+    client.session.mount('http://', adapter)
+    yield adapter
+    client.configure()  # next use builds a fresh session without the adapter
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,157 @@
+import gzip
+import json
+import os
+import sys
+
+import pytest
+from flask import Flask, jsonify, request
+
+from conftest import ROOT
+
+from utils.capture import CaptureMiddleware, CaptureWriter
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+replay = pytest.importorskip('replay')
+
+SESSION_ID = '6f1c2a9e-3b7d-4e0a-9c51-2f8e7d6b4a10'
+NEW_SESSION_ID = '0b7e4c1d-9a2f-4d3e-8c6b-5a1f2e3d4c5b'
+SUBMISSION_ID = '9d8c7b6a-5f4e-4d3c-2b1a-0f9e8d7c6b5a'
+VERIFY = {'firstName': 'Jordan', 'lastName': 'Captured', 'dob': '1984-07-12', 'freshen': True}
+
+
+class ListWriter:
+    def __init__(self):
+        self.records = []
+
+    def put(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def captured():
+    app = Flask(__name__)
+    seen = {}
+
+    @app.route('/api/verify', methods=['POST'])
+    def verify():
+        seen['body'] = request.get_json()
+        return jsonify({'session_id': NEW_SESSION_ID, 'tries': 1})
+
+    @app.route('/api/submit', methods=['POST'])
+    def submit():
+        return jsonify({'submission_id': SUBMISSION_ID}), 202
+
+    @app.route('/api/submit/<submission_id>')
+    def status(submission_id):
+        return jsonify({'status': 'queued'})
+
+    @app.route('/api/monitor/stats')
+    def stats():
+        return jsonify({})
+
+    writer = ListWriter()
+    app.wsgi_app = CaptureMiddleware(app.wsgi_app, writer, 'capture-key')
+    return app.test_client(), app.wsgi_app, writer.records, seen
+
+
+def test_verify_is_recorded_without_patient_details(captured):
+    client, middleware, records, seen = captured
+    response = client.post('/api/verify', json=VERIFY, headers={'Session-ID': SESSION_ID})
+    # The route still reads the body and the client still gets the reply
+    assert seen['body'] == VERIFY
+    assert response.get_json()['session_id'] == NEW_SESSION_ID
+
+    record, = records
+    text = json.dumps(record)
+    for value in ('Jordan', 'Captured', '1984-07-12', SESSION_ID, NEW_SESSION_ID):
+        assert value not in text
+    assert (record['m'], record['p'], record['st']) == ('POST', '/api/verify', 200)
+    assert record['s'] == middleware.token(SESSION_ID)
+    assert record['ns'] == middleware.token(NEW_SESSION_ID)
+    assert record['b']['fr'] is True and record['tr'] == 1
+
+
+def test_patient_token_ignores_case_and_spacing(captured):
+    client, _middleware, records, _seen = captured
+    client.post('/api/verify', json=VERIFY)
+    client.post('/api/verify', json=dict(VERIFY, firstName=' JORDAN ', freshen=False))
+    client.post('/api/verify', json=dict(VERIFY, firstName='Morgan'))
+    first, same, other = (record['b']['pt'] for record in records)
+    assert first == same != other
+    assert records[1]['b']['fr'] is False
+
+
+def test_submit_keeps_only_the_shape_of_the_answers(captured):
+    client, middleware, records, _seen = captured
+    client.post('/api/submit', json={'participation': 'I choose to participate', 'foodSecurity': 'Never',
+                                     'housingCondition': [], 'requestHelp': ''},
+                headers={'Idempotency-Key': 'key-1'})
+    client.post('/api/submit', json={'participation': 'Jordan Captured'})
+    client.get(f'/api/submit/{SUBMISSION_ID}')
+    submitted, free_text, polled = records
+    assert submitted['b'] == {'pa': 'I choose to participate', 'n': 1}
+    assert submitted['ik'] == middleware.token('key-1')
+    assert free_text['b']['pa'] == 'other'
+    assert polled['p'] == '/api/submit/{id}'
+    assert polled['sub'] == submitted['sub'] == middleware.token(SUBMISSION_ID)
+
+
+def test_monitor_and_non_api_paths_are_not_recorded(captured):
+    client, _middleware, records, _seen = captured
+    client.get('/api/monitor/stats')
+    client.get('/elsewhere')
+    assert records == []
+
+
+def test_capture_needs_a_key():
+    with pytest.raises(ValueError):
+        CaptureMiddleware(Flask(__name__).wsgi_app, ListWriter(), '')
+
+
+def test_written_capture_reads_back_in_order(tmp_path):
+    writer = CaptureWriter(str(tmp_path), flush_interval=0.05)
+    writer.start()
+    for t in (3.0, 1.0, 2.0):
+        writer.put({'t': t, 'm': 'GET', 'p': '/api/submit/{id}'})
+    writer.stop()
+    # A worker killed mid-write leaves a truncated file behind
+    with open(tmp_path / 'capture-999999.jsonl.gz', 'wb') as f:
+        f.write(gzip.compress(b'{"t":0.5,"m":"GET","p":"/api/verify"}\n{"t":4')[:-12])
+    records = replay.read_capture([str(tmp_path)])
+    assert [record['t'] for record in records][-3:] == [1.0, 2.0, 3.0]
+
+
+def test_replay_reproduces_the_recorded_outcome():
+    journeys = replay.Journeys()
+    failed = {'m': 'POST', 'p': '/api/verify', 'st': 502, 's': 'pre', 'b': {'pt': 'p1'}}
+    missed = {'m': 'POST', 'p': '/api/verify', 'st': 404, 's': 'pre', 'b': {'pt': 'p1', 'fr': True}}
+    _method, _path, headers, payload = replay.build_request(failed, journeys)
+    assert payload['lastName'].startswith(replay.FAIL_MARKER)
+    _method, _path, again, payload = replay.build_request(missed, journeys)
+    assert payload['lastName'].startswith(replay.NOVISIT_MARKER) and payload['freshen'] is True
+    # Same pre-verify session token, same live Session-ID, so tries keep counting
+    assert again['Session-ID'] == headers['Session-ID']
+
+
+def test_replay_threads_live_ids_through_a_journey():
+    journeys = replay.Journeys()
+    verified = {'m': 'POST', 'p': '/api/verify', 'st': 200, 'ns': 'sess', 'b': {'pt': 'p1'}}
+    journeys.remember(verified, {'session_id': 'live-session', 'verificationToken': 'vt', 'verify_nonce': 'n'})
+
+    _method, _path, headers, payload = replay.build_request(
+        {'m': 'POST', 'p': '/api/validate', 'st': 200, 's': 'sess'}, journeys)
+    assert payload == {'address': replay.ADDRESS}
+    assert (headers['Session-ID'], headers['Verification-Token'], headers['X-CSP-Nonce']) == ('live-session', 'vt', 'n')
+    journeys.remember({'s': 'sess'}, {'validationToken': 'valt'})
+
+    submit = {'m': 'POST', 'p': '/api/submit', 'st': 202, 's': 'sess', 'sub': 'sub1', 'ik': 'k1',
+              'b': {'pa': 'I choose to participate', 'n': 2}}
+    _method, _path, headers, payload = replay.build_request(submit, journeys)
+    assert headers['Validation-Token'] == 'valt'
+    assert len(payload) == 3
+    # A duplicate submit reuses the live key, so it stays a duplicate
+    assert replay.build_request(submit, journeys)[2]['Idempotency-Key'] == headers['Idempotency-Key']
+    journeys.remember(submit, {'submission_id': 'live-submission'})
+
+    poll = {'m': 'GET', 'p': '/api/submit/{id}', 'sub': 'sub1'}
+    assert replay.build_request(poll, journeys)[1] == '/api/submit/live-submission'
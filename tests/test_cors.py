@@ -0,0 +1,63 @@
+import pytest
+from flask import Flask
+
+from utils.cors import PreflightMiddleware
+
+ORIGIN = 'https://sdohtest.utmck.edu'
+
+
+def preflight(client, path, origin=ORIGIN):
+    return client.options(path, headers={'Origin': origin, 'Access-Control-Request-Method': 'POST',
+                                         'Access-Control-Request-Headers': 'content-type, session-id'})
+
+
+@pytest.mark.parametrize('path', ['/api', '/api/verify', '/api/validate', '/api/submit'])
+def test_preflight_from_an_allowed_origin(app, client, path):
+    response = preflight(client, path)
+    assert response.status_code == 204
+    assert response.headers['Access-Control-Allow-Origin'] == ORIGIN
+    assert response.headers['Access-Control-Allow-Methods'] == 'GET, POST, OPTIONS'
+    assert response.headers['Access-Control-Allow-Headers'] == ', '.join(app.config['CORS_ALLOW_HEADERS'])
+    assert response.headers['Access-Control-Allow-Credentials'] == 'true'
+    assert response.headers['Access-Control-Max-Age'] == str(app.config['CORS_MAX_AGE'])
+    assert response.headers['Vary'] == 'Origin'
+    assert response.data == b''
+
+
+@pytest.mark.parametrize('origin', ['https://evil.example', None])
+def test_preflight_from_an_unknown_origin_is_forbidden(client, origin):
+    headers = {'Access-Control-Request-Method': 'POST'}
+    if origin:
+        headers['Origin'] = origin
+    response = client.options('/api/verify', headers=headers)
+    assert response.status_code == 403
+    assert response.data == b'Forbidden'
+    assert 'Access-Control-Allow-Origin' not in response.headers
+
+
+def test_plain_options_on_api_still_serves_the_csp_nonce(client):
+    response = client.options('/api', headers={'Origin': ORIGIN})
+    assert response.status_code == 204
+    assert response.headers['Access-Control-Allow-Origin'] == ORIGIN
+    nonce = response.headers['X-CSP-Nonce']
+    assert f"'nonce-{nonce}'" in response.headers['Content-Security-Policy']
+    assert client.options('/api', headers={'Origin': 'https://evil.example'}).status_code == 403
+
+
+def test_plain_options_on_a_route_goes_to_flask(client):
+    response = client.options('/api/verify', headers={'Origin': ORIGIN})
+    # Flask's automatic OPTIONS answer, with flask_cors headers on it
+    assert response.status_code == 200
+    assert 'POST' in response.headers['Allow']
+    assert response.headers['Access-Control-Allow-Origin'] == ORIGIN
+    assert 'Access-Control-Max-Age' not in response.headers
+
+
+def test_middleware_passes_everything_else_through():
+    app = Flask(__name__)
+    app.add_url_rule('/ping', 'ping', lambda: 'pong', methods=['GET', 'POST'])
+    app.wsgi_app = PreflightMiddleware(app.wsgi_app, [ORIGIN], ['Content-Type'], 600)
+    client = app.test_client()
+    assert client.post('/ping', headers={'Origin': ORIGIN}).data == b'pong'
+    response = client.options('/ping', headers={'Origin': ORIGIN, 'Access-Control-Request-Method': 'POST'})
+    assert (response.status_code, response.headers['Access-Control-Max-Age']) == (204, '600')
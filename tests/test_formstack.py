@@ -0,0 +1,67 @@
+import json
+import logging
+
+import pytest
+from flask import Flask
+
+from utils.formstack import SCHEMA_PATH, FormstackSchemaError, PayloadBuilder, SubmissionRecord
+from utils.scoring import ScoringEngine
+
+
+@pytest.fixture(scope='module')
+def engine():
+    return ScoringEngine.from_file()
+
+
+@pytest.fixture
+def schema():
+    with open(SCHEMA_PATH) as f:
+        return json.load(f)
+
+
+def init(engine, tmp_path, schema, environment):
+    path = tmp_path / 'formstack_schema.json'
+    path.write_text(json.dumps(schema))
+    app = Flask(__name__)
+    app.config['FORMSTACK_SCHEMA_ENV'] = environment
+    builder = PayloadBuilder()
+    builder.init_app(app, engine, path=str(path))
+    return builder
+
+
+def test_production_starts_on_the_fallback_form(engine, tmp_path, schema, caplog):
+    # The shipped production map has no domain or score ids yet
+    with caplog.at_level(logging.WARNING, logger='utils.formstack'):
+        builder = init(engine, tmp_path, schema, 'production')
+    assert builder.environment == schema['fallback'] == 'development'
+    assert builder.form_id == '5848665'
+    assert 'domain.safety' in caplog.text
+
+
+def test_complete_map_is_used(engine, tmp_path, schema):
+    schema['environments']['production'] = dict(schema['environments']['development'], form_id='5780073')
+    builder = init(engine, tmp_path, schema, 'production')
+    assert builder.environment == 'production'
+    assert builder.url == 'https://www.formstack.com/api/v2/form/5780073/submission.json'
+
+
+def test_unknown_environment_falls_back(engine, tmp_path, schema):
+    assert init(engine, tmp_path, schema, 'staging').environment == 'development'
+
+
+def test_incomplete_fallback_fails_startup(engine, tmp_path, schema):
+    del schema['environments']['development']['fields']['score.safety']
+    with pytest.raises(FormstackSchemaError, match='score.safety'):
+        init(engine, tmp_path, schema, 'production')
+
+
+def test_payload_fields(engine, tmp_path, schema):
+    builder = init(engine, tmp_path, schema, 'development')
+    answers = {'housingCondition': ['Mold', 'Water leaks'], 'foodSecurity': 'Often true'}
+    result = engine.score(answers)
+    payload = builder.build(SubmissionRecord('Jordan', 'Example', '1984-07-12', '1', '2', '2024-03-01', '10:42',
+                                             answers, result.domains, result.scores))
+    assert payload['field_169568839'] == {'first': 'Jordan', 'last': 'Example'}
+    assert payload['field_169568842'] == 'Mold\nWater leaks'
+    assert payload['field_173549893'] == 'POSITIVE'
+    assert payload['field_173550244'] == 0
@@ -0,0 +1,96 @@
+import datetime
+import decimal
+import json
+import uuid
+
+import pytest
+from flask import Flask, jsonify, request
+
+from utils import jsoncodec
+
+VALUES = {
+    'name': 'Zoë Ñúñez',
+    'count': 3,
+    'ratio': 0.5,
+    'flags': [True, False, None],
+    'nested': {'b': 1, 'a': [1, 2]},
+}
+
+
+@pytest.fixture
+def codec_app():
+    app = Flask(__name__)
+    jsoncodec.init_app(app)
+
+    @app.route('/echo', methods=['POST'])
+    def echo():
+        return jsonify(request.get_json())
+
+    return app
+
+
+def test_round_trip():
+    encoded = jsoncodec.dumpb(VALUES)
+    assert isinstance(encoded, bytes)
+    assert jsoncodec.loads(encoded) == VALUES
+    assert jsoncodec.loads(encoded.decode('utf-8')) == VALUES
+    assert jsoncodec.loads(memoryview(encoded)) == VALUES
+    # Whatever the backend, the stdlib reads it back the same
+    assert json.loads(jsoncodec.dumps(VALUES)) == VALUES
+
+
+def test_sort_keys_and_indent():
+    assert jsoncodec.dumps({'b': 1, 'a': 2}, sort_keys=True) == '{"a":2,"b":1}'
+    assert jsoncodec.dumps({'a': 1}, indent=True) == '{\n  "a": 1\n}'
+
+
+def test_types_flask_can_encode():
+    encoded = jsoncodec.loads(jsoncodec.dumpb({
+        'date': datetime.date(2024, 7, 12),
+        'amount': decimal.Decimal('1.50'),
+        'id': uuid.UUID('6f1c2a9e-3b7d-4e0a-9c51-2f8e7d6b4a10'),
+    }))
+    assert encoded['amount'] == '1.50'
+    assert encoded['id'] == '6f1c2a9e-3b7d-4e0a-9c51-2f8e7d6b4a10'
+    assert '2024' in encoded['date']
+
+
+def test_values_outside_the_fast_path():
+    # Above 64 bits, so orjson hands it to the stdlib
+    assert jsoncodec.loads(jsoncodec.dumpb({'big': 2 ** 70})) == {'big': 2 ** 70}
+    with pytest.raises(TypeError):
+        jsoncodec.dumpb({'unencodable': object()})
+
+
+def test_malformed_input_raises_a_value_error():
+    # orjson.JSONDecodeError and json.JSONDecodeError are both ValueErrors
+    for data in (b'{"name": ', b'', b'\xff'):
+        with pytest.raises(ValueError):
+            jsoncodec.loads(data)
+
+
+def test_provider_round_trip(codec_app):
+    response = codec_app.test_client().post('/echo', json=VALUES)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    assert response.data.endswith(b'\n')
+    assert response.get_json() == VALUES
+
+
+def test_provider_keeps_stdlib_options(codec_app):
+    with codec_app.app_context():
+        assert codec_app.json.dumps({'a': 1}, separators=(',', '=')) == '{"a"=1}'
+        assert codec_app.json.loads('{"a": 1.5}', parse_float=decimal.Decimal) == {'a': decimal.Decimal('1.5')}
+
+
+def test_malformed_body_is_a_bad_request(codec_app):
+    response = codec_app.test_client().post('/echo', data=b'{"name": ', content_type='application/json')
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('body', [b'{"firstName": ', b'[1, 2]', b'"text"'])
+def test_routes_answer_malformed_bodies_with_json_errors(client, body):
+    response = client.post('/api/verify', data=body, content_type='application/json',
+                           headers={'Session-ID': str(uuid.uuid4())})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid request body'
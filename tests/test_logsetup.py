@@ -0,0 +1,124 @@
+import json
+import logging
+import threading
+
+import pytest
+from flask import Flask
+
+from utils import logsetup
+from utils.logsetup import init_logging, log_body, log_headers, session_ref, stop_log_listener
+
+SESSION_ID = '6f1c2a9e-3b7d-4e0a-9c51-2f8e7d6b4a10'
+
+
+@pytest.fixture
+def logged(tmp_path):
+    """Logging to a file for one test: setup(**config) initializes it for an app, read() flushes and returns the lines."""
+    root = logging.getLogger()
+    saved = dict(logsetup._pipeline), dict(logsetup._settings), root.level
+    path = tmp_path / 'app.log'
+
+    def setup(**config):
+        app = Flask(__name__)
+        app.config.update(LOG_FILE=str(path), SECRET_KEY='test', LOG_LEVEL='INFO', **config)
+        init_logging(app)
+        return app
+
+    def read():
+        stop_log_listener()
+        return path.read_text().splitlines()
+
+    yield setup, read
+
+    stop_log_listener()
+    root.removeHandler(logsetup._pipeline['handler'])
+    pipeline, settings, level = saved
+    logsetup._pipeline.update(pipeline, listener=None)
+    logsetup._settings.update(settings)
+    if pipeline['handler'] is not None:
+        root.addHandler(pipeline['handler'])
+        logsetup.start_log_listener()
+    root.setLevel(level)
+
+
+class FormattedOn:
+    """Records the thread that turns it into text."""
+
+    def __init__(self):
+        self.thread = None
+
+    def __str__(self):
+        self.thread = threading.current_thread().name
+        return 'formatted'
+
+
+def test_records_are_formatted_by_the_listener_thread(logged):
+    setup, read = logged
+    app = setup()
+    arg = FormattedOn()
+    app.logger.info('value: %s', arg)
+    assert read()[-1].endswith('value: formatted')
+    assert arg.thread is not None and arg.thread != threading.current_thread().name
+
+
+def test_set_up_again_writes_through_the_new_target(logged):
+    setup, read = logged
+    setup()
+    app = setup(LOG_FORMAT='json')
+    app.logger.warning('after reconfiguring')
+    entry = json.loads(read()[-1])
+    assert (entry['level'], entry['msg']) == ('WARNING', 'after reconfiguring')
+
+
+def test_session_ids_are_hashed(logged):
+    setup, read = logged
+    app = setup()
+    app.logger.info('Session ID: %s', session_ref(SESSION_ID))
+    app.logger.info('Session ID: %s', session_ref(SESSION_ID))
+    app.logger.info('Session ID: %s', session_ref(None))
+    lines = read()
+    assert SESSION_ID not in '\n'.join(lines)
+    first, second, missing = (line.rsplit(': ', 1)[1] for line in lines[-3:])
+    # Stable, so one session's lines can still be followed
+    assert first == second and first.startswith('sid:')
+    assert missing == '-'
+
+
+def test_session_ids_are_logged_with_full_headers(logged):
+    setup, read = logged
+    app = setup(LOG_HEADERS='full')
+    app.logger.info('Session ID: %s', session_ref(SESSION_ID))
+    assert read()[-1].endswith(SESSION_ID)
+
+
+def test_headers_and_bodies_are_redacted(logged):
+    setup, read = logged
+    app = setup()
+    log_headers(app.logger, {'Session-ID': SESSION_ID, 'Verification-Token': 'secret-token', 'Accept': 'json'})
+    log_body(app.logger, 'Request Data', {'firstName': 'Jordan', 'dob': '1984-07-12', 'freshen': True})
+    text = '\n'.join(read())
+    for value in (SESSION_ID, 'secret-token', 'Jordan', '1984-07-12'):
+        assert value not in text
+    assert "'Session-ID': '<redacted>'" in text and "'Accept': 'json'" in text
+    assert "'firstName': '<str:6>'" in text and "'freshen': True" in text
+
+
+def test_dumps_are_off_when_configured(logged):
+    setup, read = logged
+    app = setup(LOG_HEADERS='off', LOG_BODIES='off')
+    log_headers(app.logger, {'Accept': 'json'})
+    log_body(app.logger, 'Request Data', {'firstName': 'Jordan'})
+    app.logger.info('marker')
+    lines = read()
+    assert len(lines) == 1 and lines[0].endswith('marker')
+
+
+def test_routes_log_the_hashed_session_id(app, client, corepoint, caplog):
+    caplog.set_level(logging.INFO)
+    client.post('/api/validate', json={'address': 'x'},
+                headers={'Session-ID': SESSION_ID, 'Verification-Token': 'x', 'X-CSP-Nonce': 'x'})
+    client.post('/api/verify', json={'firstName': 'Jordan', 'lastName': 'Logged', 'dob': '1984-07-12'},
+                headers={'Session-ID': SESSION_ID})
+    messages = [record.getMessage() for record in caplog.records]
+    assert any(message.startswith('Session ID: sid:') for message in messages)
+    assert not any(SESSION_ID in message for message in messages)
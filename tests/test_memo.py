@@ -0,0 +1,167 @@
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils import memo as memo_module
+from utils.memo import LookupMemo
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(memo_module, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def memo(clock):
+    return LookupMemo(ttl=30, max_entries=2, wait_timeout=5)
+
+
+class Fetch:
+    """Counts calls; returns `result`, or raises it when it is an exception."""
+
+    def __init__(self, result=(200, {'mrn': '000123456'})):
+        self.result = result
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def test_repeat_lookup_is_answered_from_the_memo(memo, clock):
+    fetch = Fetch()
+    key = memo.key('Jordan', 'Memo', '1984-07-12')
+    assert memo.lookup(key, fetch) == (200, {'mrn': '000123456'})
+    # Same identity, differently typed
+    assert memo.lookup(memo.key(' JORDAN', 'memo ', '1984-07-12'), fetch) == [200, {'mrn': '000123456'}]
+    assert fetch.calls == 1
+    clock.now += 31
+    memo.lookup(key, fetch)
+    assert fetch.calls == 2
+    assert memo.stats()['hits'] == 1
+
+
+def test_entries_are_encrypted_and_keyed_by_hmac(memo):
+    key = memo.key('Jordan', 'Memo', '1984-07-12')
+    memo.lookup(key, Fetch())
+    assert b'Jordan' not in key
+    _expires, token = memo._entries[key]
+    assert b'000123456' not in token
+    # Another worker's memo has its own salt
+    assert LookupMemo().key('Jordan', 'Memo', '1984-07-12') != key
+
+
+def test_only_cacheable_results_are_kept(memo):
+    fetch = Fetch((404, None))
+    for _ in range(2):
+        memo.lookup('k', fetch, cacheable=lambda result: result[0] == 200)
+    assert fetch.calls == 2
+
+
+def test_refresh_replaces_the_memoised_result(memo):
+    memo.lookup('k', Fetch((200, {'v': 1})))
+    assert memo.lookup('k', Fetch((200, {'v': 2})), refresh=True) == (200, {'v': 2})
+    assert memo.lookup('k', Fetch()) == [200, {'v': 2}]
+    assert memo.stats()['bypassed'] == 1
+
+
+def test_least_recently_used_entry_is_evicted(memo):
+    for key in ('a', 'b'):
+        memo.lookup(key, Fetch())
+    memo.lookup('a', Fetch())
+    memo.lookup('c', Fetch())
+    assert list(memo._entries) == ['a', 'c']
+
+
+def test_zero_ttl_turns_the_memo_off(clock):
+    memo = LookupMemo(ttl=0)
+    fetch = Fetch()
+    memo.lookup('k', fetch)
+    memo.lookup('k', fetch)
+    assert fetch.calls == 2 and not memo.stats()['enabled']
+
+
+def concurrent_lookups(memo, fetch, count=6):
+    """Starts `count` identical lookups while `fetch` is held; returns (release, futures)."""
+    release, started = threading.Event(), threading.Event()
+
+    def held():
+        started.set()
+        release.wait(5)
+        return fetch()
+
+    pool = ThreadPoolExecutor(max_workers=count)
+    futures = [pool.submit(memo.lookup, 'k', held)]
+    started.wait(5)
+    futures += [pool.submit(memo.lookup, 'k', held) for _ in range(count - 1)]
+    pool.shutdown(wait=False)
+    return release, futures
+
+
+def wait_for_waiters(memo, count):
+    # The followers are parked on the leader's flight once they have counted their lookup
+    for _ in range(500):
+        if memo.stats()['lookups'] == count:
+            return
+        threading.Event().wait(0.01)
+
+
+def test_identical_lookups_in_flight_share_one_call(memo):
+    fetch = Fetch()
+    release, futures = concurrent_lookups(memo, fetch)
+    wait_for_waiters(memo, 6)
+    release.set()
+    results = [future.result(5) for future in futures]
+    assert fetch.calls == 1
+    assert results.count((200, {'mrn': '000123456'})) == 6
+    assert memo.stats()['coalesced'] == 5
+
+
+def test_waiters_get_the_leaders_error(memo):
+    fetch = Fetch(ConnectionError('Corepoint down'))
+    release, futures = concurrent_lookups(memo, fetch, count=3)
+    wait_for_waiters(memo, 3)
+    release.set()
+    for future in futures:
+        with pytest.raises(ConnectionError):
+            future.result(5)
+    assert fetch.calls == 1
+    # Nothing memoised or left in flight; the next lookup calls again
+    assert memo.lookup('k', Fetch()) == (200, {'mrn': '000123456'})
+
+
+def test_waiter_gives_up_on_a_stuck_leader(memo):
+    memo.wait_timeout = 0.05
+    release, futures = concurrent_lookups(memo, Fetch(), count=1)
+    # The follower times out and makes its own call while the leader is still held
+    fetch = Fetch()
+    assert memo.lookup('k', fetch) == (200, {'mrn': '000123456'})
+    assert fetch.calls == 1
+    release.set()
+    futures[0].result(5)
+
+
+def test_verify_repeats_share_a_corepoint_call(client, corepoint):
+    body = {'firstName': 'Jordan', 'lastName': f'Memo-{uuid.uuid4().hex[:8]}', 'dob': '1984-07-12'}
+    for _ in range(2):
+        response = client.post('/api/verify', json=body, headers={'Session-ID': str(uuid.uuid4())})
+        assert response.status_code == 200
+    assert corepoint.calls == 1
+    # Freshen always asks Corepoint
+    response = client.post('/api/verify', json=dict(body, freshen=True), headers={'Session-ID': str(uuid.uuid4())})
+    assert response.status_code == 200
+    assert corepoint.calls == 2
@@ -0,0 +1,54 @@
+import pytest
+
+MONITOR_PATHS = ['/api/monitor/upstreams', '/api/monitor/ratelimit', '/api/monitor/sessions']
+
+
+@pytest.mark.parametrize('path', MONITOR_PATHS)
+def test_local_caller_is_allowed(client, path):
+    response = client.get(path)
+    assert response.status_code == 200, response.get_json()
+
+
+@pytest.mark.parametrize('path', MONITOR_PATHS)
+def test_forwarded_external_client_is_forbidden(client, path):
+    # The same-host proxy connects from 127.0.0.1 and names the real client
+    response = client.get(path, headers={'X-Forwarded-For': '203.0.113.7'})
+    assert response.status_code == 403
+    assert response.get_json() == {'error': 'Forbidden'}
+
+
+@pytest.mark.parametrize('headers', [{'X-Real-IP': '203.0.113.7'}, {'Forwarded': 'for=203.0.113.7'},
+                                     {'X-Forwarded-For': '203.0.113.7', 'X-Real-IP': '127.0.0.1'}])
+def test_other_forwarding_headers_are_forbidden(client, headers):
+    assert client.get(MONITOR_PATHS[0], headers=headers).status_code == 403
+
+
+def test_local_client_through_the_proxy_is_allowed(client):
+    assert client.get(MONITOR_PATHS[0], headers={'X-Forwarded-For': '127.0.0.1'}).status_code == 200
+
+
+def test_forwarded_header_from_an_untrusted_peer_is_forbidden(client):
+    # Reaching gunicorn directly with a spoofed header does not make a caller local
+    response = client.get(MONITOR_PATHS[0], headers={'X-Forwarded-For': '127.0.0.1'},
+                          environ_base={'REMOTE_ADDR': '198.51.100.4'})
+    assert response.status_code == 403
+
+
+def test_without_proxy_hops_forwarded_requests_are_forbidden(client, monkeypatch):
+    from utils.ratelimit import limiter
+    monkeypatch.setattr(limiter, 'proxy_hops', 0)
+    assert client.get(MONITOR_PATHS[0], headers={'X-Forwarded-For': '127.0.0.1'}).status_code == 403
+    assert client.get(MONITOR_PATHS[0]).status_code == 200
+
+
+def test_metrics_are_served_locally(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+
+
+@pytest.mark.parametrize('headers', [{'X-Forwarded-For': '203.0.113.7'}, {'X-Real-IP': '203.0.113.7'}])
+def test_metrics_are_forbidden_to_forwarded_clients(client, headers):
+    response = client.get('/metrics', headers=headers)
+    assert response.status_code == 403
+    assert response.get_json() == {'error': 'Forbidden'}
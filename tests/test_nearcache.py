@@ -0,0 +1,51 @@
+import pytest
+
+from utils.nearcache import NearCacheBackend, StampTable
+from utils.session_backends import CacheSessionBackend
+
+
+@pytest.fixture
+def shared(tmp_path):
+    cachelib = pytest.importorskip('cachelib')
+    return cachelib.SimpleCache(), StampTable(str(tmp_path / 'stamps'), slots=64)
+
+
+def worker(shared, **options):
+    cache, stamps = shared
+    return NearCacheBackend(CacheSessionBackend(cache, 60, stamps=stamps), **options)
+
+
+def write(record):
+    return {'s1': (record, set(record), set(), True)}
+
+
+def test_repeat_reads_are_served_from_the_near_cache(shared):
+    backend = worker(shared)
+    backend.commit(write({'_v': 1, 'nonce': 'a'}), ())
+    assert backend.load('s1') == {'_v': 1, 'nonce': 'a'}
+    assert backend.load('s1') == {'_v': 1, 'nonce': 'a'}
+    stats = backend.stats()
+    assert stats['near']['enabled'] is True
+    assert (stats['near']['stamp_checks'], stats['near']['hits']) == (2, 2)
+    assert stats['shared']['loads'] == 0
+
+
+def test_write_by_another_worker_makes_the_entry_stale(shared):
+    first, second = worker(shared), worker(shared)
+    first.commit(write({'_v': 1, 'nonce': 'a'}), ())
+    assert second.load('s1') == {'_v': 1, 'nonce': 'a'}
+    first.commit(write({'_v': 1, 'nonce': 'b'}), ())
+    assert second.load('s1') == {'_v': 1, 'nonce': 'b'}
+    first.commit({}, ('s1',))
+    assert second.load('s1') is None
+    assert second.stats()['near']['stale'] == 2
+
+
+def test_disabled_near_cache_passes_through(shared):
+    backend = worker(shared, max_entries=0)
+    backend.commit(write({'_v': 1}), ())
+    assert backend.load('s1') == {'_v': 1}
+    stats = backend.stats()
+    assert stats['near']['enabled'] is False
+    assert stats['near']['stamp_checks'] == 0
+    assert stats['shared']['loads'] == 1
@@ -0,0 +1,163 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from utils import jsoncodec
+from utils import outbox as outbox_module
+from utils.outbox import DEAD, DELIVERED, QUEUED, SCHEMA, SENDING, DeliveryError, Outbox
+
+URL = 'https://formstack.test/api/v2/form/1/submission.json'
+PAYLOAD = {'field_1': 'Jordan', 'field_2': '000123456'}
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(outbox_module, 'time', SimpleNamespace(time=clock))
+    return clock
+
+
+@pytest.fixture
+def box(tmp_path, clock):
+    box = Outbox(str(tmp_path / 'outbox.db'), concurrency=2, max_attempts=3, backoff=2.0, backoff_max=300.0,
+                 lease_seconds=120, idempotency_ttl=3600)
+    box._conn().executescript(SCHEMA)
+    box.deliver = lambda url, payload: {'id': '555', 'data': payload}
+    return box
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+def test_enqueue_is_idempotent(box, clock):
+    row, created = box.enqueue('key-1', URL, PAYLOAD, session_id='s1')
+    again, created_again = box.enqueue('key-1', URL, {'other': 'body'}, session_id='s1')
+    assert (created, created_again) == (True, False)
+    assert again['id'] == row['id']
+    assert jsoncodec.loads(again['payload']) == PAYLOAD
+    assert box.find('key-1')['id'] == row['id']
+
+    # Past idempotency_ttl the key starts a new submission; the old row keeps its history
+    clock.now += 3601
+    assert box.find('key-1') is None
+    fresh, created = box.enqueue('key-1', URL, PAYLOAD, session_id='s1')
+    assert created and fresh['id'] != row['id']
+    assert box.get(row['id'])['idempotency_key'] == f"key-1:{row['id']}"
+
+
+def test_concurrent_enqueues_create_one_row(box):
+    barrier = threading.Barrier(8)
+
+    def enqueue(_):
+        barrier.wait()
+        return box.enqueue('key-race', URL, PAYLOAD, session_id='s1')
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(enqueue, range(8)))
+    assert sum(created for _row, created in results) == 1
+    assert len({row['id'] for row, _created in results}) == 1
+    assert box.stats() == {QUEUED: 1}
+
+
+def test_expired_lease_is_reclaimed(box, clock):
+    row, _created = box.enqueue('key-1', URL, PAYLOAD)
+    assert [claimed['id'] for claimed in box._claim(10)] == [row['id']]
+    assert box.get(row['id'])['status'] == SENDING
+    # Leased to the first claimer, so nobody else picks it up
+    clock.now += 119
+    assert box._claim(10) == []
+    # The worker delivering it died; once the lease runs out the row is claimed again
+    clock.now += 2
+    assert [claimed['id'] for claimed in box._claim(10)] == [row['id']]
+
+
+def test_failed_delivery_is_retried_after_a_jittered_backoff(box, clock, executor):
+    def deliver(url, payload):
+        raise DeliveryError('Formstack returned 503')
+
+    box.deliver = deliver
+    row, _created = box.enqueue('key-1', URL, PAYLOAD)
+    for attempt in (1, 2):
+        started = clock.now
+        assert box.drain(executor) == 1
+        failed = box.get(row['id'])
+        assert (failed['status'], failed['attempts']) == (QUEUED, attempt)
+        assert failed['last_error'] == 'Formstack returned 503'
+        delay = failed['next_attempt_at'] - started
+        # Exponential backoff, jittered between half and all of it
+        assert box.backoff * 2 ** (attempt - 1) / 2 <= delay <= box.backoff * 2 ** (attempt - 1)
+        # Not due yet
+        assert box.drain(executor) == 0
+        clock.now = failed['next_attempt_at']
+
+
+def test_permanent_failure_is_dead_lettered_at_once(box, executor):
+    def deliver(url, payload):
+        raise DeliveryError('Formstack returned 400', permanent=True)
+
+    box.deliver = deliver
+    row, _created = box.enqueue('key-1', URL, PAYLOAD)
+    box.drain(executor)
+    dead = box.get(row['id'])
+    assert (dead['status'], dead['attempts']) == (DEAD, 1)
+    # Kept so it can be sent by hand
+    assert jsoncodec.loads(dead['payload']) == PAYLOAD
+
+
+def test_retries_stop_at_max_attempts(box, clock, executor):
+    def deliver(url, payload):
+        raise ConnectionError('refused')
+
+    box.deliver = deliver
+    row, _created = box.enqueue('key-1', URL, PAYLOAD)
+    for _ in range(box.max_attempts):
+        assert box.drain(executor) == 1
+        clock.now += box.backoff_max
+    assert box.drain(executor) == 0
+    assert box.get(row['id'])['status'] == DEAD
+    assert box.get(row['id'])['attempts'] == box.max_attempts
+
+
+def test_delivered_payload_is_not_kept(box, executor):
+    row, _created = box.enqueue('key-1', URL, PAYLOAD)
+    box.drain(executor)
+    delivered = box.get(row['id'])
+    assert (delivered['status'], delivered['attempts']) == (DELIVERED, 1)
+    assert delivered['payload'] == ''
+    # Formstack echoes the fields back; only its submission id is stored
+    assert jsoncodec.loads(delivered['response']) == {'id': '555'}
+
+
+def test_purge_keeps_rows_within_retention(box, clock, executor):
+    row, _created = box.enqueue('key-1', URL, PAYLOAD)
+    box.drain(executor)
+    box._purge()
+    assert box.get(row['id']) is not None
+    clock.now += box.retention_seconds + 1
+    box._purge()
+    assert box.get(row['id']) is None
+
+
+def test_formstack_token_comes_from_config(monkeypatch, tmp_path):
+    from flask import Flask
+    from utils import upstream
+
+    monkeypatch.setattr(upstream, 'corepoint', upstream.UpstreamClient('corepoint'))
+    monkeypatch.setattr(upstream, 'formstack', upstream.UpstreamClient('formstack'))
+    app = Flask(__name__)
+    app.config.update(FS_TOK='fs-token', BULKHEAD_DIR=str(tmp_path))
+    upstream.init_upstreams(app)
+    assert upstream.formstack.session.headers['Authorization'] == 'Bearer fs-token'
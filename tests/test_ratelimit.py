@@ -0,0 +1,152 @@
+import uuid
+
+import pytest
+from flask import Flask
+from werkzeug.test import EnvironBuilder
+
+from conftest import COREPOINT_REPLY
+
+from utils import ratelimit
+from utils.ratelimit import RateLimiter, parse_rule
+
+NO_VISIT = {'IDS': dict(COREPOINT_REPLY['IDS'], VALID='false')}
+
+
+@pytest.fixture
+def limiter():
+    app = Flask(__name__)
+    app.config.update(SESSION_BACKEND='memory', SECRET_KEY='test', VERIFY_LIMIT_IP='off',
+                      VERIFY_LIMIT_IDENTITY='10/900', VERIFY_LIMIT_SESSION='10/900', VERIFY_LIMIT_FAILURES='4/3600',
+                      PROXY_HOPS=1, TRUSTED_PROXIES=['127.0.0.1', '::1'])
+    limiter = RateLimiter()
+    limiter.init_app(app)
+    return limiter
+
+
+def test_parse_rule():
+    assert parse_rule('30/300') == (30, 300)
+    assert parse_rule('off') is None
+    assert parse_rule('') is None
+
+
+def test_rule_that_is_off_never_limits(limiter):
+    for _ in range(1000):
+        assert limiter.hit('verify_ip', '10.0.0.1').allowed
+    assert limiter.count('verify_ip', '10.0.0.1') == 0
+    assert limiter.allows('verify_ip', '10.0.0.1')
+    assert limiter.stats()['verify_ip']['limit'] is None
+
+
+def test_failures_cannot_be_off():
+    app = Flask(__name__)
+    app.config.update(SESSION_BACKEND='memory', VERIFY_LIMIT_IP='off', VERIFY_LIMIT_IDENTITY='off',
+                      VERIFY_LIMIT_SESSION='off', VERIFY_LIMIT_FAILURES='off')
+    with pytest.raises(ValueError):
+        RateLimiter().init_app(app)
+
+
+def test_allows_matches_what_hit_would_decide(limiter):
+    for _ in range(3):
+        assert limiter.allows('verify_fail', 's1')
+        assert limiter.hit('verify_fail', 's1').allowed
+    assert limiter.allows('verify_fail', 's1')
+    assert not limiter.allows('verify_fail', 's1', cost=2)
+    assert limiter.hit('verify_fail', 's1').allowed
+    assert not limiter.allows('verify_fail', 's1')
+    assert not limiter.hit('verify_fail', 's1').allowed
+
+
+def test_fractional_allowance_is_not_enough(limiter, monkeypatch):
+    # 40% into the window: the previous window's 4 failures still weigh 2.4, plus 1 now
+    _limit, window, start, _now = limiter._window('verify_fail')
+    monkeypatch.setattr(ratelimit.time, 'time', lambda: start + window * 0.4)
+    limiter.store._windows[('verify_fail:s1', start - window)] = [4, start + window]
+    limiter.hit('verify_fail', 's1')
+    assert limiter.count('verify_fail', 's1') == pytest.approx(3.4)
+    assert not limiter.allows('verify_fail', 's1')
+    assert not limiter.hit('verify_fail', 's1').allowed
+
+
+def request_from(remote_addr, forwarded=None):
+    headers = {'X-Forwarded-For': forwarded} if forwarded else {}
+    return EnvironBuilder(headers=headers, environ_base={'REMOTE_ADDR': remote_addr}).get_request()
+
+
+def test_client_ip_is_read_from_a_trusted_proxy_only(limiter):
+    assert limiter.client_ip(request_from('127.0.0.1', '203.0.113.7')) == '203.0.113.7'
+    # The proxy appends the address it saw, so a spoofed first entry is ignored
+    assert limiter.client_ip(request_from('127.0.0.1', '10.9.9.9, 203.0.113.7')) == '203.0.113.7'
+    assert limiter.client_ip(request_from('127.0.0.1')) == '127.0.0.1'
+    # A client reaching gunicorn directly cannot pick its own address
+    assert limiter.client_ip(request_from('198.51.100.4', '10.9.9.9')) == '198.51.100.4'
+
+
+def test_identity_is_the_normalized_name(limiter):
+    assert limiter.identity('Jordan', "O'Brien") == limiter.identity(' jordan', 'OBRIEN ')
+    assert limiter.identity('Jordan', 'Lee') != limiter.identity('Jordan', 'Leek')
+
+
+def verify(client, session_id, last_name, freshen=False, dob='1984-07-12', client_ip=None):
+    headers = {'Session-ID': session_id}
+    if client_ip:
+        headers['X-Forwarded-For'] = client_ip
+    return client.post('/api/verify', json={'firstName': 'Jordan', 'lastName': last_name, 'dob': dob,
+                                            'freshen': freshen},
+                       headers=headers)
+
+
+def test_exhausted_session_is_refused_before_other_limits_and_corepoint(app, client, corepoint):
+    from utils.ratelimit import limiter
+
+    corepoint.reply = NO_VISIT
+    session_id = str(uuid.uuid4())
+    last_name = f'Limits-{uuid.uuid4().hex[:8]}'
+    assert verify(client, session_id, last_name).get_json().get('tries') == 3
+    # freshen costs two tries and does not start the budget over
+    assert verify(client, session_id, last_name, freshen=True).get_json().get('tries') == 1
+    calls = corepoint.calls
+    response = verify(client, session_id, last_name, freshen=True)
+    assert response.get_json() == {'message': 'Maximum tries exceeded', 'redirectTo': '/failedpage'}
+    assert corepoint.calls == calls
+    response = verify(client, session_id, last_name)
+    assert response.get_json() == {'message': 'Maximum tries exceeded', 'redirectTo': '/failedpage'}
+
+    identity = limiter.identity('Jordan', last_name)
+    used = limiter.count('verify_session', session_id), limiter.count('verify_identity', identity)
+    response = verify(client, session_id, last_name)
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Maximum tries exceeded'
+    assert (limiter.count('verify_session', session_id), limiter.count('verify_identity', identity)) == used
+
+
+def test_identity_limit_covers_every_dob_guess(client, corepoint, monkeypatch):
+    from utils.ratelimit import limiter
+
+    corepoint.reply = NO_VISIT
+    monkeypatch.setitem(limiter.rules, 'verify_identity', (3, 900))
+    last_name = f'Guess-{uuid.uuid4().hex[:8]}'
+    for year in (1980, 1981, 1982):
+        assert verify(client, str(uuid.uuid4()), last_name, dob=f'{year}-01-01').status_code == 400
+    response = verify(client, str(uuid.uuid4()), last_name, dob='1983-01-01')
+    assert response.status_code == 429
+
+
+def test_ip_limit_is_per_forwarded_client(client, corepoint, monkeypatch):
+    from utils.ratelimit import limiter
+
+    corepoint.reply = NO_VISIT
+    monkeypatch.setitem(limiter.rules, 'verify_ip', (2, 300))
+    client_ip = f'203.0.113.{uuid.uuid4().int % 250 + 1}'
+    for _ in range(2):
+        assert verify(client, str(uuid.uuid4()), f'Ip-{uuid.uuid4().hex[:8]}', client_ip=client_ip).status_code == 400
+    response = verify(client, str(uuid.uuid4()), f'Ip-{uuid.uuid4().hex[:8]}', client_ip=client_ip)
+    assert response.status_code == 429
+    assert 'Retry-After' in response.headers
+    other = verify(client, str(uuid.uuid4()), f'Ip-{uuid.uuid4().hex[:8]}', client_ip='198.51.100.9')
+    assert other.status_code == 400
+
+
+def test_ip_rule_is_on_by_default():
+    from config import Config
+    assert parse_rule(Config.VERIFY_LIMIT_IP) is not None
+    assert Config.PROXY_HOPS == 1 and '127.0.0.1' in Config.TRUSTED_PROXIES
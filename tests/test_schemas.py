@@ -0,0 +1,88 @@
+import uuid
+
+import pytest
+
+from test_scoring import CASES, GOLDEN, unanswered
+
+
+@pytest.fixture(scope='module')
+def validators(app):
+    from routes.fscommit import submit_body
+    from routes.routes import verify_body
+    return {'submit': submit_body, 'verify': verify_body}
+
+
+def test_golden_and_blank_answers_validate(validators):
+    # CASES includes every golden body with each answer blanked in turn
+    for body in CASES:
+        assert validators['submit'](body) == [], body
+
+
+def test_blank_scored_answers_validate(validators):
+    from routes.fscommit import scoring_engine
+    body = dict(GOLDEN[0]['request'], **{field: '' for field in scoring_engine.scorers})
+    assert validators['submit'](body) == []
+    assert validators['submit'](dict(body, physicalSecurity='Always'))
+
+
+@pytest.mark.parametrize('dob', ['1990-01-02', '01/02/1990'])
+def test_verify_accepts_the_frontend_dob_formats(validators, dob):
+    assert validators['verify']({'firstName': 'Jordan', 'lastName': 'Lee', 'dob': dob}) == []
+
+
+def test_verify_rejects_an_empty_dob(validators):
+    assert validators['verify']({'firstName': 'Jordan', 'lastName': 'Lee', 'dob': ''})
+
+
+def test_submit_with_unanswered_questions(client, corepoint):
+    # Scored like missing answers; test_scoring checks the blank bodies against the baseline
+    from utils.outbox import outbox
+
+    response = client.post('/api/verify', json={'firstName': 'Jordan', 'lastName': 'Blank-Answers',
+                                                'dob': '07/12/1984'},
+                           headers={'Session-ID': str(uuid.uuid4())})
+    assert response.status_code == 200, response.get_json()
+    verified = response.get_json()
+    response = client.post('/api/validate', json={'address': corepoint.reply['IDS']['ADDRESS']}, headers={
+        'Session-ID': verified['session_id'], 'Verification-Token': verified['verificationToken'],
+        'X-CSP-Nonce': verified['verify_nonce']})
+    assert response.status_code == 200, response.get_json()
+
+    body = unanswered(GOLDEN[0]['request'])
+    response = client.post('/api/submit', json=body, headers={
+        'Session-ID': verified['session_id'], 'Validation-Token': response.get_json()['validationToken'],
+        'Idempotency-Key': str(uuid.uuid4())})
+    assert response.status_code == 202, response.get_json()
+    assert outbox.get(response.get_json()['submission_id'])['status'] == 'queued'
+
+
+def test_every_answer_field_has_its_form_choices():
+    from routes.fscommit import ANSWER_FIELDS, scoring_engine
+    assert set(scoring_engine.choices) == set(ANSWER_FIELDS)
+
+
+@pytest.mark.parametrize('field', ['housingSecurity', 'foodAccess', 'utilitySecurity', 'childcareAccess',
+                                   'legalStatus', 'militaryService', 'requestHelp', 'sdohConsentProgram',
+                                   'sdohConsentHelp'])
+def test_unknown_answers_are_rejected(validators, field):
+    from routes.fscommit import scoring_engine
+    body = dict(GOLDEN[0]['request'])
+    option = scoring_engine.choices[field][0]
+    assert validators['submit'](dict(body, **{field: option})) == []
+    assert validators['submit'](dict(body, **{field: 'Maybe'}))
+    # Options are matched exactly
+    assert validators['submit'](dict(body, **{field: option.upper()}))
+
+
+def test_unknown_housing_conditions_are_rejected(validators):
+    body = dict(GOLDEN[0]['request'])
+    assert validators['submit'](dict(body, housingCondition=['Mold', 'Drafty windows']))
+    assert validators['submit'](dict(body, housingCondition=[None]))
+    assert validators['submit'](dict(body, housingCondition=['Mold', 'No or not working smoke detectors'])) == []
+    assert validators['submit'](dict(body, housingCondition=[])) == []
+
+
+def test_unknown_answer_is_refused_by_submit(client):
+    response = client.post('/api/submit', json=dict(GOLDEN[0]['request'], requestHelp='maybe'),
+                           headers={'Session-ID': str(uuid.uuid4()), 'Validation-Token': 'token'})
+    assert response.status_code == 400
@@ -0,0 +1,111 @@
+import json
+import os
+
+import pytest
+
+from conftest import ROOT
+
+from utils.rescore import answers_for, rescore_records
+from utils.scoring import ScoringEngine
+
+GOLDEN_PATH = os.path.join(ROOT, 'benchmarks', 'scoring_golden.jsonl')
+NONPARTICIPANT = "I choose not to answer"
+SAFETY_FIELDS = ('physicalSecurity', 'emotionalSecurity', 'safetySecurity', 'wellbeingSecurity')
+
+
+def calculate_scores(data):
+    """The inline scoring fscommit.submit did before the rule engine, kept as the reference."""
+    if data.get('participation') == "I choose not to participate":
+        answers = {field: NONPARTICIPANT for field in (
+            'housingSecurity', 'housingCondition', 'foodSecurity', 'foodAccess', 'healthcareAccess',
+            'utilitySecurity', 'childcareAccess', 'occupationAccess', 'educationAccess', 'financialSecurity',
+            *SAFETY_FIELDS, 'legalStatus', 'refugeSecurity', 'militaryService')}
+        hous_con = NONPARTICIPANT
+    else:
+        answers = data
+        hous_con = data.get('housingCondition', [])
+    get = answers.get
+
+    pos_true_answers = {"Sometimes true", "Often true"}
+    pos_freq_answers = {"Sometimes", "Fairly often", "Frequently"}
+    housing_conditions = ["Bug infestation", "Mold", "Lead paint or pipes", "Inadequate heat",
+                          "Oven or stove not working", "No or not working smoke detectors", "Water leaks"]
+    answer_scores = {"Never": 1, "Rarely": 2, "Sometimes": 3, "Fairly often": 4, "Frequently": 5,
+                     "I choose not to answer": 0}
+
+    def flag(condition):
+        return "POSITIVE" if condition else "negative"
+
+    safety_score = sum(answer_scores.get(get(field), 0) for field in SAFETY_FIELDS)
+    domains = {
+        'financial': flag(get('financialSecurity') in pos_freq_answers),
+        'childcare': flag(get('childcareAccess') == "Yes"),
+        'food': flag(any(answer in pos_true_answers for answer in [get('foodAccess'), get('foodSecurity')])),
+        'housing': flag(get('housingSecurity') == "Yes"
+                        or any(condition in hous_con for condition in housing_conditions)),
+        'transport': flag(get('healthcareAccess') == "Yes"),
+        'utility': flag(get('utilitySecurity') in ("Yes", "Already shut off")),
+        'safety': flag(safety_score > 10),
+        'employment': flag(get('occupationAccess') == "No"),
+        'education': flag(get('educationAccess') == "No"),
+        'add_factors': flag(get('legalStatus') == "Yes" or get('refugeSecurity') == "Yes" or get('militaryService') in (
+            "Veteran/Honorably discharged", "Veteran/Dishonorably discharged")),
+    }
+    return domains, safety_score
+
+
+def load_golden():
+    with open(GOLDEN_PATH) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+GOLDEN = load_golden()
+
+
+def unanswered(request):
+    # The frontend sends "" for questions left blank
+    return {field: ('' if isinstance(value, str) and field != 'participation' else value)
+            for field, value in request.items()}
+
+
+# Golden bodies plus the same bodies with every single answer left blank in turn
+CASES = [case['request'] for case in GOLDEN] + [
+    dict(case['request'], **{field: ''})
+    for case in GOLDEN[:40] for field in case['request'] if field not in ('participation', 'housingCondition')
+] + [unanswered(case['request']) for case in GOLDEN[:40]]
+
+
+@pytest.fixture(scope='module')
+def engine():
+    return ScoringEngine.from_file()
+
+
+def test_golden_file_is_the_baseline():
+    for case in GOLDEN:
+        assert calculate_scores(case['request']) == (case['domains'], case['safety_score'])
+
+
+@pytest.mark.parametrize('index', range(len(CASES)))
+def test_engine_matches_baseline(engine, index):
+    request = CASES[index]
+    result = engine.score(answers_for(engine, request))
+    assert (result.domains, result.scores['safety']) == calculate_scores(request)
+
+
+def test_rescore_matches_baseline(engine):
+    pytest.importorskip('numpy')
+    flags, totals = rescore_records(CASES, engine)
+    for i, request in enumerate(CASES):
+        domains = {name: engine.positive if flags[i, index] else engine.negative
+                   for index, name in enumerate(engine.domain_names)}
+        assert (domains, int(totals['safety'][i])) == calculate_scores(request), request
+
+
+def test_rules_must_use_answers_the_form_offers():
+    from utils.scoring import RULES_PATH, ScoringRulesError
+
+    with open(RULES_PATH) as f:
+        rules = json.load(f)
+    rules['choices']['utilitySecurity'] = ['Yes', 'No']
+    with pytest.raises(ScoringRulesError, match='utilitySecurity'):
+        ScoringEngine(rules)
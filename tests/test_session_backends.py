@@ -0,0 +1,173 @@
+import time
+import uuid
+
+import pytest
+
+from utils.session_backends import RedisSessionBackend
+
+ADDRESS = '1924 Alcoa Hwy Apt 4B'
+
+
+@pytest.fixture
+def backend(redis_server):
+    import fakeredis
+    client = fakeredis.FakeRedis(server=redis_server)
+    return RedisSessionBackend(None, timeout=60, prefix=f'test:{uuid.uuid4().hex}:', client=client)
+
+
+@pytest.fixture
+def store(fake_redis):
+    """A SessionStore configured the way sdohapi does it, with SESSION_BACKEND=redis."""
+    from flask import Flask
+    from utils.extensions import SessionStore
+
+    app = Flask(__name__)
+    app.config.update(SESSION_BACKEND='redis', SESSION_REDIS_URL='redis://sessions.test/0',
+                      SESSION_KEY_PREFIX=f'test:{uuid.uuid4().hex}:')
+    store = SessionStore(None)
+    store.init_app(app)
+    return app, store
+
+
+def write(record, changed=None, dropped=(), replace=False):
+    return (record, set(record if changed is None else changed), set(dropped), replace)
+
+
+def test_commit_and_load_round_trip(backend):
+    backend.commit({'s1': write({'_v': 1, 'mrn': '000123456', 'addresses': ['a', 'b']}, replace=True)}, ())
+    assert backend.load('s1') == {'_v': 1, 'mrn': '000123456', 'addresses': ['a', 'b']}
+    assert backend.load('missing') is None
+
+
+def test_field_updates_merge_server_side(backend):
+    backend.commit({'s1': write({'_v': 1, 'mrn': '1'}, replace=True)}, ())
+    # Two workers each holding a stale copy update different fields
+    backend.commit({'s1': write({'_v': 1, 'mrn': '1', 'validate_nonce': 'n'}, changed={'validate_nonce'})}, ())
+    backend.commit({'s1': write({'_v': 1, 'mrn': '1', 'fin': '2'}, changed={'fin'})}, ())
+    assert backend.load('s1') == {'_v': 1, 'mrn': '1', 'validate_nonce': 'n', 'fin': '2'}
+
+
+def test_dropped_fields_and_replace(backend):
+    backend.commit({'s1': write({'_v': 1, 'a': 1, 'b': 2}, replace=True)}, ())
+    backend.commit({'s1': write({'_v': 1, 'a': 1}, changed=(), dropped={'b'})}, ())
+    assert backend.load('s1') == {'_v': 1, 'a': 1}
+    backend.commit({'s1': write({'_v': 1, 'c': 3}, replace=True)}, ())
+    assert backend.load('s1') == {'_v': 1, 'c': 3}
+
+
+def test_delete(backend):
+    backend.commit({'s1': write({'_v': 1}, replace=True), 's2': write({'_v': 1}, replace=True)}, ())
+    backend.commit({}, ('s1',))
+    assert backend.load('s1') is None
+    assert backend.load('s2') == {'_v': 1}
+
+
+def test_every_write_refreshes_the_ttl(backend):
+    backend.commit({'s1': write({'_v': 1}, replace=True)}, ())
+    key = backend._key('s1')
+    backend.client.expire(key, 5)
+    backend.commit({'s1': write({'_v': 1, 'a': 1}, changed={'a'})}, ())
+    assert 55 < backend.client.ttl(key) <= 60
+
+
+def test_records_expire_after_the_timeout(backend):
+    backend.timeout = 1
+    backend.commit({'s1': write({'_v': 1}, replace=True)}, ())
+    time.sleep(1.2)
+    assert backend.load('s1') is None
+
+
+def test_journey_on_the_redis_backend(store, fake_redis):
+    # The session reads and writes /api/verify, /api/validate and /api/submit make,
+    # one request context each; flush() is what after_request runs
+    app, store = store
+    session_id = str(uuid.uuid4())
+    key = f"{app.config['SESSION_KEY_PREFIX']}{session_id}"
+    shared = RedisSessionBackend(None, store.timeout, prefix=app.config['SESSION_KEY_PREFIX'], client=fake_redis)
+
+    with app.test_request_context():
+        store.create(session_id, mrn='000123456', fin='987654321012', verify_nonce='verify-nonce',
+                     valid='true', correct_address=ADDRESS, verification_token='verify-token',
+                     FNM='Jordan', LNM='Lee', DOB='1984-07-12')
+        store.flush()
+    # The record went to the shared Redis hash, not to worker memory
+    assert fake_redis.exists(key)
+    assert 0 < fake_redis.ttl(key) <= store.timeout
+    assert shared.load(session_id)['correct_address'] == ADDRESS
+
+    with app.test_request_context():
+        assert store.get(session_id, 'verify_nonce') == 'verify-nonce'
+        store.update(session_id, validate_nonce='validate-nonce')
+        assert store.get(session_id, 'correct_address') == ADDRESS
+        store.update(session_id, drop=('correct_address', 'tries'), validation_token='validation-token')
+        store.flush()
+    stored = shared.load(session_id)
+    assert 'correct_address' not in stored
+    assert stored['validation_token'] == 'validation-token'
+    assert stored['validate_nonce'] == 'validate-nonce'
+
+    with app.test_request_context():
+        assert store.get(session_id, 'validation_token') == 'validation-token'
+        record = store.get(session_id)
+    assert (record['FNM'], record['LNM'], record['DOB']) == ('Jordan', 'Lee', '1984-07-12')
+    assert (record['mrn'], record['fin']) == ('000123456', '987654321012')
+
+
+def test_clear_deletes_the_redis_hash(store, fake_redis):
+    app, store = store
+    session_id = str(uuid.uuid4())
+    key = f"{app.config['SESSION_KEY_PREFIX']}{session_id}"
+    with app.test_request_context():
+        store.create(session_id, verify_nonce='n')
+        store.flush()
+    assert fake_redis.exists(key)
+    with app.test_request_context():
+        store.clear(session_id)
+        store.flush()
+    assert not fake_redis.exists(key)
+    with app.test_request_context():
+        assert store.get(session_id) is None
+
+
+def test_redis_sessions_skip_the_near_cache(app, client, corepoint):
+    from utils.extensions import session_store
+
+    response = client.post('/api/verify', json={'firstName': 'Jordan', 'lastName': 'Redis-Stats',
+                                                'dob': '1984-07-12'},
+                           headers={'Session-ID': str(uuid.uuid4())})
+    assert response.status_code == 200, response.get_json()
+    verified = response.get_json()
+    before = session_store.stats()
+    assert before['near']['enabled'] is False
+    response = client.post('/api/validate', json={'address': ADDRESS}, headers={
+        'Session-ID': verified['session_id'], 'Verification-Token': verified['verificationToken'],
+        'X-CSP-Nonce': verified['verify_nonce']})
+    assert response.status_code == 200, response.get_json()
+    after = session_store.stats()
+    # Every load is one read of the Redis hash, and is counted as such
+    assert after['near']['stamp_checks'] == before['near']['stamp_checks'] == 0
+    assert after['shared']['loads'] > before['shared']['loads']
+    assert after['shared']['backend'] == 'RedisSessionBackend'
+
+
+@pytest.mark.parametrize('backend', ['filesystem', 'memory', None])
+def test_gevent_mode_needs_redis_sessions(backend, tmp_path):
+    from flask import Flask
+    from utils.session_backends import make_session_backend
+
+    app = Flask(__name__)
+    app.config.update(SERVER_MODE='gevent', SESSION_BACKEND=backend, SESSION_STAMP_PATH=str(tmp_path / 'stamps'))
+    with pytest.raises(ValueError, match='SESSION_BACKEND=redis'):
+        make_session_backend(app, None, 60)
+
+
+def test_gevent_mode_runs_on_redis_sessions(fake_redis):
+    from flask import Flask
+    from utils.session_backends import make_session_backend
+
+    app = Flask(__name__)
+    app.config.update(SERVER_MODE='gevent', SESSION_BACKEND='redis', SESSION_REDIS_URL='redis://sessions.test/0',
+                      SESSION_KEY_PREFIX=f'test:{uuid.uuid4().hex}:')
+    backend = make_session_backend(app, None, 60)
+    backend.commit({'s1': write({'_v': 1, 'mrn': '000123456'}, replace=True)}, ())
+    assert backend.load('s1') == {'_v': 1, 'mrn': '000123456'}
@@ -0,0 +1,73 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+PROBE = """
+import json, config
+print(json.dumps({'workers': config.WEB_WORKERS, 'threads': config.WEB_THREADS, 'slots': config.UPSTREAM_SLOTS,
+                  'bulkhead': config.Config.CP_BULKHEAD_LIMIT, 'pool': config.Config.CP_POOL_SIZE}))
+"""
+
+
+def sizing(**env):
+    # config.py reads the environment at import, so each case needs its own interpreter
+    env = {key: value for key, value in os.environ.items()
+           if key not in ('CP_BULKHEAD_LIMIT', 'CP_POOL_SIZE', 'WEB_THREADS', 'SERVER_MODE')} | env
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize('env', [
+    {'WEB_WORKERS': '4'},
+    {'WEB_WORKERS': '4', 'UPSTREAM_LATENCY_MS': '20'},
+    {'WEB_WORKERS': '2', 'SERVER_MODE': 'gevent'},
+    {'WEB_WORKERS': '3', 'SERVER_MODE': 'sync'},
+])
+def test_bulkhead_leaves_threads_for_other_requests(env):
+    size = sizing(**env)
+    # Half the Corepoint calls the threads were sized for, so a slow Corepoint cannot hold them all
+    assert size['bulkhead'] == max(1, size['workers'] * size['slots'] // 2)
+    assert size['bulkhead'] < size['workers'] * max(size['threads'], size['slots'])
+    assert size['pool'] == size['slots']
+    if env.get('SERVER_MODE') is None:
+        assert size['slots'] == size['threads'] - 1
+
+
+def test_threads_follow_a_fixed_corepoint_limit():
+    size = sizing(WEB_WORKERS='4', CP_BULKHEAD_LIMIT='6')
+    assert size['bulkhead'] == 6
+    # ceil(6 / 4) Corepoint calls per worker, plus one thread for everything else
+    assert size['threads'] == 3
+
+
+
+GEVENT_SMOKE = """
+from gevent import monkey
+monkey.patch_all()
+import fakeredis, redis
+server = fakeredis.FakeServer()
+redis.Redis.from_url = classmethod(lambda cls, url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs))
+import gevent, json, sdohapi
+client = sdohapi.app.test_client()
+jobs = [gevent.spawn(client.get, path) for path in ('/api/monitor/sessions', '/api/monitor/ratelimit') * 10]
+gevent.joinall(jobs, timeout=30)
+print(json.dumps(sorted({job.value.status_code for job in jobs})))
+"""
+
+
+def test_app_serves_under_gevent(tmp_path):
+    # Smoke test: the app loads on a monkey-patched worker with Redis sessions and serves concurrent greenlets
+    pytest.importorskip('gevent')
+    pytest.importorskip('fakeredis')
+    env = dict(os.environ, SERVER_MODE='gevent', SESSION_BACKEND='redis', SECRET_KEY='test',
+               ENV_CP_API_URL='http://corepoint.test/verify', OUTBOX_PATH=str(tmp_path / 'outbox.db'),
+               BULKHEAD_DIR=str(tmp_path / 'bulkhead'), METRICS_DIR=str(tmp_path / 'metrics'))
+    output = subprocess.run([sys.executable, '-c', GEVENT_SMOKE], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True, timeout=60).stdout
+    assert json.loads(output.strip().splitlines()[-1]) == [200]
@@ -0,0 +1,130 @@
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import ADDRESS
+
+SUBMIT_BODY = {
+    'participation': 'I choose to participate',
+    'housingSecurity': 'Yes',
+    'housingCondition': ['Bug infestation', 'None of the above'],
+    'foodSecurity': 'Sometimes true',
+    'physicalSecurity': 'Sometimes',
+    'emotionalSecurity': 'Never',
+    'requestHelp': 'no',
+}
+
+
+def validated_session(client, last_name='Submit'):
+    """Run verify and validate; returns (session_id, validation token)."""
+    response = client.post('/api/verify', json={'firstName': 'Jordan', 'lastName': last_name, 'dob': '1984-07-12'},
+                           headers={'Session-ID': str(uuid.uuid4())})
+    assert response.status_code == 200, response.get_json()
+    verified = response.get_json()
+    response = client.post('/api/validate', json={'address': ADDRESS}, headers={
+        'Session-ID': verified['session_id'], 'Verification-Token': verified['verificationToken'],
+        'X-CSP-Nonce': verified['verify_nonce']})
+    assert response.status_code == 200, response.get_json()
+    return verified['session_id'], response.get_json()['validationToken']
+
+
+def submit(client, session_id, token, body=SUBMIT_BODY, key=None):
+    headers = {'Session-ID': session_id, 'Validation-Token': token}
+    if key is not None:
+        headers['Idempotency-Key'] = key
+    return client.post('/api/submit', json=body, headers=headers)
+
+
+def queued():
+    from utils.outbox import outbox
+    return sum(outbox.stats().values())
+
+
+def test_submission_is_queued_with_the_verified_patient(client, corepoint):
+    from utils.outbox import outbox
+
+    session_id, token = validated_session(client)
+    response = submit(client, session_id, token, key=str(uuid.uuid4()))
+    assert response.status_code == 202, response.get_json()
+    row = outbox.get(response.get_json()['submission_id'])
+    assert (row['session_id'], row['status']) == (session_id, 'queued')
+    # Name and MRN come from the session record
+    assert 'Jordan' in row['payload'] and '000123456' in row['payload']
+
+
+@pytest.mark.parametrize('session_id', ['', str(uuid.uuid4())])
+def test_unknown_session_is_refused(client, session_id):
+    before = queued()
+    response = submit(client, session_id, 'token')
+    assert response.status_code == 401
+    assert queued() == before
+
+
+def test_expired_session_is_refused(app, client, corepoint, redis_server):
+    import fakeredis
+
+    session_id, token = validated_session(client, last_name='Expired')
+    # What the session TTL does to the Redis hash
+    fakeredis.FakeRedis(server=redis_server).delete(f"{app.config['SESSION_KEY_PREFIX']}{session_id}")
+    before = queued()
+    response = submit(client, session_id, token)
+    assert response.status_code == 401
+    assert response.get_json() == {'error': 'Invalid or expired session'}
+    assert queued() == before
+
+
+def test_replay_with_the_same_key_returns_the_original_response(client, corepoint):
+    session_id, token = validated_session(client, last_name='Replay')
+    key = str(uuid.uuid4())
+    first = submit(client, session_id, token, key=key)
+    assert first.status_code == 202
+    before = queued()
+    # Different body, same key: still the first submission
+    again = submit(client, session_id, token, body=dict(SUBMIT_BODY, requestHelp='yes'), key=key)
+    assert again.status_code == 202
+    assert again.get_json() == first.get_json()
+    assert again.headers['Idempotent-Replayed'] == 'true'
+    assert 'Idempotent-Replayed' not in first.headers
+    assert queued() == before
+
+
+def test_retry_without_a_key_is_matched_on_the_body(client, corepoint):
+    session_id, token = validated_session(client, last_name='Auto-Key')
+    first = submit(client, session_id, token)
+    again = submit(client, session_id, token)
+    assert again.get_json()['submission_id'] == first.get_json()['submission_id']
+    assert again.headers['Idempotent-Replayed'] == 'true'
+
+
+def test_key_reused_by_another_session_is_refused(client, corepoint):
+    key = str(uuid.uuid4())
+    first_session, first_token = validated_session(client, last_name='Key-Owner')
+    assert submit(client, first_session, first_token, key=key).status_code == 202
+    other_session, other_token = validated_session(client, last_name='Key-Reuser')
+    before = queued()
+    response = submit(client, other_session, other_token, key=key)
+    assert response.status_code == 409
+    assert response.get_json() == {'error': 'Idempotency-Key already used'}
+    assert 'submission_id' not in response.get_json()
+    assert queued() == before
+
+
+def test_concurrent_duplicates_are_queued_once(app, corepoint):
+    session_id, token = validated_session(app.test_client(), last_name='Concurrent')
+    key = str(uuid.uuid4())
+    before = queued()
+    barrier = threading.Barrier(6)
+
+    def duplicate(_):
+        # One client per thread, as with requests arriving on different worker threads
+        barrier.wait()
+        return submit(app.test_client(), session_id, token, key=key)
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        responses = list(pool.map(duplicate, range(6)))
+    assert [response.status_code for response in responses] == [202] * 6
+    assert len({response.get_json()['submission_id'] for response in responses}) == 1
+    assert sum('Idempotent-Replayed' not in response.headers for response in responses) == 1
+    assert queued() == before + 1
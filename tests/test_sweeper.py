@@ -0,0 +1,127 @@
+import fcntl
+import pickle
+import struct
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from utils import sweeper as sweeper_module
+from utils.sweeper import LOCK_NAME, TRANSACTION_SUFFIX, CacheSweeper, read_expiry
+
+NOW = 1_000_000
+
+
+class Clock:
+    def __init__(self, now=NOW):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sweeper_module, 'time', SimpleNamespace(time=clock, perf_counter=time.perf_counter))
+    return clock
+
+
+@pytest.fixture
+def sweeper(tmp_path, clock):
+    return CacheSweeper(str(tmp_path), batch_size=2, bucket_seconds=60, pause=0)
+
+
+def write(directory, name, expires, value=b'session'):
+    """A cache file as cachelib writes it: packed uint32 expiry, then the pickled value."""
+    path = directory / name
+    path.write_bytes(struct.pack('I', expires) + pickle.dumps(value))
+    return path
+
+
+def test_read_expiry(tmp_path):
+    assert read_expiry(write(tmp_path, 'a', NOW + 5)) == NOW + 5
+    assert read_expiry(write(tmp_path, 'b', 0)) == 0
+    # flask_caching 1.x pickles the timestamp
+    legacy = tmp_path / 'c'
+    legacy.write_bytes(pickle.dumps(NOW + 7, protocol=2) + pickle.dumps(b'session'))
+    assert read_expiry(legacy) == NOW + 7
+
+
+def test_expired_files_are_removed(sweeper, tmp_path):
+    expired = write(tmp_path, 'expired', NOW - 1)
+    live = write(tmp_path, 'live', NOW + 300)
+    forever = write(tmp_path, 'forever', 0)
+    files, freed, _elapsed = sweeper.sweep()
+    assert (files, freed) == (1, len(pickle.dumps(b'session')) + 4)
+    assert not expired.exists()
+    assert live.exists() and forever.exists()
+
+
+def test_temp_and_hidden_files_are_left_alone(sweeper, tmp_path):
+    pending = write(tmp_path, 'abc' + TRANSACTION_SUFFIX, NOW - 1)
+    lock = write(tmp_path, LOCK_NAME, NOW - 1)
+    assert sweeper.sweep()[0] == 0
+    assert pending.exists() and lock.exists()
+
+
+def test_later_passes_only_read_due_buckets(sweeper, tmp_path, clock, monkeypatch):
+    write(tmp_path, 'soon', NOW + 30)
+    write(tmp_path, 'later', NOW + 3600)
+    sweeper.sweep()
+    assert sweeper.stats()['indexed_files'] == 2
+
+    checked = []
+    check = sweeper._check
+    monkeypatch.setattr(sweeper, '_check', lambda name, now: checked.append(name) or check(name, now))
+    clock.now += 120
+    assert sweeper.sweep()[0] == 1
+    # 'later' was indexed by the first pass and is not due, so its header is not read again
+    assert checked == ['soon']
+    assert sweeper.stats()['indexed_files'] == 1
+
+
+def test_refreshed_file_is_reindexed(sweeper, tmp_path, clock):
+    write(tmp_path, 'session', NOW + 30)
+    sweeper.sweep()
+    # The session was touched and rewritten with a later expiry
+    path = write(tmp_path, 'session', NOW + 3600)
+    clock.now += 120
+    assert sweeper.sweep()[0] == 0
+    assert path.exists()
+    clock.now += 3600
+    assert sweeper.sweep()[0] == 1
+    assert not path.exists()
+
+
+def test_file_removed_by_someone_else_is_dropped(sweeper, tmp_path, clock):
+    write(tmp_path, 'gone', NOW + 30).unlink()
+    write(tmp_path, 'kept', NOW + 30)
+    sweeper.sweep()
+    (tmp_path / 'kept').unlink()
+    clock.now += 120
+    assert sweeper.sweep()[0] == 0
+    assert sweeper.stats()['indexed_files'] == 0
+
+
+def test_stats_accumulate(sweeper, tmp_path, clock):
+    for name in ('a', 'b', 'c'):
+        write(tmp_path, name, NOW - 1)
+    sweeper.sweep()
+    write(tmp_path, 'd', NOW - 1)
+    sweeper.sweep()
+    stats = sweeper.stats()
+    assert (stats['passes'], stats['files_removed'], stats['last_files_removed']) == (2, 4, 1)
+
+
+def test_only_one_process_sweeps_a_directory(tmp_path):
+    first, second = CacheSweeper(str(tmp_path)), CacheSweeper(str(tmp_path))
+    with open(tmp_path / LOCK_NAME, 'a') as other:
+        # What another worker's sweeper holds
+        fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        assert not first._acquire()
+        fcntl.flock(other, fcntl.LOCK_UN)
+    assert first._acquire()
+    assert first._acquire()
+    assert not second._acquire()
+    first._lock_file.close()
@@ -0,0 +1,60 @@
+import datetime
+
+import pytest
+
+from utils.tls import ServerContext
+
+
+@pytest.fixture(scope='module')
+def certificate(tmp_path_factory):
+    pytest.importorskip('cryptography')
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'localhost')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(now)
+            .not_valid_after(now + datetime.timedelta(days=1)).sign(key, hashes.SHA256()))
+    workdir = tmp_path_factory.mktemp('tls')
+    cert_file, key_file = workdir / 'cert.pem', workdir / 'key.pem'
+    cert_file.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_file.write_bytes(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                           serialization.NoEncryption()))
+    return str(cert_file), str(key_file)
+
+
+def age(context, seconds):
+    context._rotated_at -= seconds
+
+
+def test_context_rotates_once_due(certificate):
+    context = ServerContext(*certificate, rotation=60)
+    first = context.current()
+    assert context.current() is first
+    age(context, 61)
+    assert context.expired()
+    assert context.current() is not first
+    assert context.rotations == 1
+    assert not context.expired()
+
+
+def test_pinned_context_keeps_its_keys_and_reports_when_due(certificate):
+    # A gunicorn worker keeps the master's context and is replaced instead of rotating
+    context = ServerContext(*certificate, rotation=60)
+    inherited = context.current()
+    context.pin()
+    age(context, 61)
+    assert context.current() is inherited
+    assert context.rotations == 0
+    assert context.expired()
+    assert not context.expired(grace=5)
+
+
+def test_rotation_zero_never_expires(certificate):
+    context = ServerContext(*certificate, rotation=0)
+    age(context, 10 ** 6)
+    assert not context.expired()
@@ -0,0 +1,148 @@
+import uuid
+
+import pytest
+from flask import Flask
+
+from conftest import ADDRESS
+
+from utils.tokens import RedisRevocationStore, TokenService
+
+
+def signed_service(tmp_path, **config):
+    app = Flask(__name__)
+    app.config.update(TOKEN_MODE='signed', SECRET_KEY='test', SESSION_BACKEND='filesystem',
+                      TOKEN_REVOCATION_PATH=str(tmp_path / 'revoked.db'), TOKEN_REVOCATION_SYNC=60, **config)
+    service = TokenService()
+    service.init_app(app)
+    return service
+
+
+@pytest.fixture
+def service(tmp_path):
+    return signed_service(tmp_path)
+
+
+def test_issue_and_check(service):
+    token = service.issue('verify', 's1', nonce='n1')
+    claims = service.check('verify', token, 's1')
+    assert (claims['sid'], claims['nonce']) == ('s1', 'n1')
+    assert claims['exp'] > 0
+
+
+def test_token_is_bound_to_its_session_and_kind(service):
+    token = service.issue('verify', 's1')
+    assert service.check('verify', token, 's2') is None
+    assert service.check('validate', token, 's1') is None
+    assert service.check('verify', token[:-2] + 'xx', 's1') is None
+    assert service.check('verify', '', 's1') is None
+
+
+def test_expired_token_is_refused(service):
+    token = service.issue('verify', 's1')
+    service.max_age = -1
+    assert service.check('verify', token, 's1') is None
+
+
+def test_revoked_token_is_refused(service):
+    token = service.issue('verify', 's1')
+    service.revoke(service.check('verify', token, 's1'))
+    assert service.check('verify', token, 's1') is None
+    # Other tokens for the session are unaffected
+    assert service.check('verify', service.issue('verify', 's1'), 's1') is not None
+
+
+def test_revocation_reaches_other_workers_on_sync(tmp_path):
+    first, second = signed_service(tmp_path), signed_service(tmp_path)
+    token = first.issue('verify', 's1')
+    first.revoke(first.check('verify', token, 's1'))
+    # Until its next sync the other worker still has the old list
+    assert second.check('verify', token, 's1') is not None
+    second.sync()
+    assert second.check('verify', token, 's1') is None
+
+
+def test_revocation_is_shared_through_redis(fake_redis, tmp_path):
+    first, second = signed_service(tmp_path), signed_service(tmp_path)
+    for service in (first, second):
+        service.store = RedisRevocationStore(None, client=fake_redis, key='test:revoked')
+    token = first.issue('verify', 's1')
+    first.revoke(first.check('verify', token, 's1'))
+    second.sync()
+    assert second.check('verify', token, 's1') is None
+
+
+def test_signed_mode_needs_a_secret():
+    app = Flask(__name__)
+    app.config.update(TOKEN_MODE='signed', SESSION_BACKEND='memory')
+    with pytest.raises(ValueError):
+        TokenService().init_app(app)
+
+
+@pytest.fixture
+def signed_mode(app, monkeypatch):
+    # The app runs in cache mode; switch the shared service to signed for one test
+    from utils.tokens import tokens
+    for attr in ('mode', 'store', 'max_age', 'sync_interval', '_secret', '_cursor'):
+        monkeypatch.setattr(tokens, attr, getattr(tokens, attr))
+    monkeypatch.setattr(tokens, '_serializers', {})
+    monkeypatch.setattr(tokens, '_revoked', {})
+    monkeypatch.setitem(app.config, 'TOKEN_MODE', 'signed')
+    tokens.init_app(app)
+    return tokens
+
+
+def verify(client, last_name):
+    response = client.post('/api/verify', json={'firstName': 'Jordan', 'lastName': last_name, 'dob': '1984-07-12'},
+                           headers={'Session-ID': str(uuid.uuid4())})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def validate(client, verified, token=None, nonce=None, address=ADDRESS):
+    return client.post('/api/validate', json={'address': address}, headers={
+        'Session-ID': verified['session_id'],
+        'Verification-Token': token or verified['verificationToken'],
+        'X-CSP-Nonce': nonce or verified['verify_nonce']})
+
+
+def test_signed_tokens_through_verify_and_validate(app, client, corepoint, signed_mode):
+    from utils.extensions import session_store
+
+    verified = verify(client, 'Signed')
+    claims = signed_mode.check('verify', verified['verificationToken'], verified['session_id'])
+    assert claims['nonce'] == verified['verify_nonce']
+    with app.test_request_context():
+        assert session_store.get(verified['session_id'], 'verification_token') is None
+
+    response = validate(client, verified)
+    assert response.status_code == 200, response.get_json()
+    assert signed_mode.check('validate', response.get_json()['validationToken'], verified['session_id'])
+    # Used up by the address check
+    assert validate(client, verified).status_code == 401
+
+
+def test_signed_mode_checks_the_signed_nonce(client, corepoint, signed_mode):
+    verified = verify(client, 'Signed-Nonce')
+    response = validate(client, verified, nonce='not-the-nonce')
+    assert response.status_code == 401
+    assert response.get_json() == {'error': 'Invalid or expired nonce'}
+
+
+def test_signed_mode_refuses_a_token_for_another_session(client, corepoint, signed_mode):
+    first, second = verify(client, 'Signed-First'), verify(client, 'Signed-Second')
+    response = validate(client, second, token=first['verificationToken'], nonce=first['verify_nonce'])
+    assert response.status_code == 401
+
+
+def test_cache_mode_compares_the_stored_token(client, corepoint):
+    verified = verify(client, 'Cache-Token')
+    response = validate(client, verified, token='not-the-token')
+    assert response.status_code == 401
+    assert response.get_json() == {'error': 'Invalid or expired verification token'}
+    assert validate(client, verified).status_code == 200
+
+
+def test_cache_mode_token_is_used_up_by_the_address_check(client, corepoint):
+    verified = verify(client, 'Cache-Used')
+    assert validate(client, verified, address='310 Gay St').status_code == 400
+    assert validate(client, verified).status_code == 401
@@ -0,0 +1,232 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from conftest import CorepointAdapter
+
+from utils.resilience import OPEN, BulkheadFullError, Bulkhead, CircuitBreaker, CircuitOpenError
+from utils.upstream import UpstreamClient
+
+
+class DictStore:
+    """Just enough of flask_caching's get/set for the breaker's shared state."""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.values[key] = value
+
+
+class FailingAdapter(requests.adapters.BaseAdapter):
+    def send(self, request, **kwargs):
+        raise requests.ConnectionError('refused')
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def client(tmp_path):
+    client = UpstreamClient('test', url='http://upstream.test/', retries=0)
+    client.breaker = CircuitBreaker('test', DictStore(), failure_threshold=1, recovery_timeout=30, sync_interval=0)
+    client.bulkhead = Bulkhead('test', 1, str(tmp_path), max_wait=0.5)
+    client.session.mount('http://', CorepointAdapter())
+    return client
+
+
+def open_breaker(breaker, opened_at):
+    breaker.store.set(breaker._key, {'state': OPEN, 'failures': 1, 'opened_at': opened_at, 'trips': 1})
+
+
+def test_open_breaker_fails_fast_without_waiting_for_a_slot(client):
+    open_breaker(client.breaker, time.time())
+    held = client.bulkhead.acquire()
+    try:
+        started = time.monotonic()
+        with pytest.raises(CircuitOpenError):
+            client.post()
+        # Refused before queueing for the (full) bulkhead, which would wait max_wait
+        assert time.monotonic() - started < 0.1
+        assert client.bulkhead.stats()['rejected'] == 0
+    finally:
+        client.bulkhead.release(held)
+
+
+def test_half_open_trial_is_freed_when_no_slot_is_left(client):
+    open_breaker(client.breaker, time.time() - 60)
+    client.bulkhead.max_wait = 0
+    held = client.bulkhead.acquire()
+    try:
+        with pytest.raises(BulkheadFullError):
+            client.post()
+    finally:
+        client.bulkhead.release(held)
+    # The trial never reached the upstream, so the next call may still make it
+    assert client.post().status_code == 200
+    assert client.breaker.stats()['state'] == 'closed'
+
+
+def test_failures_open_the_breaker(client):
+    client.session.mount('http://', FailingAdapter())
+    with pytest.raises(requests.ConnectionError):
+        client.post()
+    with pytest.raises(CircuitOpenError):
+        client.post()
+
+
+class BrokenAdapter(requests.adapters.BaseAdapter):
+    def send(self, request, **kwargs):
+        raise RuntimeError('bug in the adapter')
+
+    def close(self):
+        pass
+
+
+def test_half_open_trial_is_freed_when_the_call_raises_something_else(client):
+    open_breaker(client.breaker, time.time() - 60)
+    client.session.mount('http://', BrokenAdapter())
+    with pytest.raises(RuntimeError):
+        client.post()
+    # Not an upstream failure, so the breaker stays half-open with its trial free
+    assert client.breaker.stats()['state'] == 'half_open'
+    client.session.mount('http://', CorepointAdapter())
+    assert client.post().status_code == 200
+    assert client.breaker.stats()['state'] == 'closed'
+
+
+def test_bulkhead_scan_starts_at_a_random_slot(tmp_path, monkeypatch):
+    from utils import resilience
+
+    bulkhead = Bulkhead('scan', 4, str(tmp_path))
+    monkeypatch.setattr(resilience.random, 'randrange', lambda n: 2)
+    first, second = bulkhead.acquire(), bulkhead.acquire()
+    assert [slot[1].name.rsplit('.', 2)[-2] for slot in (first, second)] == ['2', '3']
+    # Wraps around to the slots before the starting point
+    third, fourth = bulkhead.acquire(), bulkhead.acquire()
+    assert [slot[1].name.rsplit('.', 2)[-2] for slot in (third, fourth)] == ['0', '1']
+    with pytest.raises(BulkheadFullError):
+        bulkhead.acquire()
+    for slot in (first, second, third, fourth):
+        bulkhead.release(slot)
+
+
+class ScriptedAdapter(requests.adapters.BaseAdapter):
+    """Plays back `outcomes` in order: a status code to answer with, or an exception to raise."""
+
+    def __init__(self, *outcomes):
+        super().__init__()
+        self.outcomes = list(outcomes)
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = requests.Response()
+        response.status_code = outcome
+        response._content = b'{}'
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def retrying(monkeypatch):
+    from utils import upstream
+
+    client = UpstreamClient('retrying', url='http://upstream.test/', retries=2, backoff=0.2, backoff_max=0.5)
+    sleeps = []
+    monkeypatch.setattr(upstream, 'time', SimpleNamespace(sleep=sleeps.append, perf_counter=time.perf_counter))
+    # Report the jitter window instead of a point in it
+    monkeypatch.setattr(upstream, 'random', SimpleNamespace(uniform=lambda low, high: (low, high)))
+
+    def play(*outcomes):
+        adapter = ScriptedAdapter(*outcomes)
+        client.session.mount('http://', adapter)
+        return adapter
+
+    return client, play, sleeps
+
+
+def test_connect_failures_are_retried_with_full_jitter(retrying):
+    client, play, sleeps = retrying
+    play(requests.ConnectTimeout('slow'), requests.ConnectTimeout('slow'), 200)
+    assert client.post().status_code == 200
+    # Exponential window starting at zero, capped at backoff_max
+    assert sleeps == [(0, 0.2), (0, 0.4)]
+    assert client._counts['retries'] == 2
+
+
+def test_retries_stop_at_the_limit(retrying):
+    client, play, sleeps = retrying
+    play(*[requests.ConnectTimeout('slow')] * 3)
+    with pytest.raises(requests.ConnectTimeout):
+        client.post()
+    assert sleeps == [(0, 0.2), (0, 0.4)]
+    assert client._counts['errors'] == 3
+
+
+def test_backoff_is_capped(retrying):
+    client, play, sleeps = retrying
+    client.retries = 4
+    play(*[requests.ConnectTimeout('slow')] * 4, 200)
+    client.post()
+    assert sleeps == [(0, 0.2), (0, 0.4), (0, 0.5), (0, 0.5)]
+
+
+@pytest.mark.parametrize('outcome', [requests.ConnectionError('reset'), requests.ReadTimeout('slow'), 503])
+def test_calls_that_may_have_arrived_are_only_retried_when_idempotent(retrying, outcome):
+    client, play, sleeps = retrying
+    adapter = play(outcome)
+    if isinstance(outcome, Exception):
+        with pytest.raises(type(outcome)):
+            client.post()
+    else:
+        assert client.post().status_code == outcome
+    assert (len(adapter.requests), sleeps) == (1, [])
+
+    adapter = play(outcome, 200)
+    assert client.post(idempotent=True).status_code == 200
+    assert len(adapter.requests) == 2
+
+
+def test_last_retryable_response_is_returned(retrying):
+    client, play, _sleeps = retrying
+    play(503, 502, 504)
+    assert client.post(idempotent=True).status_code == 504
+
+
+def test_json_is_encoded_once_for_all_attempts(retrying):
+    client, play, _sleeps = retrying
+    adapter = play(requests.ConnectTimeout('slow'), 200)
+    client.post(json={'name': 'Jordan'}, headers={'Accept': 'application/json'})
+    bodies = {request.body for request in adapter.requests}
+    assert bodies == {b'{"name":"Jordan"}'}
+    assert adapter.requests[-1].headers['Content-Type'] == 'application/json'
+
+
+def test_session_is_pooled_per_process(monkeypatch):
+    from utils import upstream
+
+    client = UpstreamClient('pooled', pool_size=7, headers={'Authorization': 'Bearer t'})
+    session = client.session
+    assert client.session is session
+    assert session.headers['Authorization'] == 'Bearer t'
+    assert session.get_adapter('https://upstream.test/')._pool_maxsize == 7
+    # A forked worker must not share the parent's sockets
+    monkeypatch.setattr(upstream.os, 'getpid', lambda: -1)
+    assert client.session is not session
+    # Nor keep a session built with old settings
+    rebuilt = client.session
+    client.configure(pool_size=3)
+    assert client.session is not rebuilt
+    assert client.session.get_adapter('https://upstream.test/')._pool_maxsize == 3
@@ -0,0 +1,197 @@
+# capture.py
+# Opt-in (CAPTURE_ENABLED) WSGI middleware that records the shape and timing
+# of /api traffic for benchmarks/replay.py. Nothing that identifies a patient
+# is written: names, dates of birth, session ids, submission ids and
+# idempotency keys become stable HMAC tokens (CAPTURE_KEY), so a journey can
+# still be followed across requests and workers, and bodies are reduced to
+# the few facts replay needs (freshen flag, participation choice, ...).
+#
+# Each worker appends gzip'd JSON lines to CAPTURE_DIR/capture-<pid>.jsonl.gz
+# from a background thread; the request thread only enqueues a small dict.
+import atexit
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY = 64 * 1024
+# Only these participation answers are kept verbatim; anything else is recorded as 'other'
+PARTICIPATION = frozenset({"I choose to participate", "I choose not to participate"})
+# Responses whose ids link the next steps of a journey
+LINKING_PATHS = frozenset({'/api/verify', '/api/validate', '/api/submit'})
+
+
+class CaptureWriter:
+    """Background writer for capture records, one file per worker process."""
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._pid = None
+        self.dropped = 0
+
+    def put(self, record):
+        if self._pid != os.getpid():
+            # Writer not running in this process (not started yet after fork)
+            self.dropped += 1
+            return
+        self._queue.put(record)
+
+    def _run(self):
+        path = os.path.join(self.directory, f'capture-{os.getpid()}.jsonl.gz')
+        with gzip.open(path, 'ab') as f:
+            while True:
+                try:
+                    record = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    f.flush()
+                    continue
+                if record is None:
+                    break
+                f.write(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+                # Sync-flush whenever the queue runs dry so a killed worker loses little
+                if self._queue.empty():
+                    f.flush()
+
+    def start(self):
+        if not self.directory or (self._thread is not None and self._pid == os.getpid()):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='capture-writer', daemon=True)
+        self._thread.start()
+        self._pid = os.getpid()
+        # Closing the gzip stream writes its trailer; a killed worker leaves a readable, truncated file
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+        self._thread = None
+        self._pid = None
+
+
+class CaptureMiddleware:
+    def __init__(self, wsgi_app, writer, key):
+        if not key:
+            raise ValueError("CAPTURE_ENABLED needs CAPTURE_KEY (or SECRET_KEY) so tokens match across workers")
+        self.wsgi_app = wsgi_app
+        self.writer = writer
+        self.key = key.encode() if isinstance(key, str) else key
+
+    def token(self, value):
+        if value in (None, ''):
+            return None
+        return hmac.new(self.key, str(value).encode(), hashlib.sha256).hexdigest()[:16]
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith('/api/') or path.startswith('/api/monitor'):
+            return self.wsgi_app(environ, start_response)
+
+        wall = time.time()
+        started = time.perf_counter()
+        body = b''
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if 0 < length <= MAX_BODY:
+            body = environ['wsgi.input'].read(length)
+            environ['wsgi.input'] = io.BytesIO(body)
+
+        status = {}
+
+        def capture_start_response(status_line, headers, exc_info=None):
+            status['code'] = int(status_line.split(' ', 1)[0])
+            return start_response(status_line, headers, exc_info)
+
+        result = self.wsgi_app(environ, capture_start_response)
+        method = environ.get('REQUEST_METHOD')
+        response_body = None
+        if method == 'POST' and path in LINKING_PATHS:
+            # Small JSON replies; buffered so the new session/submission id can be tokenized
+            try:
+                response_body = b''.join(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            result = [response_body]
+
+        try:
+            self.writer.put(self._record(environ, path, method, body, response_body, status.get('code'),
+                                         wall, time.perf_counter() - started))
+        except Exception:
+            logger.exception("Could not capture request")
+        return result
+
+    def _record(self, environ, path, method, body, response_body, status, wall, elapsed):
+        record = {
+            't': round(wall, 3),
+            'd': round(elapsed * 1000, 2),
+            'm': method,
+            'p': path,
+            'st': status,
+            's': self.token(environ.get('HTTP_SESSION_ID')),
+        }
+        if path.startswith('/api/submit/'):
+            record['p'] = '/api/submit/{id}'
+            record['sub'] = self.token(path.rsplit('/', 1)[-1])
+        if environ.get('HTTP_IDEMPOTENCY_KEY'):
+            record['ik'] = self.token(environ['HTTP_IDEMPOTENCY_KEY'])
+
+        data = _json(body)
+        if path == '/api/verify' and isinstance(data, dict):
+            patient = '|'.join(str(data.get(k, '')).strip().lower() for k in ('firstName', 'lastName', 'dob'))
+            record['b'] = {'pt': self.token(patient), 'fr': bool(data.get('freshen'))}
+        elif path == '/api/validate' and isinstance(data, dict):
+            record['b'] = {'a': bool(data.get('address'))}
+        elif path == '/api/submit' and isinstance(data, dict):
+            participation = data.get('participation')
+            record['b'] = {
+                'pa': participation if participation in PARTICIPATION else 'other',
+                'n': sum(1 for k, v in data.items() if k != 'participation' and v not in (None, '', [])),
+            }
+
+        reply = _json(response_body)
+        if isinstance(reply, dict):
+            if reply.get('session_id'):
+                record['ns'] = self.token(reply['session_id'])
+            if reply.get('submission_id'):
+                record['sub'] = self.token(reply['submission_id'])
+            if 'tries' in reply:
+                record['tr'] = reply['tries']
+        return {k: v for k, v in record.items() if v is not None}
+
+
+def _json(raw):
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return None
+
+
+capture_writer = CaptureWriter()
+
+
+def init_capture(app):
+    """Wrap app.wsgi_app when CAPTURE_ENABLED; the writer starts with the other background tasks."""
+    if not app.config.get('CAPTURE_ENABLED'):
+        return
+    capture_writer.directory = app.config['CAPTURE_DIR']
+    app.wsgi_app = CaptureMiddleware(app.wsgi_app, capture_writer,
+                                     app.config.get('CAPTURE_KEY') or app.config.get('SECRET_KEY'))
+    app.logger.warning("Traffic capture enabled, writing to %s", capture_writer.directory)
@@ -0,0 +1,40 @@
+# cors.py
+# CORS preflights answered in WSGI, before Flask routing, request hooks and
+# header logging run. The response headers for every allowed origin are built
+# once at startup; a preflight only looks its Origin up in a dict. Browsers
+# cache the answer for CORS_MAX_AGE seconds (Chromium caps this at 7200), so
+# most POSTs are no longer preceded by an OPTIONS round trip at all.
+# Headers on the actual (non-preflight) responses still come from flask_cors.
+
+ALLOW_METHODS = ('GET', 'POST', 'OPTIONS')
+
+
+class PreflightMiddleware:
+    def __init__(self, wsgi_app, origins, allow_headers, max_age):
+        self.wsgi_app = wsgi_app
+        common = [
+            ('Access-Control-Allow-Methods', ', '.join(ALLOW_METHODS)),
+            ('Access-Control-Allow-Headers', ', '.join(allow_headers)),
+            ('Access-Control-Allow-Credentials', 'true'),
+            ('Access-Control-Max-Age', str(max_age)),
+            ('Vary', 'Origin'),
+            ('Content-Length', '0'),
+        ]
+        self._allowed = {origin: [('Access-Control-Allow-Origin', origin)] + common for origin in origins}
+        self._forbidden = [('Content-Type', 'text/plain; charset=utf-8'), ('Content-Length', '9'), ('Vary', 'Origin')]
+
+    def __call__(self, environ, start_response):
+        # Only real preflights; a bare OPTIONS still goes to Flask
+        if environ.get('REQUEST_METHOD') != 'OPTIONS' or 'HTTP_ACCESS_CONTROL_REQUEST_METHOD' not in environ:
+            return self.wsgi_app(environ, start_response)
+        headers = self._allowed.get(environ.get('HTTP_ORIGIN'))
+        if headers is None:
+            start_response('403 FORBIDDEN', list(self._forbidden))
+            return [b'Forbidden']
+        start_response('204 NO CONTENT', list(headers))
+        return []
+
+
+def init_cors(app):
+    app.wsgi_app = PreflightMiddleware(app.wsgi_app, app.config['CORS_ORIGINS'],
+                                       app.config['CORS_ALLOW_HEADERS'], app.config['CORS_MAX_AGE'])
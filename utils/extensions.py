@@ -1,11 +1,149 @@
 # extensions.py
 import secrets
-from flask import request, jsonify
+from flask import request, jsonify, g, has_request_context
 from functools import wraps
 from flask_caching import Cache
+from utils.session_backends import CacheSessionBackend, make_session_backend
+from utils.metrics import metrics
 
 cache = Cache()
 
+# Bump when the layout of the session record changes so stale records are ignored
+SESSION_RECORD_VERSION = 1
+SESSION_TIMEOUT = 1 * 3600  # 1 hour
+
+
+class SessionStore:
+    """Keeps one versioned record per session instead of one cache key per field.
+
+    Reads are memoised for the length of a request and writes are buffered and
+    committed to the backend once in after_request, so a request costs at most
+    one read and one write round trip no matter how many fields it touches.
+    The backend is chosen by SESSION_BACKEND (see utils.session_backends);
+    filesystem sessions are read through a per-worker near cache (utils.nearcache).
+    """
+
+    def __init__(self, cache, timeout=SESSION_TIMEOUT):
+        self.cache = cache
+        self.timeout = timeout
+        self.backend = CacheSessionBackend(cache, timeout)
+
+    def init_app(self, app, sweeper=None):
+        self.backend = make_session_backend(app, self.cache, self.timeout, sweeper=sweeper)
+        app.after_request(self._flush_after_request)
+
+    def stats(self):
+        """Hit/miss and eviction counts for the near (this worker) and shared tiers."""
+        if hasattr(self.backend, 'stats'):
+            return self.backend.stats()
+        return {}
+
+    # -- request local buffering -------------------------------------------
+
+    def _request_state(self):
+        if not has_request_context():
+            return None
+        if '_session_store' not in g:
+            g._session_store = {'records': {}, 'pending': {}, 'cleared': set()}
+        return g._session_store
+
+    def _load(self, session_id):
+        if not session_id:
+            return None
+        state = self._request_state()
+        if state is not None and session_id in state['records']:
+            return state['records'][session_id]
+
+        with metrics.timer('session_load'):
+            record = self.backend.load(session_id)
+        if not isinstance(record, dict) or record.get('_v') != SESSION_RECORD_VERSION:
+            record = None
+        if state is not None:
+            state['records'][session_id] = record
+        return record
+
+    def _store(self, session_id, record, changed=(), dropped=(), replace=False):
+        state = self._request_state()
+        if state is None:
+            self.backend.commit({session_id: (record, set(changed), set(dropped), replace)}, ())
+            return
+        state['records'][session_id] = record
+        state['cleared'].discard(session_id)
+        pending = state['pending'].get(session_id)
+        if pending is None or replace:
+            state['pending'][session_id] = (record, set(changed), set(dropped), replace)
+            return
+        _record, pending_changed, pending_dropped, pending_replace = pending
+        pending_changed = (pending_changed - set(dropped)) | set(changed)
+        pending_dropped = (pending_dropped - set(changed)) | set(dropped)
+        state['pending'][session_id] = (record, pending_changed, pending_dropped, pending_replace)
+
+    def flush(self):
+        state = self._request_state()
+        if state is None or not (state['pending'] or state['cleared']):
+            return
+        with metrics.timer('session_commit'):
+            self.backend.commit(state['pending'], state['cleared'])
+        state['pending'] = {}
+        state['cleared'] = set()
+
+    def _flush_after_request(self, response):
+        self.flush()
+        return response
+
+    # -- public API ---------------------------------------------------------
+
+    def get(self, session_id, field=None, default=None):
+        record = self._load(session_id)
+        if record is None:
+            return default
+        if field is None:
+            return {k: v for k, v in record.items() if k != '_v'}
+        return record.get(field, default)
+
+    def get_many(self, session_id, *fields):
+        record = self._load(session_id) or {}
+        return [record.get(field) for field in fields]
+
+    def exists(self, session_id):
+        return self._load(session_id) is not None
+
+    def create(self, session_id, **fields):
+        record = dict(fields)
+        record['_v'] = SESSION_RECORD_VERSION
+        self._store(session_id, record, changed=record.keys(), replace=True)
+        return record
+
+    def update(self, session_id, drop=(), **fields):
+        # Field changes land in a single backend write, so readers never see a
+        # half-applied update.
+        current = self._load(session_id)
+        record = dict(current or {'_v': SESSION_RECORD_VERSION})
+        record.update(fields)
+        for field in drop:
+            record.pop(field, None)
+        self._store(session_id, record, changed=fields.keys(), dropped=drop, replace=current is None)
+        return record
+
+    def delete_many(self, session_id, *fields):
+        if self._load(session_id) is None:
+            return
+        self.update(session_id, drop=fields)
+
+    def clear(self, session_id):
+        if not session_id:
+            return
+        state = self._request_state()
+        if state is None:
+            self.backend.commit({}, (session_id,))
+            return
+        state['records'][session_id] = None
+        state['pending'].pop(session_id, None)
+        state['cleared'].add(session_id)
+
+
+session_store = SessionStore(cache)
+
 def generate_csp_nonce():
     return secrets.token_urlsafe(16)
 
@@ -22,8 +160,8 @@ def validate_nonce(f):
         if not session_id or not client_nonce:
             return jsonify({'error': 'Missing session ID or nonce'}), 403
 
-        session_data = cache.get(session_id)
-        if not session_data or session_data.get('nonce') != client_nonce:
+        stored_nonce = session_store.get(session_id, 'verify_nonce')
+        if not stored_nonce or stored_nonce != client_nonce:
             return jsonify({'error': 'Invalid session or nonce'}), 403
 
         return f(*args, **kwargs)
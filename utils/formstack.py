@@ -0,0 +1,143 @@
+# formstack.py
+# Formstack form schemas per environment (formstack_schema.json) and the
+# builder that turns a scored submission into a Formstack payload. The schema
+# is loaded, validated and compiled once at startup. An environment whose map
+# is missing or incomplete falls back, with a warning, to the schema's
+# fallback form: the one every environment posted to before there were
+# per-environment maps.
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'formstack_schema.json')
+
+
+class FormstackSchemaError(ValueError):
+    pass
+
+
+class SubmissionRecord:
+    """Everything that goes into one Formstack entry."""
+
+    __slots__ = ('first_name', 'last_name', 'dob', 'mrn', 'fin', 'result_date', 'result_time',
+                 'answers', 'domains', 'scores')
+
+    def __init__(self, first_name, last_name, dob, mrn, fin, result_date, result_time,
+                 answers, domains, scores):
+        self.first_name = first_name
+        self.last_name = last_name
+        self.dob = dob
+        self.mrn = mrn
+        self.fin = fin
+        self.result_date = result_date
+        self.result_time = result_time
+        self.answers = answers    # request field name -> answer
+        self.domains = domains    # domain name -> "POSITIVE" / "negative"
+        self.scores = scores      # score name -> int
+
+
+def _name(record):
+    return {"first": record.first_name, "last": record.last_name}
+
+
+def _attribute(name):
+    def get(record):
+        return getattr(record, name)
+    return get
+
+
+def _answer(field):
+    def get(record):
+        value = record.answers.get(field)
+        # Multi-select answers are sent one per line
+        if isinstance(value, list):
+            return "\n".join(value)
+        return value
+    return get
+
+
+def _domain(name):
+    def get(record):
+        return record.domains[name]
+    return get
+
+
+def _score(name):
+    def get(record):
+        return record.scores[name]
+    return get
+
+
+RECORD_SOURCES = ('result_date', 'result_time', 'mrn', 'fin', 'dob')
+
+
+def _getter(source):
+    if source == 'name':
+        return _name
+    if source in RECORD_SOURCES:
+        return _attribute(source)
+    kind, _, key = source.partition('.')
+    if kind == 'answer' and key:
+        return _answer(key)
+    if kind == 'domain' and key:
+        return _domain(key)
+    if kind == 'score' and key:
+        return _score(key)
+    raise FormstackSchemaError(f"Unknown Formstack field source: {source}")
+
+
+class PayloadBuilder:
+    """Compiled field map for one Formstack form."""
+
+    def __init__(self):
+        self.environment = None
+        self.form_id = None
+        self.url = None
+        self._fields = ()
+
+    def init_app(self, app, engine, path=None):
+        environment = app.config.get('FORMSTACK_SCHEMA_ENV') or app.config.get('FLASK_ENV') or 'development'
+        with open(path or SCHEMA_PATH) as f:
+            schema = json.load(f)
+        submission_url = app.config.get('FS_SUBMISSION_URL')
+        try:
+            self.compile(schema, environment, engine, submission_url)
+        except FormstackSchemaError as e:
+            fallback = schema.get('fallback')
+            if not fallback or fallback == environment:
+                raise
+            # Keep serving on the form in use so far rather than refuse to start
+            logger.warning("%s Submitting to the '%s' form instead.", e, fallback)
+            self.compile(schema, fallback, engine, submission_url)
+
+    def compile(self, schema, environment, engine, submission_url=None):
+        spec = schema['environments'].get(environment)
+        if spec is None:
+            raise FormstackSchemaError(f"No Formstack schema for environment '{environment}'")
+
+        sources = spec['fields']
+        # Every answer, domain and score the rule table produces must land somewhere
+        required = (
+            [f'answer.{field}' for field in sorted(engine.fields)]
+            + [f'domain.{name}' for name in engine.domain_names]
+            + [f'score.{name}' for name in engine.score_names]
+        )
+        missing = [source for source in required if source not in sources]
+        if missing:
+            raise FormstackSchemaError(
+                f"Formstack schema '{environment}' (form {spec['form_id']}) has no field id for: "
+                f"{', '.join(missing)}. Add them to formstack_schema.json."
+            )
+
+        self._fields = tuple((field_id, _getter(source)) for source, field_id in sources.items())
+        self.environment = environment
+        self.form_id = spec['form_id']
+        self.url = (submission_url or schema['submission_url']).format(form_id=spec['form_id'])
+
+    def build(self, record):
+        return {field_id: get(record) for field_id, get in self._fields}
+
+
+payload_builder = PayloadBuilder()
@@ -0,0 +1,100 @@
+# jsoncodec.py
+# One JSON codec for the whole app: Flask request parsing and responses, the
+# upstream clients, the outbox and the Redis session backend. Uses orjson when
+# it is installed and the stdlib json module otherwise; the output is valid
+# JSON either way, orjson just skips the \uXXXX escaping of non-ASCII text.
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+from utils.metrics import metrics
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def _default(obj):
+    # Same fallbacks Flask's provider uses (dates, decimals, dataclasses, __html__)
+    return DefaultJSONProvider.default(obj)
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumpb(obj, sort_keys=False, indent=False):
+        """Encode obj to UTF-8 JSON bytes."""
+        option = _OPTIONS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=_default, option=option)
+        except TypeError:
+            # Out of orjson's range (e.g. ints above 64 bits); the stdlib copes
+            return _stdlib_dumps(obj, sort_keys, indent).encode('utf-8')
+
+    def loads(data):
+        """Decode JSON from str, bytes or bytearray."""
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        return orjson.loads(data)
+
+else:
+    def dumpb(obj, sort_keys=False, indent=False):
+        """Encode obj to UTF-8 JSON bytes."""
+        return _stdlib_dumps(obj, sort_keys, indent).encode('utf-8')
+
+    def loads(data):
+        """Decode JSON from str, bytes or bytearray."""
+        return json.loads(data)
+
+
+def _stdlib_dumps(obj, sort_keys=False, indent=False):
+    if indent:
+        return json.dumps(obj, default=_default, sort_keys=sort_keys, indent=2)
+    return json.dumps(obj, default=_default, sort_keys=sort_keys, separators=(',', ':'))
+
+
+def dumps(obj, sort_keys=False, indent=False):
+    """Encode obj to a JSON str."""
+    return dumpb(obj, sort_keys, indent).decode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by this module.
+
+    Installed on app.json, so request.json / request.get_json() and jsonify()
+    in every blueprint go through it. Keeps Flask's sort_keys and debug-mode
+    pretty printing behaviour; responses are encoded straight to bytes.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if kwargs.keys() - {'sort_keys', 'indent'}:
+            # Caller wants stdlib-only options (cls, separators, ...)
+            kwargs.setdefault('default', self.default)
+            kwargs.setdefault('sort_keys', self.sort_keys)
+            return json.dumps(obj, **kwargs)
+        return dumps(obj, kwargs.get('sort_keys', self.sort_keys), bool(kwargs.get('indent')))
+
+    def loads(self, s, **kwargs):
+        with metrics.timer('json_parse'):
+            if kwargs:
+                return json.loads(s, **kwargs)
+            return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        with metrics.timer('json_encode'):
+            body = dumpb(obj, self.sort_keys, indent) + b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_app(app):
+    app.json = FastJSONProvider(app)
+    app.logger.info("JSON codec: %s", BACKEND)
@@ -0,0 +1,226 @@
+# logsetup.py
+# Logging off the request path. Request threads only put LogRecords on an
+# in-process queue; a listener thread formats them (text or JSON) and writes
+# them out. Header and body dumps go through log_headers()/log_body(), which
+# sample them and redact PHI and credentials according to config, and defer
+# building the dump until the listener formats it. Session ids in messages go
+# through session_ref(), which logs a keyed hash unless LOG_HEADERS=full.
+import atexit
+import hashlib
+import hmac
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+
+from flask.logging import default_handler
+
+from utils import jsoncodec
+
+# Request headers that carry credentials or session identifiers
+SENSITIVE_HEADERS = frozenset({
+    'authorization', 'cookie', 'set-cookie', 'session-id', 'verification-token',
+    'validation-token', 'x-csp-nonce', 'idempotency-key',
+})
+
+TEXT_FORMAT = '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_settings = {'headers': 'redacted', 'bodies': 'redacted', 'sample_rate': 1.0, 'key': b''}
+_pipeline = {'queue': None, 'handler': None, 'listener': None, 'targets': (), 'pid': None}
+
+
+class _DeferredQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # The listener is in this process, so the record can go on the queue as-is;
+        # message formatting (and any lazy dump objects in args) happens over there
+        return record
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, including anything passed through extra=."""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'pid': record.process,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return jsoncodec.dumps(entry)
+
+
+class _HeaderDump:
+    """Headers rendered only when the record is formatted."""
+
+    __slots__ = ('items', 'redact')
+
+    def __init__(self, items, redact):
+        self.items = items
+        self.redact = redact
+
+    def __str__(self):
+        if self.redact:
+            return str({k: ('<redacted>' if k.lower() in SENSITIVE_HEADERS else v) for k, v in self.items})
+        return str(dict(self.items))
+
+
+class _BodyDump:
+    """A request or upstream body rendered only when the record is formatted.
+
+    Redacted bodies keep their shape (keys, value types and lengths) but none
+    of the values, which are names, dates of birth, addresses and SDOH answers.
+    """
+
+    __slots__ = ('data', 'redact')
+
+    def __init__(self, data, redact):
+        self.data = data
+        self.redact = redact
+
+    def __str__(self):
+        return str(_shape(self.data) if self.redact else self.data)
+
+
+class _SessionRef:
+    """A Session-ID rendered only when the record is formatted.
+
+    Redacted, it is a short keyed hash: the same session gets the same tag on
+    every worker, so its lines can be followed without logging the id itself.
+    """
+
+    __slots__ = ('session_id', 'redact')
+
+    def __init__(self, session_id, redact):
+        self.session_id = session_id
+        self.redact = redact
+
+    def __str__(self):
+        if not self.session_id:
+            return '-'
+        if not self.redact:
+            return self.session_id
+        return 'sid:' + hmac.new(_settings['key'], self.session_id.encode(), hashlib.sha256).hexdigest()[:12]
+
+
+def _shape(value):
+    if isinstance(value, dict):
+        return {k: _shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_shape(v) for v in value]
+    if isinstance(value, str):
+        return f'<str:{len(value)}>'
+    if value is None or isinstance(value, bool):
+        return value
+    return f'<{type(value).__name__}>'
+
+
+def _sampled():
+    rate = _settings['sample_rate']
+    return rate >= 1 or random.random() < rate
+
+
+def log_headers(logger, headers, label='Headers'):
+    """Log request headers per LOG_HEADERS ('off', 'redacted' or 'full') and LOG_SAMPLE_RATE."""
+    mode = _settings['headers']
+    if mode == 'off' or not logger.isEnabledFor(logging.INFO) or not _sampled():
+        return
+    logger.info('%s: %s', label, _HeaderDump(list(headers.items()), mode != 'full'), stacklevel=2)
+
+
+def log_body(logger, label, data):
+    """Log a request/response body per LOG_BODIES ('off', 'redacted' or 'full') and LOG_SAMPLE_RATE."""
+    mode = _settings['bodies']
+    if mode == 'off' or not logger.isEnabledFor(logging.INFO) or not _sampled():
+        return
+    logger.info('%s: %s', label, _BodyDump(data, mode != 'full'), stacklevel=2)
+
+
+def session_ref(session_id):
+    """Session-ID for a log message: hashed, unless LOG_HEADERS is 'full'."""
+    return _SessionRef(session_id, _settings['headers'] != 'full')
+
+
+def _targets(app):
+    if app.config.get('LOG_FILE'):
+        # Watched: picks up logrotate moving the file underneath us
+        target = WatchedFileHandler(app.config['LOG_FILE'])
+    else:
+        target = logging.StreamHandler(sys.stderr)
+    if app.config.get('LOG_FORMAT') == 'json':
+        target.setFormatter(JSONFormatter())
+    else:
+        target.setFormatter(logging.Formatter(TEXT_FORMAT))
+    return (target,)
+
+
+def _key(secret):
+    if not secret:
+        return b''
+    return secret.encode() if isinstance(secret, str) else secret
+
+
+def init_logging(app):
+    """Route the root logger (and so app.logger and every module logger) through the queue."""
+    _settings.update(
+        headers=app.config.get('LOG_HEADERS', 'redacted'),
+        bodies=app.config.get('LOG_BODIES', 'redacted'),
+        sample_rate=float(app.config.get('LOG_SAMPLE_RATE', 1.0)),
+        key=_key(app.config.get('SECRET_KEY')),
+    )
+    level = logging.getLevelName(app.config.get('LOG_LEVEL', 'INFO'))
+
+    root = logging.getLogger()
+    if _pipeline['handler'] is not None:
+        # Set up again: the old writer drains the old queue and stops
+        root.removeHandler(_pipeline['handler'])
+        stop_log_listener()
+    _pipeline['targets'] = _targets(app)
+    _pipeline['queue'] = queue.SimpleQueue()
+    _pipeline['handler'] = _DeferredQueueHandler(_pipeline['queue'])
+    root.addHandler(_pipeline['handler'])
+    root.setLevel(level)
+
+    # Flask's own stderr handler would write synchronously on the request thread
+    app.logger.removeHandler(default_handler)
+    app.logger.setLevel(level)
+    start_log_listener()
+    atexit.register(stop_log_listener)
+
+
+def start_log_listener():
+    """Start the writer thread for this process. Safe to call again after fork."""
+    if _pipeline['handler'] is None:
+        return
+    pid = os.getpid()
+    if _pipeline['listener'] is not None and _pipeline['pid'] == pid:
+        return
+    if _pipeline['pid'] is not None and _pipeline['pid'] != pid:
+        # Forked: the parent's writer thread did not come along, and its queue may
+        # hold records the parent still owns, so this process gets a fresh one
+        _pipeline['queue'] = queue.SimpleQueue()
+        _pipeline['handler'].queue = _pipeline['queue']
+    listener = QueueListener(_pipeline['queue'], *_pipeline['targets'], respect_handler_level=True)
+    listener.start()
+    _pipeline['listener'] = listener
+    _pipeline['pid'] = pid
+
+
+def stop_log_listener():
+    """Flush queued records and stop the writer thread."""
+    listener = _pipeline['listener']
+    if listener is not None and _pipeline['pid'] == os.getpid():
+        listener.stop()
+    _pipeline['listener'] = None
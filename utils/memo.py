@@ -0,0 +1,172 @@
+# memo.py
+# Short-lived memo of Corepoint identity lookups. Patients resubmit the same
+# name and date of birth within seconds (double taps, the back button, freshen
+# retries); those are answered from this worker's memory instead of another
+# Corepoint call, and identical lookups already in flight wait for the first
+# one instead of starting their own (single flight).
+#
+# Entries hold PHI, so they are Fernet-encrypted with a key that only lives in
+# this process, and keyed by a salted HMAC of the identity rather than the
+# names themselves. Without the optional cryptography package the memo stays
+# off; lookups still coalesce. Only successful (200) lookups are memoised.
+import hashlib
+import hmac
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from utils import jsoncodec
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class LookupMemo:
+    """TTL + LRU memo with single-flight coalescing for one kind of upstream lookup."""
+
+    def __init__(self, ttl=30, max_entries=1024, wait_timeout=30):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self._salt = secrets.token_bytes(32)
+        self._fernet = None
+        self._entries = OrderedDict()  # key -> (expires_at, encrypted result)
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._cipher_lock = threading.Lock()
+        self._counts = {'lookups': 0, 'hits': 0, 'coalesced': 0, 'upstream_calls': 0, 'bypassed': 0}
+
+    def init_app(self, app):
+        self.ttl = app.config.get('COREPOINT_MEMO_TTL', 30)
+        self.max_entries = app.config.get('COREPOINT_MEMO_SIZE', 1024)
+        self.wait_timeout = app.config.get('CP_READ_TIMEOUT', 15) * 2
+
+    @property
+    def enabled(self):
+        return bool(self.ttl) and self._fernet is not False
+
+    def _cipher(self):
+        # cryptography is imported on the first memoised lookup rather than at startup,
+        # and after a gunicorn fork, so every worker gets its own key
+        if self._fernet is None:
+            with self._cipher_lock:
+                if self._fernet is None:
+                    try:
+                        from cryptography.fernet import Fernet
+                    except ImportError:  # pragma: no cover - optional dependency
+                        logger.warning("cryptography is not installed; Corepoint lookups are coalesced but not memoised")
+                        self._fernet = False
+                    else:
+                        self._fernet = Fernet(Fernet.generate_key())
+        return self._fernet
+
+    def key(self, *parts):
+        normalized = '|'.join(str(part or '').strip().lower() for part in parts)
+        return hmac.new(self._salt, normalized.encode(), hashlib.sha256).digest()
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, token = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return jsoncodec.loads(self._fernet.decrypt(token))
+
+    def _put(self, key, value):
+        cipher = self._cipher()
+        if not cipher:
+            return
+        token = cipher.encrypt(jsoncodec.dumpb(value))
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, token)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, key, fetch, refresh=False, cacheable=lambda result: True):
+        """fetch()'s result for key, from the memo, a lookup already in flight, or a new call.
+
+        refresh=True always makes a new call, whose result replaces the memoised one.
+        """
+        self._count('lookups')
+        if refresh:
+            self._count('bypassed')
+            return self._call(fetch, None, key, cacheable)
+        if self.enabled:
+            cached = self._get(key)
+            if cached is not None:
+                self._count('hits')
+                return cached
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            if flight.done.wait(self.wait_timeout):
+                self._count('coalesced')
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result
+            # Leader is stuck; make our own call rather than wait forever
+            return self._call(fetch, None, key, cacheable)
+        return self._call(fetch, flight, key, cacheable)
+
+    def _call(self, fetch, flight, key, cacheable):
+        self._count('upstream_calls')
+        try:
+            result = fetch()
+        except BaseException as e:
+            if flight is not None:
+                flight.error = e
+            raise
+        else:
+            if flight is not None:
+                flight.result = result
+            if self.enabled and cacheable(result):
+                self._put(key, result)
+            return result
+        finally:
+            if flight is not None:
+                with self._lock:
+                    self._flights.pop(key, None)
+                flight.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+            counts['entries'] = len(self._entries)
+        saved = counts['hits'] + counts['coalesced']
+        counts.update(
+            enabled=self.enabled,
+            ttl_seconds=self.ttl,
+            upstream_calls_saved=saved,
+            hit_ratio=round(saved / counts['lookups'], 4) if counts['lookups'] else None,
+        )
+        return counts
+
+
+corepoint_memo = LookupMemo()
@@ -0,0 +1,254 @@
+# metrics.py
+# Latency histograms for the request hot path (session cache reads/writes,
+# Corepoint and Formstack calls, scoring, JSON parsing, outbox writes) and for
+# whole requests. Each worker keeps its histograms in memory and a background
+# thread writes them to METRICS_DIR/<pid>.json; /metrics sums every worker's
+# file into one Prometheus text exposition. Stages timed inside a request can
+# also be reported to the browser in a Server-Timing header (SERVER_TIMING).
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+logger = logging.getLogger(__name__)
+
+# Seconds; chosen around sub-millisecond cache hits up to the upstream read timeouts
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    'sdoh_stage_seconds': 'Time spent in one stage of request handling or delivery',
+    'sdoh_request_seconds': 'Time from before_request to after_request',
+}
+
+ARCHIVE = 'archive.json'
+LOCK_NAME = '.lock'
+
+
+class Histograms:
+    """Fixed-bucket histograms keyed by (metric name, label tuple).
+
+    Each series is a list of per-bucket counts (not cumulative) followed by
+    the +Inf count, the sum and the total count.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, labels, seconds):
+        size = len(self.buckets)
+        index = size
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                index = i
+                break
+        key = (name, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (size + 3)
+            series[index] += 1
+            series[size + 1] += seconds
+            series[size + 2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[name, list(labels), list(series)] for (name, labels), series in self._series.items()]
+
+
+def merge(into, snapshot):
+    for name, labels, series in snapshot:
+        key = (name, tuple(tuple(pair) for pair in labels))
+        current = into.get(key)
+        if current is None:
+            into[key] = list(series)
+        else:
+            for i, value in enumerate(series):
+                current[i] += value
+    return into
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms = Histograms()
+        self.directory = None
+        self.flush_interval = 5.0
+        self.server_timing = False
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def init_app(self, app):
+        self.directory = app.config.get('METRICS_DIR')
+        self.flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', 5.0)
+        self.server_timing = app.config.get('SERVER_TIMING', False)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    # -- recording --------------------------------------------------------------
+
+    def observe(self, stage, seconds):
+        self.histograms.observe('sdoh_stage_seconds', (('stage', stage),), seconds)
+        if has_request_context():
+            timings = g.get('_stage_timings')
+            if timings is None:
+                timings = g._stage_timings = {}
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def _before_request(self):
+        g._request_started = time.perf_counter()
+
+    def _after_request(self, response):
+        started = g.get('_request_started')
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        labels = (('endpoint', request.endpoint or 'none'), ('method', request.method),
+                  ('status', f'{response.status_code // 100}xx'))
+        self.histograms.observe('sdoh_request_seconds', labels, elapsed)
+        if self.server_timing:
+            parts = [f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in g.get('_stage_timings', {}).items()]
+            parts.append(f'app;dur={elapsed * 1000:.2f}')
+            response.headers['Server-Timing'] = ', '.join(parts)
+            # Browsers only expose Server-Timing cross-origin to origins CORS already allowed
+            allowed = response.headers.get('Access-Control-Allow-Origin')
+            if allowed:
+                response.headers['Timing-Allow-Origin'] = allowed
+        return response
+
+    # -- cross-worker aggregation -------------------------------------------------
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def flush(self):
+        """Write this worker's histograms to METRICS_DIR/<pid>.json."""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(f'{os.getpid()}.json')
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(json.dumps(self.histograms.snapshot(), separators=(',', ':')).encode())
+        os.replace(tmp, path)
+
+    def _compact(self):
+        # Fold files left by workers that have exited (max_requests recycling,
+        # restarts) into the archive so their counts are kept but files do not pile up
+        with open(self._path(LOCK_NAME), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                dead = []
+                for name in os.listdir(self.directory):
+                    pid = name[:-len('.json')]
+                    if not name.endswith('.json') or not pid.isdigit():
+                        continue
+                    try:
+                        os.kill(int(pid), 0)
+                    except ProcessLookupError:
+                        dead.append(name)
+                    except PermissionError:
+                        pass
+                if not dead:
+                    return
+                series = merge({}, self._read(ARCHIVE))
+                for name in dead:
+                    merge(series, self._read(name))
+                tmp = self._path(f'{ARCHIVE}.tmp')
+                with open(tmp, 'wb') as f:
+                    f.write(json.dumps([[n, list(labels), s] for (n, labels), s in series.items()]).encode())
+                os.replace(tmp, self._path(ARCHIVE))
+                for name in dead:
+                    os.unlink(self._path(name))
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self, name):
+        try:
+            with open(self._path(name), 'rb') as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return []
+        except ValueError:
+            logger.warning("Ignoring unreadable metrics file %s", name)
+            return []
+
+    def collect(self):
+        """Histograms summed over every worker on this host, including exited ones."""
+        if not self.directory:
+            return merge({}, self.histograms.snapshot())
+        self.flush()
+        series = {}
+        # Shared lock: never read a dead worker's file and the archive it was just folded into
+        with open(self._path(LOCK_NAME), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            try:
+                for name in os.listdir(self.directory):
+                    if name.endswith('.json'):
+                        merge(series, self._read(name))
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return series
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        buckets = self.histograms.buckets
+        size = len(buckets)
+        lines = []
+        by_name = {}
+        for (name, labels), series in sorted(self.collect().items()):
+            by_name.setdefault(name, []).append((labels, series))
+        for name, entries in by_name.items():
+            lines.append(f'# HELP {name} {HELP.get(name, name)}')
+            lines.append(f'# TYPE {name} histogram')
+            for labels, series in entries:
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+                prefix = f'{label_text},' if label_text else ''
+                suffix = f'{{{label_text}}}' if label_text else ''
+                cumulative = 0
+                for bound, count in zip(buckets, series):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                cumulative += series[size]
+                lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+                lines.append(f'{name}_sum{suffix} {series[size + 1]:.6f}')
+                lines.append(f'{name}_count{suffix} {series[size + 2]}')
+        return '\n'.join(lines) + '\n'
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                self._compact()
+            except Exception:
+                logger.exception("Metrics flush failed")
+
+    def start(self):
+        if not self.directory:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+        self._thread.start()
+        self._pid = os.getpid()
+
+    def stop(self):
+        self._stop.set()
+
+
+metrics = Metrics()
@@ -0,0 +1,174 @@
+# nearcache.py
+# Per-worker near cache of session records in front of the filesystem
+# session backend. Protected requests read the same record several times per
+# session while it only changes a few times, so reads are answered from
+# process memory when the record is unchanged.
+#
+# "Unchanged" is decided by a version stamp, never by age alone: every write
+# gives the session a new random stamp in the same step as the backend
+# commit, and every read compares the stamp it cached the record under with
+# the current one before using it. The stamps live in a small shared-memory
+# table (StampTable), so checking one costs no I/O, and a worker never serves
+# a nonce or token another worker has since replaced or dropped. Entries also
+# expire after `ttl` seconds and the least recently used go first once
+# `max_entries` is reached.
+#
+# Redis sessions are not near cached: the stamp would have to be read from
+# Redis on every load, which costs the same round trip as the record itself.
+import fcntl
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+SLOT = struct.Struct('<Q')
+
+
+class StampTable:
+    """Version stamps shared by the workers on one host: a file of 8-byte slots mapped into each process.
+
+    A session's stamp is slot crc32(session_id) % slots. Writers replace it with
+    a random value while holding an flock on the file, around the backend
+    commit, so a stamp never names an older record than the one stored.
+    Sessions sharing a slot only cost each other a near-cache miss.
+    """
+
+    def __init__(self, path, slots=65536):
+        self.path = path
+        self.slots = slots
+        self._file = None
+        self._map = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _mapped(self):
+        # flock belongs to the open file, which a fork shares; each worker opens its own
+        if self._map is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            f = open(self.path, 'a+b')
+            size = self.slots * SLOT.size
+            if os.fstat(f.fileno()).st_size < size:
+                f.truncate(size)
+            self._file = f
+            self._map = mmap.mmap(f.fileno(), size)
+            self._pid = os.getpid()
+        return self._map
+
+    def _offset(self, session_id):
+        return zlib.crc32(session_id.encode()) % self.slots * SLOT.size
+
+    def read(self, session_id):
+        return SLOT.unpack_from(self._mapped(), self._offset(session_id))[0]
+
+    def commit(self, session_ids, commit):
+        """Run commit() and restamp session_ids as one step for every worker; returns the new stamps."""
+        with self._lock:
+            table = self._mapped()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                commit()
+                stamps = {}
+                for session_id in session_ids:
+                    stamps[session_id] = random.getrandbits(64)
+                    SLOT.pack_into(table, self._offset(session_id), stamps[session_id])
+                return stamps
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+
+class NearCacheBackend:
+    """LRU + TTL near cache over a session backend, validated by version stamps; write-through.
+
+    Backends without local stamps (Redis, the in-process memory backend), or
+    max_entries=0, pass straight through and only get counted.
+    """
+
+    def __init__(self, backend, max_entries=1024, ttl=30):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = bool(max_entries and ttl) and hasattr(backend, 'stamp')
+        self._entries = OrderedDict()  # session_id -> (expires_at, stamp, record)
+        self._lock = threading.Lock()
+        self._near = {'stamp_checks': 0, 'hits': 0, 'misses': 0, 'stale': 0, 'expired': 0, 'evictions': 0}
+        self._shared = {'loads': 0, 'hits': 0, 'misses': 0, 'commits': 0}
+
+    @property
+    def timeout(self):
+        return self.backend.timeout
+
+    def load(self, session_id):
+        if not self.enabled:
+            return self._load_shared(session_id)
+        # Read the stamp before the record: a write landing in between leaves
+        # a newer record under an older stamp, which only costs a miss
+        stamp = self.backend.stamp(session_id)
+        now = time.monotonic()
+        with self._lock:
+            self._near['stamp_checks'] += 1
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                expires_at, entry_stamp, record = entry
+                if entry_stamp == stamp and expires_at > now:
+                    self._entries.move_to_end(session_id)
+                    self._near['hits'] += 1
+                    return dict(record)
+                del self._entries[session_id]
+                self._near['stale' if entry_stamp != stamp else 'expired'] += 1
+            self._near['misses'] += 1
+        record = self._load_shared(session_id)
+        if isinstance(record, dict) and stamp is not None:
+            self._put(session_id, stamp, record)
+        return record
+
+    def _load_shared(self, session_id):
+        record = self.backend.load(session_id)
+        with self._lock:
+            self._shared['loads'] += 1
+            self._shared['hits' if record is not None else 'misses'] += 1
+        return record
+
+    def _put(self, session_id, stamp, record):
+        with self._lock:
+            self._entries[session_id] = (time.monotonic() + self.ttl, stamp, dict(record))
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._near['evictions'] += 1
+
+    def commit(self, writes, deletes):
+        with self._lock:
+            self._shared['commits'] += 1
+        if not self.enabled:
+            self.backend.commit(writes, deletes)
+            return
+        # Drop first, so a failed commit cannot leave the old copy behind
+        with self._lock:
+            for session_id in (*writes, *deletes):
+                self._entries.pop(session_id, None)
+        stored = self.backend.commit_stamped(writes, deletes)
+        for session_id, (stamp, record) in stored.items():
+            if isinstance(record, dict):
+                self._put(session_id, stamp, record)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            near = dict(self._near, entries=len(self._entries))
+            shared = dict(self._shared)
+        near_lookups = near['hits'] + near['misses']
+        near.update(enabled=self.enabled, max_entries=self.max_entries, ttl_seconds=self.ttl,
+                    hit_ratio=round(near['hits'] / near_lookups, 4) if near_lookups else None)
+        shared.update(backend=type(self.backend).__name__,
+                      hit_ratio=round(shared['hits'] / shared['loads'], 4) if shared['loads'] else None,
+                      evictions=self.backend.evictions() if hasattr(self.backend, 'evictions') else None)
+        return {'near': near, 'shared': shared}
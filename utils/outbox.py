@@ -0,0 +1,252 @@
+# outbox.py
+# Durable queue for Formstack submissions. /api/submit only has to get the
+# payload safely onto local disk; a background drainer delivers it upstream
+# with bounded concurrency, retries and dead-lettering. Each row carries an
+# idempotency key, so a retried submission maps to the row queued first for
+# as long as idempotency_ttl.
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import jsoncodec
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+SENDING = 'sending'
+DELIVERED = 'delivered'
+DEAD = 'dead'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    id TEXT PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    session_id TEXT,
+    url TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    lease_until REAL,
+    last_error TEXT,
+    response TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS submissions_due ON submissions (status, next_attempt_at);
+"""
+
+
+class DeliveryError(Exception):
+    """Raised by a deliver callable; permanent=True sends the row straight to dead-letter."""
+
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+class Outbox:
+    """SQLite (WAL) backed outbox shared by every worker on the host.
+
+    Rows move queued -> sending -> delivered, or back to queued with a
+    jittered backoff when delivery fails, and to dead once max_attempts is
+    reached. Workers claim rows inside BEGIN IMMEDIATE transactions and hold
+    them under a lease, so a row is only in flight in one place at a time and
+    is picked up again if the worker delivering it dies.
+    """
+
+    def __init__(self, path=None, concurrency=2, max_attempts=8, backoff=2.0, backoff_max=300.0,
+                 poll_interval=1.0, lease_seconds=120, retention_seconds=7 * 24 * 3600, idempotency_ttl=24 * 3600):
+        self.path = path
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        self.idempotency_ttl = idempotency_ttl
+        self.deliver = None
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def init_app(self, app, deliver):
+        self.path = app.config['OUTBOX_PATH']
+        self.concurrency = app.config['OUTBOX_CONCURRENCY']
+        self.max_attempts = app.config['OUTBOX_MAX_ATTEMPTS']
+        self.idempotency_ttl = app.config['OUTBOX_IDEMPOTENCY_TTL']
+        self.deliver = deliver
+        self._conn().executescript(SCHEMA)
+
+    # -- storage ---------------------------------------------------------------
+
+    def _conn(self):
+        # sqlite connections must not cross threads or forks
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            # FULL: the row is on disk before /api/submit answers
+            conn.execute('PRAGMA synchronous=FULL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def enqueue(self, idempotency_key, url, payload, session_id=None):
+        """Store a submission durably. Returns (row, created); an existing row is returned for a repeated key.
+
+        The check and the insert run in one BEGIN IMMEDIATE transaction, so of
+        several concurrent requests with the same key exactly one creates the
+        row and the others wait for it and get it back.
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT * FROM submissions WHERE idempotency_key = ?', (idempotency_key,)
+            ).fetchone()
+            if row is not None and row['created_at'] + self.idempotency_ttl >= now:
+                conn.execute('COMMIT')
+                return dict(row), False
+            if row is not None:
+                # Expired: the old row keeps its history under a key nobody will send again
+                conn.execute(
+                    "UPDATE submissions SET idempotency_key = idempotency_key || ':' || id WHERE id = ?", (row['id'],)
+                )
+            submission_id = str(uuid.uuid4())
+            conn.execute(
+                'INSERT INTO submissions (id, idempotency_key, session_id, url, payload, status, '
+                'next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (submission_id, idempotency_key, session_id, url, jsoncodec.dumps(payload), QUEUED, now, now, now)
+            )
+            row = conn.execute('SELECT * FROM submissions WHERE id = ?', (submission_id,)).fetchone()
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._wakeup.set()
+        return dict(row), True
+
+    def find(self, idempotency_key):
+        """The row already queued under idempotency_key within idempotency_ttl, or None."""
+        row = self._conn().execute(
+            'SELECT * FROM submissions WHERE idempotency_key = ? AND created_at >= ?',
+            (idempotency_key, time.time() - self.idempotency_ttl)
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def get(self, submission_id):
+        row = self._conn().execute('SELECT * FROM submissions WHERE id = ?', (submission_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def _claim(self, limit):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                'SELECT * FROM submissions WHERE (status = ? AND next_attempt_at <= ?) '
+                'OR (status = ? AND lease_until < ?) ORDER BY next_attempt_at LIMIT ?',
+                (QUEUED, now, SENDING, now, limit)
+            ).fetchall()
+            for row in rows:
+                conn.execute(
+                    'UPDATE submissions SET status = ?, lease_until = ?, updated_at = ? WHERE id = ?',
+                    (SENDING, now + self.lease_seconds, now, row['id'])
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return [dict(row) for row in rows]
+
+    def _finish(self, submission_id, status, attempts, next_attempt_at=None, error=None, response=None):
+        now = time.time()
+        # A delivered payload (name, DOB, MRN, answers) is not kept for the retention period;
+        # queued and dead rows keep theirs so they can still be sent
+        self._conn().execute(
+            'UPDATE submissions SET status = ?, attempts = ?, next_attempt_at = ?, lease_until = NULL, '
+            "last_error = ?, response = ?, updated_at = ?, payload = CASE WHEN ? THEN '' ELSE payload END "
+            'WHERE id = ?',
+            (status, attempts, next_attempt_at or now, error, response, now, status == DELIVERED, submission_id)
+        )
+
+    def _purge(self):
+        cutoff = time.time() - self.retention_seconds
+        self._conn().execute(
+            'DELETE FROM submissions WHERE status IN (?, ?) AND updated_at < ?', (DELIVERED, DEAD, cutoff)
+        )
+
+    # -- delivery --------------------------------------------------------------
+
+    def _deliver_one(self, row):
+        attempts = row['attempts'] + 1
+        try:
+            response = self.deliver(row['url'], jsoncodec.loads(row['payload']))
+        except Exception as e:
+            permanent = isinstance(e, DeliveryError) and e.permanent
+            if permanent or attempts >= self.max_attempts:
+                logger.error("Submission %s dead-lettered after %d attempts: %s", row['id'], attempts, e)
+                self._finish(row['id'], DEAD, attempts, error=str(e))
+            else:
+                delay = min(self.backoff_max, self.backoff * (2 ** (attempts - 1)))
+                delay = random.uniform(delay / 2, delay)
+                logger.warning("Submission %s attempt %d failed, retrying in %.1fs: %s", row['id'], attempts, delay, e)
+                self._finish(row['id'], QUEUED, attempts, next_attempt_at=time.time() + delay, error=str(e))
+            return
+        # Only Formstack's submission id is kept; its reply can echo the submitted fields back
+        receipt = {'id': response.get('id')} if isinstance(response, dict) else None
+        self._finish(row['id'], DELIVERED, attempts, response=jsoncodec.dumps(receipt))
+        logger.info("Submission %s delivered after %d attempt(s)", row['id'], attempts)
+
+    def drain(self, executor):
+        rows = self._claim(self.concurrency)
+        if rows:
+            # Block until this batch is done so at most `concurrency` deliveries run per worker
+            list(executor.map(self._deliver_one, rows))
+        return len(rows)
+
+    def _run(self):
+        last_purge = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='outbox') as executor:
+            while not self._stop.is_set():
+                try:
+                    if self.drain(executor):
+                        continue
+                    if time.time() - last_purge > 3600:
+                        self._purge()
+                        last_purge = time.time()
+                except Exception:
+                    logger.exception("Outbox drain failed")
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='outbox-drainer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def stats(self):
+        rows = self._conn().execute('SELECT status, COUNT(*) AS n FROM submissions GROUP BY status').fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+
+outbox = Outbox()
@@ -0,0 +1,285 @@
+# ratelimit.py
+# Sliding-window rate limits shared by every worker. Each rule is a count per
+# window (e.g. 10 verifies per patient identity per 15 minutes), or off, and is tracked as two
+# fixed windows, weighting the previous one by how much of it still overlaps
+# the sliding window. Check-and-increment is a single atomic step in the
+# store: a BEGIN IMMEDIATE transaction in SQLite (one host), a Lua script in
+# Redis (SESSION_BACKEND=redis) or a lock (SESSION_BACKEND=memory), so
+# concurrent requests cannot both slip under a limit. Allowed/rejected
+# counts per rule are kept in the same store for /api/monitor/ratelimit.
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+Decision = namedtuple('Decision', 'allowed count limit retry_after')
+
+# rule -> config key holding "count/seconds"
+RULES = {
+    'verify_ip': 'VERIFY_LIMIT_IP',
+    'verify_identity': 'VERIFY_LIMIT_IDENTITY',
+    'verify_session': 'VERIFY_LIMIT_SESSION',
+    'verify_fail': 'VERIFY_LIMIT_FAILURES',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS windows (
+    key TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (key, start)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    n INTEGER NOT NULL
+);
+"""
+
+REDIS_HIT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local count = previous * tonumber(ARGV[3]) + current
+local cost = tonumber(ARGV[4])
+if cost > 0 and count + cost > tonumber(ARGV[1]) then
+    redis.call('HINCRBY', KEYS[3], ARGV[5] .. ':rejected', 1)
+    return {0, tostring(count)}
+end
+if cost > 0 then
+    redis.call('INCRBY', KEYS[1], cost)
+    redis.call('EXPIRE', KEYS[1], 2 * tonumber(ARGV[2]))
+    redis.call('HINCRBY', KEYS[3], ARGV[5] .. ':allowed', 1)
+end
+return {1, tostring(count + cost)}
+"""
+
+
+def parse_rule(value):
+    """'30/300' -> (30, 300): at most 30 hits per 300 seconds. '' or 'off' -> None (no limit)."""
+    if value is None or str(value).strip().lower() in ('', 'off'):
+        return None
+    count, seconds = str(value).split('/')
+    return int(count), int(seconds)
+
+
+class SqliteLimitStore:
+    """Windows in a SQLite file shared by the workers on one host."""
+
+    def __init__(self, path, purge_interval=60):
+        self.path = path
+        self.purge_interval = purge_interval
+        self._last_purge = 0
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        # sqlite connections must not cross threads or forks
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Counters, not records: losing the last few on power loss is fine
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def hit(self, key, limit, window, start, weight, cost, rule):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = dict(conn.execute(
+                'SELECT start, count FROM windows WHERE key = ? AND start IN (?, ?)', (key, start, start - window)
+            ).fetchall())
+            count = rows.get(start - window, 0) * weight + rows.get(start, 0)
+            allowed = not (cost > 0 and count + cost > limit)
+            if cost > 0:
+                if allowed:
+                    count += cost
+                    conn.execute(
+                        'INSERT INTO windows (key, start, count, expires_at) VALUES (?, ?, ?, ?) '
+                        'ON CONFLICT (key, start) DO UPDATE SET count = count + excluded.count',
+                        (key, start, cost, start + 2 * window)
+                    )
+                conn.execute(
+                    'INSERT INTO counters (name, n) VALUES (?, 1) ON CONFLICT (name) DO UPDATE SET n = n + 1',
+                    (f"{rule}:{'allowed' if allowed else 'rejected'}",)
+                )
+            if now - self._last_purge > self.purge_interval:
+                self._last_purge = now
+                conn.execute('DELETE FROM windows WHERE expires_at < ?', (now,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, count
+
+    def reset(self, key, start, window):
+        self._conn().execute('DELETE FROM windows WHERE key = ?', (key,))
+
+    def counters(self):
+        return dict(self._conn().execute('SELECT name, n FROM counters').fetchall())
+
+
+class RedisLimitStore:
+    """Windows as Redis counters with a TTL, updated by one Lua script per hit."""
+
+    def __init__(self, url, prefix='sdoh:rl:', client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self._hit = client.register_script(REDIS_HIT)
+
+    def hit(self, key, limit, window, start, weight, cost, rule):
+        allowed, count = self._hit(
+            keys=[f'{self.prefix}{key}:{start}', f'{self.prefix}{key}:{start - window}', f'{self.prefix}counters'],
+            args=[limit, window, weight, cost, rule]
+        )
+        return bool(allowed), float(count)
+
+    def reset(self, key, start, window):
+        self.client.delete(f'{self.prefix}{key}:{start}', f'{self.prefix}{key}:{start - window}')
+
+    def counters(self):
+        return {k.decode(): int(v) for k, v in self.client.hgetall(f'{self.prefix}counters').items()}
+
+
+class MemoryLimitStore:
+    """In-process stand-in for local runs; limits are per worker."""
+
+    def __init__(self):
+        self._windows = {}  # (key, start) -> [count, expires_at]
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window, start, weight, cost, rule):
+        now = time.time()
+        with self._lock:
+            previous = self._windows.get((key, start - window), (0,))[0]
+            current = self._windows.get((key, start), (0,))[0]
+            count = previous * weight + current
+            allowed = not (cost > 0 and count + cost > limit)
+            if cost > 0:
+                if allowed:
+                    count += cost
+                    self._windows[(key, start)] = [current + cost, start + 2 * window]
+                name = f"{rule}:{'allowed' if allowed else 'rejected'}"
+                self._counters[name] = self._counters.get(name, 0) + 1
+            if len(self._windows) > 10000:
+                for stale in [k for k, (_n, expires_at) in self._windows.items() if expires_at < now]:
+                    del self._windows[stale]
+        return allowed, count
+
+    def reset(self, key, start, window):
+        with self._lock:
+            for stale in [k for k in self._windows if k[0] == key]:
+                del self._windows[stale]
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+class RateLimiter:
+    def __init__(self):
+        self.store = None
+        self.rules = {}
+        self.proxy_hops = 0
+        self.trusted_proxies = frozenset()
+        self._secret = b''
+
+    def init_app(self, app):
+        self.rules = {rule: parse_rule(app.config[key]) for rule, key in RULES.items()}
+        if self.rules['verify_fail'] is None:
+            raise ValueError("VERIFY_LIMIT_FAILURES cannot be off; it is the no-visit tries budget")
+        self.proxy_hops = app.config.get('PROXY_HOPS', 0)
+        self.trusted_proxies = frozenset(addr.strip() for addr in app.config.get('TRUSTED_PROXIES') or () if addr.strip())
+        secret = app.config.get('SECRET_KEY') or ''
+        self._secret = secret.encode() if isinstance(secret, str) else secret
+        backend = app.config.get('SESSION_BACKEND') or 'filesystem'
+        if backend == 'redis':
+            self.store = RedisLimitStore(app.config['SESSION_REDIS_URL'],
+                                         prefix=f"{app.config.get('SESSION_KEY_PREFIX') or 'sdoh:'}rl:")
+        elif backend == 'memory':
+            self.store = MemoryLimitStore()
+        else:
+            self.store = SqliteLimitStore(app.config['RATE_LIMIT_PATH'])
+
+    def _window(self, rule):
+        limit, window = self.rules[rule]
+        now = time.time()
+        start = int(now // window) * window
+        return limit, window, start, now
+
+    def _hit(self, rule, key, cost):
+        limit, window, start, now = self._window(rule)
+        # Share of the previous fixed window still inside the sliding one
+        weight = 1 - (now - start) / window
+        allowed, count = self.store.hit(f'{rule}:{key}', limit, window, start, weight, cost, rule)
+        return Decision(allowed, count, limit, 0 if allowed else int(start + window - now) + 1)
+
+    def hit(self, rule, key, cost=1):
+        """Count one hit against rule for key, unless that would exceed the limit."""
+        if self.rules.get(rule) is None:
+            return Decision(True, 0, None, 0)
+        return self._hit(rule, key, cost)
+
+    def count(self, rule, key):
+        """Current sliding-window count without recording a hit."""
+        if self.rules.get(rule) is None:
+            return 0
+        return self._hit(rule, key, 0).count
+
+    def allows(self, rule, key, cost=1):
+        """Whether hit(rule, key, cost) would be allowed now, without recording it."""
+        if self.rules.get(rule) is None:
+            return True
+        return self.count(rule, key) + cost <= self.rules[rule][0]
+
+    def reset(self, rule, key):
+        if self.rules.get(rule) is None:
+            return
+        _limit, window, start, _now = self._window(rule)
+        self.store.reset(f'{rule}:{key}', start, window)
+
+    def identity(self, *parts):
+        """Keyed hash of identifying fields, so no PHI is stored with the counters.
+
+        Case, spaces and punctuation are ignored: "O'Brien" and " obrien" are the same patient.
+        """
+        normalized = '|'.join(''.join(ch for ch in str(part or '').casefold() if ch.isalnum()) for part in parts)
+        return hmac.new(self._secret, normalized.encode(), hashlib.sha256).hexdigest()[:32]
+
+    def client_ip(self, request):
+        # Behind PROXY_HOPS trusted proxies the client is that many entries from the end of X-Forwarded-For.
+        # The header is only believed from a trusted peer; anyone else could send their own
+        forwarded = request.headers.get('X-Forwarded-For')
+        if self.proxy_hops and forwarded and request.remote_addr in self.trusted_proxies:
+            hops = [hop.strip() for hop in forwarded.split(',')]
+            return hops[-self.proxy_hops] if len(hops) >= self.proxy_hops else hops[0]
+        return request.remote_addr
+
+    def stats(self):
+        counters = self.store.counters() if self.store is not None else {}
+        stats = {}
+        for rule, parsed in self.rules.items():
+            limit, window = parsed or (None, None)
+            stats[rule] = {
+                'limit': limit,
+                'window_seconds': window,
+                'allowed': counters.get(f'{rule}:allowed', 0),
+                'rejected': counters.get(f'{rule}:rejected', 0),
+            }
+        return stats
+
+
+limiter = RateLimiter()
@@ -0,0 +1,221 @@
+# rescore.py
+# Bulk re-scoring of historical submissions with the same rule table as the
+# online path (utils/sdoh_rules.json), vectorised with NumPy.
+#
+#   python -m utils.rescore export.jsonl -o rescored.jsonl [--rules path] [--chunk-size 50000] [--verify]
+#   python -m utils.rescore export.csv -o rescored.csv
+#
+# Input rows are raw /api/submit bodies (JSONL) or a CSV export with one column
+# per request field; multi-select answers in CSV are newline separated, as they
+# are in the Formstack payload. Rows are processed in chunks so memory stays
+# bounded by --chunk-size regardless of file size.
+import argparse
+import csv
+import itertools
+import json
+import sys
+
+from utils.scoring import ScoringEngine
+
+NONPARTICIPANT = "I choose not to answer"
+OPT_OUT = "I choose not to participate"
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        sys.exit("utils.rescore needs numpy: pip install numpy")
+    return numpy
+
+
+class VectorScorer:
+    """Vectorised form of a ScoringEngine.
+
+    Every scalar field is encoded as a categorical int array whose codes only
+    distinguish answers the rules care about (code 0 = anything else), so each
+    condition and points table becomes a small lookup array indexed by codes.
+    Multi-select fields become a boolean matrix over their known options.
+    """
+
+    def __init__(self, engine):
+        np = self.np = _numpy()
+        self.engine = engine
+        multi_fields = {field for field, checks in engine.triggers.items() if any(m for _, _, m in checks)}
+        self.multi_fields = multi_fields
+
+        # Per-field vocabulary: every answer that appears in any rule for the field
+        vocab = {}
+        for field, checks in engine.triggers.items():
+            for _index, accepted, _multi in checks:
+                vocab.setdefault(field, set()).update(accepted)
+        for field, entries in engine.scorers.items():
+            for _name, points, _default in entries:
+                vocab.setdefault(field, set()).update(points)
+        self.codes = {field: {value: code for code, value in enumerate(sorted(values), start=1)}
+                      for field, values in vocab.items()}
+
+        # Condition lookup tables: field -> [(domain index, bool lut)]
+        self.luts = {}
+        for field, checks in engine.triggers.items():
+            codes = self.codes[field]
+            for index, accepted, _multi in checks:
+                lut = np.zeros(len(codes) + 1, dtype=bool)
+                for value in accepted:
+                    lut[codes[value]] = True
+                self.luts.setdefault(field, []).append((index, lut))
+
+        # Points lookup tables: field -> [(score name, int lut, default)]
+        self.point_luts = {}
+        for field, entries in engine.scorers.items():
+            codes = self.codes[field]
+            for name, points, default in entries:
+                lut = np.full(len(codes) + 1, default, dtype=np.int64)
+                for value, score in points.items():
+                    lut[codes[value]] = score
+                self.point_luts.setdefault(field, []).append((name, lut, default))
+
+    def _encode(self, field, column):
+        # Rule answers are all strings, so anything else (None, numbers, lists) is code 0
+        get = self.codes[field].get
+        return self.np.array([get(value, 0) if type(value) is str else 0 for value in column], dtype=self.np.int32)
+
+    def _encode_multi(self, field, column):
+        codes = self.codes[field]
+        matrix = self.np.zeros((len(column), len(codes) + 1), dtype=bool)
+        for row, value in enumerate(column):
+            options = value if isinstance(value, (list, tuple)) else (value,)
+            for option in options:
+                try:
+                    matrix[row, codes.get(option, 0)] = True
+                except TypeError:
+                    pass
+        return matrix
+
+    def score(self, answers_by_field, size):
+        """Score a chunk given field -> list of answers. Returns (flags[size, domains], {score: totals[size]})."""
+        np = self.np
+        engine = self.engine
+        flags = np.zeros((size, len(engine.domain_names)), dtype=bool)
+        totals = {name: np.full(size, base, dtype=np.int64) for name, base in engine.score_base.items()}
+        missing = [None] * size
+
+        for field in engine.fields:
+            column = answers_by_field.get(field, missing)
+            if field in self.multi_fields:
+                matrix = self._encode_multi(field, column)
+                for index, lut in self.luts.get(field, ()):
+                    flags[:, index] |= matrix[:, lut].any(axis=1)
+                continue
+            codes = self._encode(field, column)
+            for index, lut in self.luts.get(field, ()):
+                flags[:, index] |= lut[codes]
+            for name, lut, default in self.point_luts.get(field, ()):
+                totals[name] += lut[codes] - default
+
+        for index, name, above in engine.thresholds:
+            flags[:, index] |= totals[name] > above
+        return flags, totals
+
+
+def answers_for(engine, request):
+    # Same answer set fscommit.submit scores for a request body
+    if request.get('participation') == OPT_OUT:
+        return {field: NONPARTICIPANT for field in engine.fields}
+    answers = {field: request.get(field) for field in engine.fields}
+    answers['housingCondition'] = request.get('housingCondition', [])
+    return answers
+
+
+def rescore_records(records, engine=None, scorer=None):
+    """Score a list of raw request bodies; returns (flags, totals) as NumPy arrays."""
+    engine = engine or ScoringEngine.from_file()
+    scorer = scorer or VectorScorer(engine)
+    # Column-wise equivalent of answers_for() over the whole chunk
+    opted_out = [record.get('participation') == OPT_OUT for record in records]
+    columns = {
+        field: [NONPARTICIPANT if out else record.get(field) for record, out in zip(records, opted_out)]
+        for field in engine.fields
+    }
+    return scorer.score(columns, len(records))
+
+
+def _read_jsonl(f):
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _read_csv(f, multi_fields):
+    for row in csv.DictReader(f):
+        for field in multi_fields:
+            if field in row:
+                row[field] = [v for v in row[field].split('\n') if v] if row[field] else []
+        yield row
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def rescore_file(src, dst, rules=None, chunk_size=50000, fmt=None, verify=False, id_field='id'):
+    engine = ScoringEngine.from_file(rules)
+    scorer = VectorScorer(engine)
+    fmt = fmt or ('csv' if src.endswith('.csv') else 'jsonl')
+    out_fmt = 'csv' if dst.endswith('.csv') else 'jsonl'
+    columns = [id_field, *engine.domain_names, *(f'{name}_score' for name in engine.score_names), 'rules_version']
+    rows = 0
+    mismatches = 0
+
+    with open(src, newline='') as fin, open(dst, 'w', newline='') as fout:
+        reader = _read_csv(fin, scorer.multi_fields) if fmt == 'csv' else _read_jsonl(fin)
+        writer = csv.writer(fout) if out_fmt == 'csv' else None
+        if writer:
+            writer.writerow(columns)
+
+        for chunk in _chunks(reader, chunk_size):
+            flags, totals = rescore_records(chunk, engine, scorer)
+            labels = scorer.np.where(flags, engine.positive, engine.negative).tolist()
+            score_columns = [totals[name].tolist() for name in engine.score_names]
+            for i, record in enumerate(chunk):
+                domains = labels[i]
+                scores = [column[i] for column in score_columns]
+                if verify:
+                    online = engine.score(answers_for(engine, record))
+                    if list(online.domains.values()) != domains or [online.scores[n] for n in engine.score_names] != scores:
+                        mismatches += 1
+                row = [record.get(id_field, rows + i), *domains, *scores, engine.version]
+                if writer:
+                    writer.writerow(row)
+                else:
+                    fout.write(json.dumps(dict(zip(columns, row))) + '\n')
+            rows += len(chunk)
+    return rows, mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-score historical SDOH submissions")
+    parser.add_argument('input', help='JSONL or CSV export of raw answers')
+    parser.add_argument('-o', '--output', required=True, help='JSONL or CSV output path')
+    parser.add_argument('--rules', default=None, help='rule table (default utils/sdoh_rules.json)')
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--format', choices=('jsonl', 'csv'), default=None, help='input format (default: by extension)')
+    parser.add_argument('--id-field', default='id')
+    parser.add_argument('--verify', action='store_true', help='also score every row on the online path and compare')
+    args = parser.parse_args(argv)
+
+    rows, mismatches = rescore_file(args.input, args.output, args.rules, args.chunk_size,
+                                    args.format, args.verify, args.id_field)
+    print(f"Re-scored {rows} submissions into {args.output}")
+    if args.verify:
+        print(f"Online path mismatches: {mismatches}")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+# resilience.py
+# Circuit breaker and bulkhead for upstream calls. Both are shared by every
+# worker: breaker state lives in the shared cache and bulkhead slots are
+# flock'd lock files, so a slow upstream cannot tie up every worker at once.
+import fcntl
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class UpstreamUnavailable(Exception):
+    """The call was refused locally without contacting the upstream."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class BulkheadFullError(UpstreamUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker whose state is shared through the cache.
+
+    Each worker re-reads the shared state at most every sync_interval seconds
+    and only writes it on failures and state changes, so the healthy path
+    costs no cache I/O beyond that periodic refresh.
+    """
+
+    def __init__(self, name, store, failure_threshold=5, recovery_timeout=30, sync_interval=1.0):
+        self.name = name
+        self.store = store
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.sync_interval = sync_interval
+        self._key = f'breaker:{name}'
+        self._lock = threading.Lock()
+        self._snapshot = {'state': CLOSED, 'failures': 0, 'opened_at': 0, 'trips': 0}
+        self._synced_at = 0
+        self._trial_in_flight = False
+        self._rejected = 0
+
+    def _read(self, force=False):
+        now = time.monotonic()
+        if force or now - self._synced_at >= self.sync_interval:
+            try:
+                shared = self.store.get(self._key)
+            except Exception:
+                logger.exception("Could not read %s breaker state", self.name)
+                shared = None
+            if shared:
+                self._snapshot = shared
+            self._synced_at = now
+        return self._snapshot
+
+    def _write(self, snapshot):
+        self._snapshot = snapshot
+        self._synced_at = time.monotonic()
+        try:
+            self.store.set(self._key, snapshot, timeout=24 * 3600)
+        except Exception:
+            logger.exception("Could not write %s breaker state", self.name)
+
+    def allow(self):
+        with self._lock:
+            snapshot = self._read()
+            if snapshot['state'] == CLOSED:
+                return
+            if snapshot['state'] == OPEN:
+                remaining = snapshot['opened_at'] + self.recovery_timeout - time.time()
+                if remaining > 0:
+                    self._rejected += 1
+                    raise CircuitOpenError(f"{self.name} circuit is open", retry_after=int(remaining) + 1)
+                self._write(dict(snapshot, state=HALF_OPEN))
+                logger.warning("%s circuit half-open, sending a trial request", self.name)
+            # Half-open: one trial call per worker at a time, everything else fails fast
+            if self._trial_in_flight:
+                self._rejected += 1
+                raise CircuitOpenError(f"{self.name} circuit is half-open", retry_after=1)
+            self._trial_in_flight = True
+
+    def abandon(self):
+        """The allowed call never reached the upstream (no bulkhead slot): free the half-open trial, record nothing."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._trial_in_flight = False
+            snapshot = self._snapshot
+            if snapshot['state'] != CLOSED or snapshot['failures']:
+                if snapshot['state'] != CLOSED:
+                    logger.warning("%s circuit closed", self.name)
+                self._write(dict(snapshot, state=CLOSED, failures=0))
+
+    def record_failure(self):
+        with self._lock:
+            self._trial_in_flight = False
+            snapshot = self._read(force=True)
+            failures = snapshot['failures'] + 1
+            if snapshot['state'] == HALF_OPEN or failures >= self.failure_threshold:
+                logger.error("%s circuit opened after %d consecutive failures", self.name, failures)
+                self._write(dict(snapshot, state=OPEN, failures=failures, opened_at=time.time(),
+                                 trips=snapshot['trips'] + 1))
+            else:
+                self._write(dict(snapshot, failures=failures))
+
+    def stats(self):
+        with self._lock:
+            snapshot = self._read()
+            return {
+                'state': snapshot['state'],
+                'consecutive_failures': snapshot['failures'],
+                'trips': snapshot['trips'],
+                'rejected': self._rejected,
+            }
+
+
+class Bulkhead:
+    """Caps how many workers on this host may be inside one upstream at once.
+
+    Each slot is a lock file; holding an exclusive flock on it is holding the
+    slot. The kernel releases the lock if the worker dies mid-call.
+    """
+
+    def __init__(self, name, limit, lock_dir, max_wait=0.0):
+        self.name = name
+        self.limit = limit
+        self.lock_dir = lock_dir
+        self.max_wait = max_wait
+        self._slots = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._rejected = 0
+        self._in_use = 0
+
+    def _open_slots(self):
+        pid = os.getpid()
+        if self._slots is None or self._pid != pid:
+            os.makedirs(self.lock_dir, exist_ok=True)
+            self._slots = [
+                (threading.Lock(), open(os.path.join(self.lock_dir, f'{self.name}.{i}.lock'), 'a'))
+                for i in range(self.limit)
+            ]
+            self._pid = pid
+        return self._slots
+
+    def _try_acquire(self):
+        with self._lock:
+            slots = self._open_slots()
+        # Start at a random slot, so workers do not all try the same lock files first
+        start = random.randrange(len(slots))
+        for local_lock, lock_file in slots[start:] + slots[:start]:
+            if not local_lock.acquire(blocking=False):
+                continue
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                local_lock.release()
+                continue
+            return local_lock, lock_file
+        return None
+
+    def acquire(self):
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            slot = self._try_acquire()
+            if slot is not None:
+                with self._lock:
+                    self._in_use += 1
+                return slot
+            if time.monotonic() >= deadline:
+                with self._lock:
+                    self._rejected += 1
+                raise BulkheadFullError(f"{self.name} is at its concurrency limit", retry_after=1)
+            time.sleep(0.05)
+
+    def release(self, slot):
+        local_lock, lock_file = slot
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        local_lock.release()
+        with self._lock:
+            self._in_use -= 1
+
+    def stats(self):
+        with self._lock:
+            return {'limit': self.limit, 'in_use': self._in_use, 'rejected': self._rejected}
@@ -0,0 +1,177 @@
+# schemas.py
+# Request body validation. Each endpoint declares its body as a JSON Schema
+# (the subset below) next to its route; compile_schema() turns it once, at
+# import, into nested closures with the types, enum sets and limits already
+# resolved, so checking a request is a single pass over its fields. The
+# validate_json decorator runs before the route and its other decorators, so
+# a malformed body is rejected before the session store, the rate limiter or
+# an upstream is touched. Bodies larger than MAX_CONTENT_LENGTH never get
+# this far: Flask answers 413 while reading them.
+#
+# Supported keywords: type, enum, properties, required, additionalProperties
+# (true/false), maxProperties, minLength, maxLength, pattern, items,
+# maxItems, uniqueItems (and description, ignored). Error messages name the field and the rule, never
+# the value, since values are PHI.
+import re
+from functools import wraps
+
+from flask import jsonify, request
+
+TYPES = {
+    'object': (dict,),
+    'array': (list,),
+    'string': (str,),
+    'boolean': (bool,),
+    'integer': (int,),
+    'number': (int, float),
+    'null': (type(None),),
+}
+KEYWORDS = frozenset((
+    'type', 'enum', 'properties', 'required', 'additionalProperties', 'maxProperties',
+    'minLength', 'maxLength', 'pattern', 'items', 'maxItems', 'uniqueItems', 'description',
+))
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def _type_check(spec):
+    names = spec if isinstance(spec, list) else [spec]
+    try:
+        accepted = tuple(t for name in names for t in TYPES[name])
+    except KeyError as e:
+        raise SchemaError(f"Unsupported type {e.args[0]!r}") from None
+    label = ' or '.join(names)
+    # bool is an int subclass; true is not a number here
+    allow_bool = 'boolean' in names
+
+    def check(value, path, errors):
+        if not isinstance(value, accepted) or (isinstance(value, bool) and not allow_bool):
+            errors.append(f"{path}: must be {label}")
+            return False
+        return True
+    return check
+
+
+def _child(path, name):
+    return name if path == '$' else f'{path}.{name}'
+
+
+def _compile(schema, path):
+    unknown = set(schema) - KEYWORDS
+    if unknown:
+        # Fail at startup rather than silently skip a rule
+        raise SchemaError(f"Unsupported schema keyword(s) at {path}: {', '.join(sorted(unknown))}")
+    checks = []
+    type_check = _type_check(schema['type']) if 'type' in schema else None
+
+    if 'enum' in schema:
+        allowed = frozenset(schema['enum'])
+
+        def check_enum(value, path, errors):
+            try:
+                accepted = value in allowed
+            except TypeError:  # unhashable, so not one of the values
+                accepted = False
+            if not accepted:
+                errors.append(f"{path}: not an accepted value")
+        checks.append(check_enum)
+
+    min_length = schema.get('minLength')
+    max_length = schema.get('maxLength')
+    pattern = re.compile(schema['pattern']).fullmatch if 'pattern' in schema else None
+    if min_length is not None or max_length is not None or pattern is not None:
+        def check_string(value, path, errors):
+            if not isinstance(value, str):
+                return
+            if min_length is not None and len(value) < min_length:
+                errors.append(f"{path}: shorter than {min_length}")
+            elif max_length is not None and len(value) > max_length:
+                errors.append(f"{path}: longer than {max_length}")
+            elif pattern is not None and pattern(value) is None:
+                errors.append(f"{path}: wrong format")
+        checks.append(check_string)
+
+    if 'items' in schema or 'maxItems' in schema or schema.get('uniqueItems'):
+        item_check = _compile(schema['items'], f'{path}[]') if 'items' in schema else None
+        max_items = schema.get('maxItems')
+        unique = schema.get('uniqueItems', False)
+
+        def check_array(value, path, errors):
+            if not isinstance(value, list):
+                return
+            if max_items is not None and len(value) > max_items:
+                errors.append(f"{path}: more than {max_items} items")
+                return
+            if item_check is not None:
+                for item in value:
+                    item_check(item, f'{path}[]', errors)
+            if unique:
+                try:
+                    if len(set(value)) != len(value):
+                        errors.append(f"{path}: duplicate items")
+                except TypeError:
+                    pass  # unhashable items were already reported by item_check
+        checks.append(check_array)
+
+    if 'properties' in schema or 'required' in schema or 'maxProperties' in schema:
+        properties = {name: (_compile(sub, _child(path, name)), _child(path, name))
+                      for name, sub in schema.get('properties', {}).items()}
+        required = tuple((name, _child(path, name)) for name in schema.get('required', ()))
+        closed = schema.get('additionalProperties', True) is False
+        max_properties = schema.get('maxProperties')
+
+        def check_object(value, path, errors):
+            if not isinstance(value, dict):
+                return
+            if max_properties is not None and len(value) > max_properties:
+                errors.append(f"{path}: more than {max_properties} fields")
+                return
+            for name, name_path in required:
+                if name not in value:
+                    errors.append(f"{name_path}: required")
+            for name, item in value.items():
+                entry = properties.get(name)
+                if entry is not None:
+                    entry[0](item, entry[1], errors)
+                elif closed:
+                    errors.append(f"{path}: unexpected field {name!r}")
+        checks.append(check_object)
+
+    checks = tuple(checks)
+
+    def check(value, path, errors):
+        if type_check is not None and not type_check(value, path, errors):
+            return
+        for sub_check in checks:
+            sub_check(value, path, errors)
+    return check
+
+
+def compile_schema(schema):
+    """Compile schema into validator(value) -> list of error messages (empty when valid)."""
+    check = _compile(schema, '$')
+
+    def validator(value):
+        errors = []
+        check(value, '$', errors)
+        return errors
+    return validator
+
+
+def validate_json(validator):
+    """Reject JSON POST bodies that validator finds errors in with a 400, before the route runs.
+
+    Other methods and content types pass through, for the route's own 405/415 answers.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method == 'POST' and request.content_type == 'application/json':
+                errors = validator(request.get_json(silent=True))
+                if errors:
+                    return jsonify({"error": "Invalid request body", "details": errors}), 400
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
@@ -0,0 +1,141 @@
+# scoring.py
+# SDOH domain scoring driven by a versioned rule table (sdoh_rules.json).
+# The table is loaded and compiled once; scoring a response is a single pass
+# over its answers with set lookups, no per-request rule construction.
+import json
+import os
+
+RULES_PATH = os.path.join(os.path.dirname(__file__), 'sdoh_rules.json')
+
+
+class ScoringRulesError(ValueError):
+    pass
+
+
+class ScoreResult:
+    __slots__ = ('domains', 'scores', 'version')
+
+    def __init__(self, domains, scores, version):
+        self.domains = domains  # domain name -> "POSITIVE" / "negative"
+        self.scores = scores    # score name -> int
+        self.version = version
+
+
+class ScoringEngine:
+    """Compiled form of a rule table.
+
+    A domain is positive when any of its conditions hold. A condition is
+    either a field whose answer falls in an accepted set (for multi-select
+    fields: any selected option does) or a score above a threshold. Scores
+    sum per-answer points over a fixed list of fields. The optional choices
+    table lists each answer field's options on the form.
+    """
+
+    def __init__(self, rules):
+        try:
+            self.version = rules['version']
+            self.positive = rules.get('positive', 'POSITIVE')
+            self.negative = rules.get('negative', 'negative')
+            self._compile(rules)
+        except (KeyError, TypeError) as e:
+            raise ScoringRulesError(f"Malformed scoring rules: {e!r}") from e
+
+    @classmethod
+    def from_file(cls, path=None):
+        with open(path or RULES_PATH) as f:
+            return cls(json.load(f))
+
+    def _compile(self, rules):
+        self.score_names = tuple(rules.get('scores', {}))
+        # field -> tuple of (score name, points, default)
+        scorers = {}
+        # Baseline assumes every score field is unanswered; answers adjust from there
+        self.score_base = {}
+        for name, spec in rules.get('scores', {}).items():
+            default = spec.get('default', 0)
+            self.score_base[name] = default * len(spec['fields'])
+            for field in spec['fields']:
+                scorers.setdefault(field, []).append((name, dict(spec['points']), default))
+
+        self.domain_names = tuple(domain['name'] for domain in rules['domains'])
+        if len(set(self.domain_names)) != len(self.domain_names):
+            raise ScoringRulesError("Duplicate domain names in scoring rules")
+
+        # field -> tuple of (domain index, accepted answers, multi-select)
+        triggers = {}
+        # tuple of (domain index, score name, threshold)
+        thresholds = []
+        for index, domain in enumerate(rules['domains']):
+            for condition in domain['any']:
+                if 'score' in condition:
+                    if condition['score'] not in self.score_base:
+                        raise ScoringRulesError(f"Domain {domain['name']} uses unknown score {condition['score']}")
+                    thresholds.append((index, condition['score'], condition['above']))
+                else:
+                    triggers.setdefault(condition['field'], []).append(
+                        (index, frozenset(condition['in']), bool(condition.get('multi')))
+                    )
+
+        # field -> the form's answer options; /api/submit rejects anything else
+        self.choices = {field: tuple(options) for field, options in rules.get('choices', {}).items()}
+        for field, entries in triggers.items():
+            for _index, accepted, _multi in entries:
+                self._check_choices(field, accepted)
+        for field, entries in scorers.items():
+            for _name, points, _default in entries:
+                self._check_choices(field, points)
+
+        self.scorers = {field: tuple(entries) for field, entries in scorers.items()}
+        self.triggers = {field: tuple(entries) for field, entries in triggers.items()}
+        self.thresholds = tuple(thresholds)
+        self.fields = frozenset(self.scorers) | frozenset(self.triggers)
+
+    def _check_choices(self, field, answers):
+        # A rule on an answer the form cannot send would never fire
+        if field in self.choices:
+            unknown = set(answers) - set(self.choices[field])
+            if unknown:
+                raise ScoringRulesError(f"Rules for {field} use answers the form does not offer: {sorted(unknown)}")
+
+    def score(self, answers):
+        """Score a mapping of request field name -> answer in one pass over the answers."""
+        flags = [False] * len(self.domain_names)
+        totals = dict(self.score_base)
+        triggers = self.triggers
+        scorers = self.scorers
+
+        for field, value in answers.items():
+            checks = triggers.get(field)
+            if checks is not None:
+                for index, accepted, multi in checks:
+                    if not flags[index] and _matches(value, accepted, multi):
+                        flags[index] = True
+            entries = scorers.get(field)
+            if entries is not None:
+                for name, points, default in entries:
+                    try:
+                        totals[name] += points.get(value, default) - default
+                    except TypeError:
+                        # Unhashable answer (e.g. a list) scores as unanswered
+                        pass
+
+        for index, name, above in self.thresholds:
+            if totals[name] > above:
+                flags[index] = True
+
+        positive, negative = self.positive, self.negative
+        domains = {name: positive if flag else negative for name, flag in zip(self.domain_names, flags)}
+        return ScoreResult(domains, totals, self.version)
+
+
+def _matches(value, accepted, multi):
+    if multi and isinstance(value, (list, tuple)):
+        return any(option in accepted for option in value if isinstance(option, str))
+    try:
+        return value in accepted
+    except TypeError:
+        return False
+
+
+def load_scoring_engine(path=None):
+    return ScoringEngine.from_file(path)
@@ -0,0 +1,156 @@
+# session_backends.py
+# Storage backends for SessionStore. Each backend persists one record per
+# session and applies all of a request's changes in a single commit() call.
+# The filesystem one also keeps a version stamp per session for the
+# per-worker near cache in front of it (utils/nearcache.py).
+import threading
+import time
+
+from utils import jsoncodec
+from utils.nearcache import NearCacheBackend, StampTable
+
+
+class CacheSessionBackend:
+    """Stores whole session records through flask_caching (filesystem by default).
+
+    Version stamps live in a StampTable shared by the workers on this host.
+    """
+
+    def __init__(self, cache, timeout, stamps=None, sweeper=None):
+        self.cache = cache
+        self.timeout = timeout
+        self.stamps = stamps
+        self.sweeper = sweeper
+
+    def load(self, session_id):
+        return self.cache.get(session_id)
+
+    def commit(self, writes, deletes):
+        # writes: {session_id: (record, changed_fields, dropped_fields, replace)}
+        if self.stamps is not None:
+            self.commit_stamped(writes, deletes)
+            return
+        self._commit(writes, deletes)
+
+    def _commit(self, writes, deletes):
+        for session_id, (record, _changed, _dropped, _replace) in writes.items():
+            self.cache.set(session_id, record, timeout=self.timeout)
+        if deletes:
+            self.cache.delete_many(*deletes)
+
+    def stamp(self, session_id):
+        return self.stamps.read(session_id)
+
+    def commit_stamped(self, writes, deletes):
+        """Commit and restamp; returns {session_id: (stamp, stored record)} for the writes."""
+        stamps = self.stamps.commit((*writes, *deletes), lambda: self._commit(writes, deletes))
+        return {session_id: (stamps[session_id], write[0]) for session_id, write in writes.items()}
+
+    def evictions(self):
+        # Expired files removed by the sweeper; only the worker holding its lock sweeps
+        return self.sweeper.stats()['files_removed'] if self.sweeper is not None else None
+
+
+class RedisSessionBackend:
+    """Stores each session as a Redis hash so field updates are applied server side.
+
+    All writes for a request go out in one MULTI/EXEC pipeline: changed fields
+    are HSET, dropped fields HDEL'd and the TTL refreshed, so two workers
+    updating different fields of the same session never clobber each other.
+    """
+
+    def __init__(self, url, timeout, prefix='sdoh:session:', client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.timeout = timeout
+        self.prefix = prefix
+
+    def _key(self, session_id):
+        return f'{self.prefix}{session_id}'
+
+    def load(self, session_id):
+        raw = self.client.hgetall(self._key(session_id))
+        if not raw:
+            return None
+        return {_decode(k): jsoncodec.loads(v) for k, v in raw.items()}
+
+    def commit(self, writes, deletes):
+        pipe = self.client.pipeline(transaction=True)
+        for session_id, (record, changed, dropped, replace) in writes.items():
+            key = self._key(session_id)
+            if replace:
+                pipe.delete(key)
+                changed = record.keys()
+            if changed:
+                pipe.hset(key, mapping={field: jsoncodec.dumps(record[field]) for field in changed})
+            if dropped:
+                pipe.hdel(key, *dropped)
+            pipe.expire(key, self.timeout)
+        for session_id in deletes:
+            pipe.delete(self._key(session_id))
+        pipe.execute()
+
+    def evictions(self):
+        # Server-wide: keys evicted under memory pressure plus keys that expired
+        try:
+            stats = self.client.info('stats')
+        except Exception:  # INFO may be disabled by ACLs on managed Redis
+            return None
+        return stats.get('evicted_keys', 0) + stats.get('expired_keys', 0)
+
+
+class MemorySessionBackend:
+    """In-process stand-in for local runs; sessions do not survive a restart or span workers."""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        with self._lock:
+            entry = self._records.get(session_id)
+            if entry is None:
+                return None
+            expires, record = entry
+            if expires < time.time():
+                del self._records[session_id]
+                return None
+            return dict(record)
+
+    def commit(self, writes, deletes):
+        expires = time.time() + self.timeout
+        with self._lock:
+            for session_id, (record, _changed, _dropped, _replace) in writes.items():
+                self._records[session_id] = (expires, dict(record))
+            for session_id in deletes:
+                self._records.pop(session_id, None)
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def make_session_backend(app, cache, timeout, sweeper=None):
+    backend = app.config.get('SESSION_BACKEND') or 'filesystem'
+    if app.config.get('SERVER_MODE') == 'gevent' and backend != 'redis':
+        # The other backends' stamp table, file cache, SQLite limits and revocations block the gevent hub
+        raise ValueError(f"SERVER_MODE=gevent needs SESSION_BACKEND=redis, not {backend}")
+    if backend == 'redis':
+        shared = RedisSessionBackend(
+            app.config.get('SESSION_REDIS_URL'),
+            timeout,
+            prefix=app.config.get('SESSION_KEY_PREFIX') or 'sdoh:session:'
+        )
+    elif backend == 'memory':
+        shared = MemorySessionBackend(timeout)
+    elif backend == 'filesystem':
+        shared = CacheSessionBackend(cache, timeout, stamps=StampTable(app.config['SESSION_STAMP_PATH']),
+                                     sweeper=sweeper)
+    else:
+        raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
+    # Only the filesystem backend has stamps; the others pass through and are counted
+    return NearCacheBackend(shared, max_entries=app.config.get('NEAR_CACHE_SIZE', 1024),
+                            ttl=app.config.get('NEAR_CACHE_TTL', 30))
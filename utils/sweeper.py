@@ -0,0 +1,197 @@
+# sweeper.py
+# Background expiry for the filesystem session cache. flask_caching only prunes
+# when it crosses its file threshold, and it does so with a full directory scan
+# on whichever request thread tripped it. We run with the threshold disabled
+# and let this sweeper remove expired files off the request path instead.
+import fcntl
+import logging
+import os
+import pickle
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Temp files flask_caching/cachelib writes before renaming into place
+TRANSACTION_SUFFIX = '.__wz_cache'
+LOCK_NAME = '.sweeper.lock'
+
+
+def read_expiry(path):
+    """Return the expiry timestamp stored in a cache file header (0 = never)."""
+    with open(path, 'rb') as f:
+        head = f.read(16)
+    # flask_caching 1.x pickles the timestamp, cachelib writes a packed uint32
+    if head[:1] == b'\x80' and head[1:2] in (b'\x02', b'\x03', b'\x04', b'\x05'):
+        try:
+            return pickle.loads(head + b'.')
+        except Exception:
+            pass
+    return struct.unpack('I', head[:4])[0]
+
+
+class CacheSweeper:
+    """Removes expired cache files incrementally using an expiry-bucket index.
+
+    The first pass reads each file's header once and files it under the bucket
+    its expiry falls into; later passes only re-check buckets that have come
+    due plus files that appeared since the last pass. Work is done in small
+    batches with a pause in between so the sweeper never hogs the disk.
+    Only one process per cache directory sweeps at a time (flock on a lock file).
+    """
+
+    def __init__(self, cache_dir, interval=60, batch_size=200, bucket_seconds=60, pause=0.01):
+        self.cache_dir = cache_dir
+        self.interval = interval
+        self.batch_size = batch_size
+        self.bucket_seconds = bucket_seconds
+        self.pause = pause
+        self._buckets = {}   # bucket -> set of file names
+        self._indexed = {}   # file name -> bucket
+        self._lock_file = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'passes': 0,
+            'files_removed': 0,
+            'bytes_removed': 0,
+            'sweep_seconds': 0.0,
+            'last_files_removed': 0,
+            'last_bytes_removed': 0,
+            'last_sweep_seconds': 0.0,
+            'indexed_files': 0,
+        }
+
+    # -- lifecycle -------------------------------------------------------------
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='cache-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _acquire(self):
+        if self._lock_file is not None:
+            return True
+        try:
+            lock_file = open(os.path.join(self.cache_dir, LOCK_NAME), 'a')
+        except OSError:
+            return False
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            # Another worker holds the lock; try again next interval in case it exits
+            if not self._acquire():
+                continue
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Cache sweep failed")
+
+    # -- sweeping -------------------------------------------------------------
+
+    def _bucket(self, expires):
+        return int(expires // self.bucket_seconds)
+
+    def _index(self, name, expires):
+        if expires == 0:
+            # Never expires (e.g. cachelib's file counter); remember it so it is not re-read
+            self._indexed[name] = None
+            return
+        bucket = self._bucket(expires)
+        self._buckets.setdefault(bucket, set()).add(name)
+        self._indexed[name] = bucket
+
+    def _unindex(self, name):
+        bucket = self._indexed.pop(name, None)
+        if bucket is not None:
+            names = self._buckets.get(bucket)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self._buckets[bucket]
+
+    def _check(self, name, now):
+        """Remove the file if expired, otherwise (re)index it. Returns bytes freed or None."""
+        path = os.path.join(self.cache_dir, name)
+        self._unindex(name)
+        try:
+            size = os.stat(path).st_size
+            expires = read_expiry(path)
+        except (OSError, struct.error):
+            return None
+        if expires != 0 and expires < now:
+            try:
+                os.remove(path)
+            except OSError:
+                return None
+            return size
+        self._index(name, expires)
+        return None
+
+    def _batched(self, names):
+        for i, name in enumerate(names):
+            if i and i % self.batch_size == 0:
+                if self._stop.wait(self.pause):
+                    return
+            yield name
+
+    def sweep(self):
+        started = time.perf_counter()
+        now = time.time()
+        files = 0
+        freed = 0
+
+        # Buckets whose expiry window has passed
+        due = [b for b in self._buckets if b <= self._bucket(now)]
+        due_names = [name for b in due for name in self._buckets.get(b, ())]
+
+        # Files written since the last pass
+        try:
+            with os.scandir(self.cache_dir) as entries:
+                new_names = [
+                    e.name for e in entries
+                    if e.name not in self._indexed
+                    and not e.name.startswith('.')
+                    and not e.name.endswith(TRANSACTION_SUFFIX)
+                    and e.is_file()
+                ]
+        except OSError:
+            new_names = []
+
+        for name in self._batched(due_names + new_names):
+            size = self._check(name, now)
+            if size is not None:
+                files += 1
+                freed += size
+
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self._stats['passes'] += 1
+            self._stats['files_removed'] += files
+            self._stats['bytes_removed'] += freed
+            self._stats['sweep_seconds'] += elapsed
+            self._stats['last_files_removed'] = files
+            self._stats['last_bytes_removed'] = freed
+            self._stats['last_sweep_seconds'] = elapsed
+            self._stats['indexed_files'] = len(self._indexed)
+        if files:
+            logger.info("Cache sweep removed %d files (%d bytes) in %.3fs", files, freed, elapsed)
+        return files, freed, elapsed
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
@@ -0,0 +1,115 @@
+# tls.py
+# TLS for the built-in server (app.run in sdohapi.py) and for gunicorn when it
+# terminates TLS itself (GUNICORN_TLS=1, see gunicorn_config.py). TLS 1.2 and
+# 1.3 with forward-secret AEAD ciphers, ALPN http/1.1, and session resumption:
+# a kiosk or tablet that reconnects presents a session ticket and skips the
+# certificate exchange and signature of a full handshake.
+#
+# OpenSSL ties ticket keys to the SSLContext a connection starts on, and the
+# ssl module cannot set them, so keys are rotated by rotating the context:
+# every TLS_TICKET_ROTATION seconds new connections are handed to a freshly
+# built one, and tickets issued under the previous keys fall back to a full
+# handshake. Keys live in process memory and are copied by fork. Under
+# gunicorn the master builds the context before forking, so all workers hold
+# the same keys and a client can resume on any of them; workers pin() the
+# copy instead of rotating on their own, which would give each different
+# keys, and are replaced once it is due (see gunicorn_config.py).
+import socket
+import ssl
+import threading
+import time
+
+CIPHERS = 'ECDHE+AESGCM:ECDHE+CHACHA20'
+ALPN_PROTOCOLS = ['http/1.1']
+
+
+def configure(context, cert_file, key_file, minimum_version='TLSv1_2', tickets=2):
+    """Apply the server settings to context and load the certificate chain."""
+    context.minimum_version = ssl.TLSVersion[minimum_version]
+    context.maximum_version = ssl.TLSVersion.MAXIMUM_SUPPORTED
+    # TLS 1.2 only; TLS 1.3 suites are all AEAD with forward secrecy already
+    context.set_ciphers(CIPHERS)
+    context.options |= ssl.OP_NO_COMPRESSION | ssl.OP_CIPHER_SERVER_PREFERENCE | ssl.OP_NO_RENEGOTIATION
+    # Tickets sent after a TLS 1.3 handshake; TLS 1.2 gets one when OP_NO_TICKET is unset
+    context.num_tickets = tickets
+    context.set_alpn_protocols(ALPN_PROTOCOLS)
+    context.load_cert_chain(cert_file, key_file)
+    return context
+
+
+def _listening(sock):
+    try:
+        return bool(sock.getsockopt(socket.SOL_SOCKET, socket.SO_ACCEPTCONN))
+    except (AttributeError, OSError):
+        return False
+
+
+class ServerContext(ssl.SSLContext):
+    """Server SSLContext whose connections are handed to a context rebuilt every `rotation` seconds.
+
+    Wrapping the listening socket (werkzeug) keeps this object as the socket's
+    context, so accept() calls back into wrap_socket for each connection;
+    servers that wrap each accepted socket themselves (gunicorn) land there directly.
+    """
+
+    def __new__(cls, cert_file, key_file, rotation=3600, **options):
+        return super().__new__(cls, ssl.PROTOCOL_TLS_SERVER)
+
+    def __init__(self, cert_file, key_file, rotation=3600, **options):
+        self.cert_file = cert_file
+        self.key_file = key_file
+        self.rotation = rotation
+        self.tls_options = options
+        configure(self, cert_file, key_file, **options)
+        self._lock = threading.Lock()
+        self._current = self._build()
+        self._rotated_at = time.monotonic()
+        self.rotations = 0
+        self.pinned = False
+
+    def _build(self):
+        return configure(ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER), self.cert_file, self.key_file, **self.tls_options)
+
+    def expired(self, grace=0):
+        """Whether the current context (its ticket keys) is `rotation` (plus grace) seconds old."""
+        return bool(self.rotation) and time.monotonic() - self._rotated_at >= self.rotation + grace
+
+    def pin(self):
+        """Keep the current context in this process; only its creator rotates it (gunicorn workers)."""
+        self.pinned = True
+
+    def current(self):
+        """The context new connections start on, rebuilt (new ticket keys) once it is `rotation` seconds old."""
+        if not self.pinned and self.expired():
+            with self._lock:
+                if self.expired():
+                    self._current = self._build()
+                    self._rotated_at = time.monotonic()
+                    self.rotations += 1
+        return self._current
+
+    def wrap_socket(self, sock, server_side=False, **kwargs):
+        if not server_side or _listening(sock):
+            return super().wrap_socket(sock, server_side=server_side, **kwargs)
+        return self.current().wrap_socket(sock, server_side=True, **kwargs)
+
+    def stats(self):
+        """OpenSSL session counters of the current context ('hits' are resumed handshakes)."""
+        stats = self._current.session_stats()
+        stats['rotations'] = self.rotations
+        return stats
+
+
+_contexts = {}
+_contexts_lock = threading.Lock()
+
+
+def server_context(cert_file, key_file, rotation=3600, minimum_version='TLSv1_2'):
+    """The process-wide ServerContext for this certificate, created on first use."""
+    key = (cert_file, key_file)
+    with _contexts_lock:
+        context = _contexts.get(key)
+        if context is None:
+            context = _contexts[key] = ServerContext(cert_file, key_file, rotation=rotation,
+                                                     minimum_version=minimum_version)
+        return context
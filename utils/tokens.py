@@ -0,0 +1,212 @@
+# tokens.py
+# Verification and validation tokens for TOKEN_MODE=signed. Tokens are
+# itsdangerous-signed, timestamped payloads bound to the session id (and, for
+# verification, the CSP nonce handed out with it), so checking one is pure CPU:
+# no session cache read. A verification token is used up by its address check,
+# passed or failed, and then goes on a revocation list. Each worker checks an in-memory copy of that list, which a
+# background thread refreshes from a store shared with the other workers every
+# TOKEN_REVOCATION_SYNC seconds; revocations made in this worker apply at once.
+#
+# TOKEN_MODE=cache (the default) keeps the random tokens in the session record,
+# and the route decorators compare the presented token with the stored one.
+import hmac
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS revoked (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    jti TEXT NOT NULL UNIQUE,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class SqliteRevocationStore:
+    """Revoked token ids shared by the workers on one host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        # sqlite connections must not cross threads or forks
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def add(self, jti, expires_at):
+        self._conn().execute('INSERT OR IGNORE INTO revoked (jti, expires_at) VALUES (?, ?)', (jti, expires_at))
+
+    def load(self, cursor):
+        """Entries added after cursor, as ({jti: expires_at}, new cursor)."""
+        rows = self._conn().execute(
+            'SELECT seq, jti, expires_at FROM revoked WHERE seq > ? AND expires_at > ? ORDER BY seq',
+            (cursor or 0, time.time())
+        ).fetchall()
+        return {jti: expires_at for _seq, jti, expires_at in rows}, (rows[-1][0] if rows else cursor)
+
+    def purge(self):
+        self._conn().execute('DELETE FROM revoked WHERE expires_at < ?', (time.time(),))
+
+
+class RedisRevocationStore:
+    """Revoked token ids in a Redis sorted set (score = expiry), shared across hosts."""
+
+    def __init__(self, url, key='sdoh:revoked', client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.key = key
+
+    def add(self, jti, expires_at):
+        self.client.zadd(self.key, {jti: expires_at})
+
+    def load(self, cursor):
+        # The set only holds unexpired ids (purge), so a full read stays small
+        entries = self.client.zrangebyscore(self.key, time.time(), '+inf', withscores=True)
+        return {(jti.decode() if isinstance(jti, bytes) else jti): score for jti, score in entries}, cursor
+
+    def purge(self):
+        self.client.zremrangebyscore(self.key, '-inf', time.time())
+
+
+class TokenService:
+    def __init__(self):
+        self.mode = 'cache'
+        self.max_age = 3600
+        self.sync_interval = 2.0
+        self.store = None
+        self._serializers = {}
+        self._secret = None
+        self._revoked = {}
+        self._cursor = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def init_app(self, app):
+        self.mode = app.config.get('TOKEN_MODE') or 'cache'
+        if self.mode == 'cache':
+            return
+        if self.mode != 'signed':
+            raise ValueError(f"Unknown TOKEN_MODE: {self.mode}")
+        self._secret = app.config.get('TOKEN_SECRET') or app.config.get('SECRET_KEY')
+        if not self._secret:
+            raise ValueError("TOKEN_MODE=signed needs TOKEN_SECRET or SECRET_KEY")
+        self.max_age = app.config.get('TOKEN_MAX_AGE', 3600)
+        self.sync_interval = app.config.get('TOKEN_REVOCATION_SYNC', 2.0)
+        if app.config.get('SESSION_BACKEND') == 'redis':
+            self.store = RedisRevocationStore(app.config['SESSION_REDIS_URL'],
+                                              key=f"{app.config.get('SESSION_KEY_PREFIX') or 'sdoh:'}revoked")
+        elif app.config.get('SESSION_BACKEND') == 'memory':
+            self.store = None
+        else:
+            self.store = SqliteRevocationStore(app.config['TOKEN_REVOCATION_PATH'])
+        self.sync()
+
+    @property
+    def signed(self):
+        return self.mode == 'signed'
+
+    def _serializer(self, kind):
+        serializer = self._serializers.get(kind)
+        if serializer is None:
+            # One salt per kind: a verification token never passes as a validation token
+            serializer = self._serializers[kind] = URLSafeTimedSerializer(self._secret, salt=f'sdoh-{kind}')
+        return serializer
+
+    # -- issuing and checking -----------------------------------------------------
+
+    def issue(self, kind, session_id, **claims):
+        claims.update(sid=session_id, jti=secrets.token_urlsafe(12))
+        return self._serializer(kind).dumps(claims)
+
+    def check(self, kind, token, session_id):
+        """The token's claims if it is genuine, unexpired, unrevoked and bound to session_id; else None."""
+        if not token or not session_id:
+            return None
+        try:
+            claims, issued = self._serializer(kind).loads(token, max_age=self.max_age, return_timestamp=True)
+        except SignatureExpired:
+            return None
+        except BadSignature:
+            logger.warning("Rejected %s token with a bad signature", kind)
+            return None
+        if not isinstance(claims, dict) or not hmac.compare_digest(str(claims.get('sid', '')), session_id):
+            return None
+        if claims.get('jti') in self._revoked:
+            return None
+        claims['exp'] = issued.timestamp() + self.max_age
+        return claims
+
+    def revoke(self, claims):
+        """Revoke a checked token (claims as returned by check()) on every worker."""
+        jti = claims.get('jti')
+        if not jti:
+            return
+        expires_at = claims.get('exp') or time.time() + self.max_age
+        with self._lock:
+            self._revoked[jti] = expires_at
+        if self.store is not None:
+            try:
+                self.store.add(jti, expires_at)
+            except Exception:
+                # Still revoked here; other workers may accept it until it expires
+                logger.exception("Could not share token revocation")
+
+    # -- revocation list sync -------------------------------------------------------
+
+    def sync(self):
+        now = time.time()
+        entries, cursor = ({}, self._cursor) if self.store is None else self.store.load(self._cursor)
+        with self._lock:
+            self._revoked.update(entries)
+            self._cursor = cursor
+            for jti in [jti for jti, expires_at in self._revoked.items() if expires_at < now]:
+                del self._revoked[jti]
+
+    def _run(self):
+        last_purge = 0
+        while not self._stop.wait(self.sync_interval):
+            try:
+                self.sync()
+                if self.store is not None and time.time() - last_purge > 600:
+                    self.store.purge()
+                    last_purge = time.time()
+            except Exception:
+                logger.exception("Token revocation sync failed")
+
+    def start(self):
+        if not self.signed:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='token-revocations', daemon=True)
+        self._thread.start()
+        self._pid = os.getpid()
+
+    def stop(self):
+        self._stop.set()
+
+
+tokens = TokenService()
@@ -0,0 +1,234 @@
+# upstream.py
+# Shared HTTP clients for the systems we call out to (Corepoint, Formstack).
+# Each worker process keeps one pooled keep-alive session per upstream instead
+# of opening a fresh connection and TLS handshake for every request.
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils import jsoncodec
+from utils.extensions import cache
+from utils.resilience import CircuitBreaker, Bulkhead, UpstreamUnavailable
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {502, 503, 504}
+LATENCY_WINDOW = 1000  # samples kept for percentile reporting
+
+
+class UpstreamClient:
+    """Pooled HTTP client for one upstream with timeouts and jittered retries.
+
+    Connect failures are always retried because the request never reached the
+    upstream. Read timeouts and 502/503/504 responses are only retried when the
+    caller marks the call idempotent. An optional circuit breaker and bulkhead
+    (utils.resilience) gate each logical call, retries included, the breaker
+    ahead of the bulkhead; refused calls raise UpstreamUnavailable without
+    touching the network.
+    """
+
+    def __init__(self, name, url=None, connect_timeout=3.05, read_timeout=15, pool_size=10,
+                 retries=2, backoff=0.2, backoff_max=2.0, headers=None):
+        self.name = name
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.headers = dict(headers or {})
+        self.breaker = None
+        self.bulkhead = None
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._counts = {'calls': 0, 'errors': 0, 'retries': 0}
+
+    def configure(self, **settings):
+        for key, value in settings.items():
+            if value is not None:
+                setattr(self, key, value)
+        # Drop any session built with the old settings
+        self._session = None
+
+    @property
+    def session(self):
+        # Sessions are per process: a pool inherited across fork would share sockets
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    session.headers.update(self.headers)
+                    self._session = session
+                    self._pid = pid
+        return self._session
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter: spread retries from all workers over the backoff window
+        delay = min(self.backoff_max, self.backoff * (2 ** attempt))
+        time.sleep(random.uniform(0, delay))
+
+    def request(self, method, url=None, idempotent=False, **kwargs):
+        # Breaker first: calls it refuses fail fast instead of queueing for, and
+        # holding, the bulkhead slots a half-open trial needs
+        if self.breaker is not None:
+            self.breaker.allow()
+        try:
+            slot = self.bulkhead.acquire() if self.bulkhead is not None else None
+        except UpstreamUnavailable:
+            if self.breaker is not None:
+                self.breaker.abandon()
+            raise
+        failed = None
+        try:
+            try:
+                response = self._request_with_retries(method, url, idempotent, **kwargs)
+            except requests.RequestException:
+                failed = True
+                raise
+            failed = response.status_code >= 500
+        finally:
+            if slot is not None:
+                self.bulkhead.release(slot)
+            if self.breaker is not None:
+                if failed is None:
+                    # Raised by something other than the upstream (a bug, an interrupt):
+                    # nothing to record, but a half-open trial must not stay in flight
+                    self.breaker.abandon()
+                elif failed:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+        return response
+
+    def _request_with_retries(self, method, url, idempotent, **kwargs):
+        url = url or self.url
+        if kwargs.get('json') is not None:
+            # Encode once with the app codec rather than per attempt with requests' stdlib json
+            kwargs['data'] = jsoncodec.dumpb(kwargs.pop('json'))
+            headers = dict(kwargs.get('headers') or {})
+            if not any(name.lower() == 'content-type' for name in headers):
+                headers['Content-Type'] = 'application/json'
+            kwargs['headers'] = headers
+        kwargs.setdefault('timeout', (self.connect_timeout, self.read_timeout))
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.ConnectionError as e:
+                retryable = isinstance(e, requests.ConnectTimeout) or idempotent
+                self._record(started, error=True)
+                if not retryable or attempt >= self.retries:
+                    raise
+            except requests.Timeout:
+                self._record(started, error=True)
+                if not idempotent or attempt >= self.retries:
+                    raise
+            else:
+                self._record(started, error=response.status_code >= 500)
+                if not (idempotent and response.status_code in RETRYABLE_STATUS and attempt < self.retries):
+                    return response
+            with self._lock:
+                self._counts['retries'] += 1
+            self._sleep_before_retry(attempt)
+            attempt += 1
+
+    def post(self, url=None, idempotent=False, **kwargs):
+        return self.request('POST', url, idempotent=idempotent, **kwargs)
+
+    @staticmethod
+    def decode(response):
+        """Response body as JSON, decoded with the app codec instead of response.json()."""
+        return jsoncodec.loads(response.content)
+
+    def _record(self, started, error=False):
+        elapsed = time.perf_counter() - started
+        metrics.observe(self.name, elapsed)
+        with self._lock:
+            self._latencies.append(elapsed)
+            self._counts['calls'] += 1
+            if error:
+                self._counts['errors'] += 1
+        logger.info("%s call took %.1f ms", self.name, elapsed * 1000)
+
+    def connections_opened(self):
+        # Number of TCP (and TLS) connections this worker has had to open
+        if self._session is None:
+            return 0
+        opened = 0
+        for adapter in set(self._session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    opened += pool.num_connections
+        return opened
+
+    def stats(self):
+        with self._lock:
+            samples = sorted(self._latencies)
+            counts = dict(self._counts)
+        stats = dict(counts, connections_opened=self.connections_opened())
+        if self.breaker is not None:
+            stats['breaker'] = self.breaker.stats()
+        if self.bulkhead is not None:
+            stats['bulkhead'] = self.bulkhead.stats()
+        if samples:
+            stats.update(
+                latency_p50_ms=samples[len(samples) // 2] * 1000,
+                latency_p95_ms=samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+                latency_max_ms=samples[-1] * 1000,
+            )
+        return stats
+
+
+corepoint = UpstreamClient('corepoint')
+formstack = UpstreamClient('formstack')
+
+
+def init_upstreams(app):
+    corepoint.configure(
+        url=app.config.get('CP_API'),
+        connect_timeout=app.config.get('CP_CONNECT_TIMEOUT'),
+        read_timeout=app.config.get('CP_READ_TIMEOUT'),
+        pool_size=app.config.get('CP_POOL_SIZE'),
+        retries=app.config.get('CP_RETRIES'),
+        backoff=app.config.get('CP_RETRY_BACKOFF'),
+    )
+    # Corepoint sits on the patient-facing path, so it gets a breaker and a share cap
+    corepoint.breaker = CircuitBreaker(
+        'corepoint',
+        cache,
+        failure_threshold=app.config.get('CP_BREAKER_FAILURES', 5),
+        recovery_timeout=app.config.get('CP_BREAKER_RECOVERY', 30),
+    )
+    corepoint.bulkhead = Bulkhead(
+        'corepoint',
+        app.config.get('CP_BULKHEAD_LIMIT', 2),
+        app.config.get('BULKHEAD_DIR', '/tmp/sdohapi-bulkhead'),
+        max_wait=app.config.get('CP_BULKHEAD_WAIT', 0.5),
+    )
+    formstack.configure(
+        url=app.config.get('FS_API'),
+        connect_timeout=app.config.get('FS_CONNECT_TIMEOUT'),
+        read_timeout=app.config.get('FS_READ_TIMEOUT'),
+        pool_size=app.config.get('FS_POOL_SIZE'),
+        # Sent on every call from the pooled session (FS_BEAR_TOKEN)
+        headers={'Authorization': f"Bearer {app.config['FS_TOK']}"} if app.config.get('FS_TOK') else None,
+    )
+    if not app.config.get('FS_TOK'):
+        logger.warning("FS_BEAR_TOKEN is not set; Formstack will refuse submissions")
@@ -1,4 +1,8 @@
 import sys
 sys.path.insert(0, "/home/jclutter/sdohapi")
 
-from sdohapi import app as application
+from sdohapi import app as application, start_background_tasks
+
+# Under gunicorn, the post_worker_init hook in gunicorn_config.py starts these in each worker
+if 'gunicorn' not in sys.modules:
+    start_background_tasks()